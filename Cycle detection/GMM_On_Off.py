@@ -8,6 +8,11 @@ input_file_path = '/Users/visshal/Elgo-RKA/REFIT_ELGO/CLEAN_House1_extracted.csv
 df = pd.read_csv(input_file_path)
 X = df[['Fridge']].values
 
+# Model selection only needs a representative sample: fit and score every covariance type on a subsample, then
+# label the whole dataset with the best model.
+sample_size = 100000
+X_sample = X[np.random.default_rng(0).choice(len(X), size=min(len(X), sample_size), replace=False)]
+
 
 covariance_types = ['spherical', 'diag', 'tied', 'full']
 
@@ -17,8 +22,8 @@ lowest_bic = np.inf
 for covariance_type in covariance_types:
     gmm = GaussianMixture(
         n_components=2, covariance_type=covariance_type, random_state=0)
-    gmm.fit(X)
-    bic = gmm.bic(X)
+    gmm.fit(X_sample)
+    bic = gmm.bic(X_sample)
 
     if bic < lowest_bic:
         lowest_bic = bic
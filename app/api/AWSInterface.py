@@ -1,16 +1,40 @@
 import json
-import boto3
+import threading
 from dotenv import load_dotenv
 import os
-from time import time
-import pandas as pd
+from time import time, perf_counter
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from typing import TYPE_CHECKING
+from api import Metrics, StreamDecoder
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from api.TrainingCache import TrainingCache
 
 load_dotenv()
 
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_SESSION_TOKEN = os.getenv("AWS_SESSION_TOKEN")
+STREAM_CHECKPOINT_PATH = os.getenv("STREAM_CHECKPOINT_PATH", "stream_checkpoint.json")
+# Without a stream checkpoint, read the objects already in the stream bucket (true) or only the ones added from now on
+STREAM_REPLAY_HISTORY = os.getenv("STREAM_REPLAY_HISTORY", "false").lower() == "true"
+
+def decode_stream_lines(lines, device_field: str = None, duplicates: str = StreamDecoder.STREAM_DUPLICATES) -> tuple:
+    '''
+    Decode stream records (JSON lines with devicePower and Cur_Timestamp) into columns: timestamps (datetime64[us],
+    UTC), power (float64) and, if device_field is given, the value of that field in every record. device_field may
+    also be a tuple of fields (e.g. house and device), whose values are joined with "/" into one stream key.
+    duplicates - what to do with datapoints with the same timestamp (and device), see StreamDecoder.DUPLICATE_POLICIES.
+    Shared by the S3 stream and the other ingestion sources.
+    '''
+    decoder = StreamDecoder.StreamDecoder(device_field=device_field)
+    decoder.feed(b"\n".join(line.encode() if isinstance(line, str) else line for line in lines) + b"\n")
+    columns, found = StreamDecoder.resolve_duplicates(decoder.finish(), duplicates)
+    Metrics.registry.counter("stream_duplicates_total", "Datapoints with the same timestamp (and device) as another").inc(found)
+    return columns
 
 class AWSInterface:
     '''
@@ -20,20 +44,69 @@ class AWSInterface:
     This will feature the following functionalities:
     1. Read data from S3, given a bucket name and a file name
     2. Read list of files from S3, given a bucket name
+    3. Read every new file in a stream bucket since the last checkpoint
+    4. Read a processed training set through a local on-disk cache
     '''
-    def __init__(self):
+    def __init__(self, checkpoint_path: str = STREAM_CHECKPOINT_PATH, check_connection: bool = True, replay_history: bool = STREAM_REPLAY_HISTORY):
         '''
-        1. Initialize an S3 object
+        1. Start the connectivity check (list_buckets) on a background thread, so it runs while the caller loads the
+           training set. The S3 client (and boto3) is only created when it is first needed, see s3.
+        2. Load the stream checkpoint (last read key per bucket), if one was persisted
+
+        check_connection - set to False to skip the connectivity check, get_status then returns None.
+        replay_history - on a first start (no checkpoint for a stream bucket), read the objects already in the bucket
+           instead of starting after the newest one.
         '''
         print("Connecting to AWS API...")
-        start = time()
-        self.s3 =boto3.client('s3', aws_access_key_id = AWS_ACCESS_KEY_ID, aws_secret_access_key = AWS_SECRET_ACCESS_KEY, aws_session_token=AWS_SESSION_TOKEN) 
-        self.status = self.s3.list_buckets().get("ResponseMetadata", {}).get("HTTPStatusCode")
+        self._s3 = None
+        self._s3_lock = threading.Lock()
+        self.connection = Future()
+        if check_connection:
+            threading.Thread(target=self._check_connection, name="AWSConnectivityCheck", daemon=True).start()
+        else:
+            self.connection.set_result(None)
         self.last_read_stream = datetime.fromisoformat('2000-01-01 00:00:00.001+00:00')
-        print(f"Connection status {self.status}. Finished in {time() - start}")
-    
+        self.checkpoint_path = checkpoint_path
+        self.replay_history = replay_history
+        self.checkpoint = self._load_checkpoint()
+        self.poll_seconds = Metrics.registry.histogram("s3_poll_seconds", "Latency of one stream poll, listing and reading the new objects")
+        self.objects_ingested = Metrics.registry.counter("stream_objects_total", "Stream objects read")
+        self.bytes_ingested = Metrics.registry.counter("stream_bytes_ingested_total", "Bytes of stream objects read")
+        self.duplicates_found = Metrics.registry.counter("stream_duplicates_total", "Datapoints with the same timestamp (and device) as another")
+        self.duplicates = StreamDecoder.STREAM_DUPLICATES
+
+    @property
+    def s3(self):
+        '''
+        The S3 client, created on first use. boto3 is imported here, so processes that never talk to S3 never load it.
+        '''
+        if self._s3 is None:
+            with self._s3_lock:
+                if self._s3 is None:
+                    import boto3
+                    self._s3 = boto3.client('s3', aws_access_key_id = AWS_ACCESS_KEY_ID, aws_secret_access_key = AWS_SECRET_ACCESS_KEY, aws_session_token=AWS_SESSION_TOKEN)
+        return self._s3
+
+    def _check_connection(self) -> None:
+        start = time()
+        try:
+            status = self.s3.list_buckets().get("ResponseMetadata", {}).get("HTTPStatusCode")
+        except Exception as error:
+            print(f"Connection check failed: {error}")
+            self.connection.set_exception(error)
+            return
+        print(f"Connection status {status}. Finished in {time() - start}")
+        self.connection.set_result(status)
+
+    @property
+    def status(self):
+        '''
+        HTTP status of the connectivity check, waiting for it to finish.
+        '''
+        return self.connection.result()
 
-    def get_csv_file(self, bucket_path: str, file_name: str) -> pd.DataFrame | None:
+
+    def get_csv_file(self, bucket_path: str, file_name: str) -> "pd.DataFrame | None":
         '''
         Function to load the content of a csv file. 
         For collective anomalies, this is used to read the training dataset.
@@ -47,39 +120,151 @@ class AWSInterface:
         if status == 200:
             print(f"Successful S3 get_object response. Status - {status}")
             print("Reading CSV from loaded body...")
+            import pandas as pd
             return pd.read_csv(response.get("Body"))
         else:
             print(f"Unsuccessful S3 get_object response. Status - {status}")
             exit(-1)
 
-    def get_latest_in_bucket(self, bucket_path: str) -> list | None:
+    def get_training_frame(self, bucket_path: str, file_name: str, device_mapping: dict, columns: list = None, cache: "TrainingCache" = None) -> "pd.DataFrame":
+        '''
+        Function to load a training set, renamed with device_mapping and with missing values filled with 0.
+        The processed frame is cached on disk, keyed by bucket, key and ETag. The object is requested with
+        If-None-Match, so when it has not changed S3 answers 304 and nothing is downloaded or parsed.
+
+        columns - the processed (renamed) columns to load, e.g. only the selected device. None loads all numeric columns.
+        '''
+        from botocore.exceptions import ClientError
+        from api.TrainingCache import TrainingCache
+        cache = cache if cache is not None else TrainingCache()
+        etag = cache.cached_etag(bucket_path, file_name)
+        params = {"Bucket": bucket_path, "Key": file_name}
+        if etag is not None:
+            params["IfNoneMatch"] = etag
+
+        print(f"Requesting from bucket {bucket_path}/{file_name}")
+        try:
+            response = self.s3.get_object(**params)
+        except ClientError as error:
+            if error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304 or error.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+                print(f"Training set unchanged (ETag {etag}), loading from local cache")
+                return cache.load(bucket_path, file_name, etag, columns=columns)
+            raise
+
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        if status != 200:
+            print(f"Unsuccessful S3 get_object response. Status - {status}")
+            exit(-1)
+
+        print("Reading CSV from loaded body...")
+        import pandas as pd
+        df = pd.read_csv(response.get("Body")).rename(index=str, columns=device_mapping).fillna(0)
+        etag = response.get("ETag")
+        if etag is not None:
+            cache.store(bucket_path, file_name, etag, df)
+        return df if columns is None else df[columns]
+
+    def get_latest_in_bucket(self, bucket_path: str, duplicates: str = StreamDecoder.STREAM_DUPLICATES) -> tuple | None:
         '''
         Function to read all the files in the bucket, and get the content from the latest one. 
         Additionally, the function also detects if the bucket has been read before, and filters it if it has not been returned before. 
+        The object is decoded as it is read (see StreamDecoder.decode_stream_body) into timestamps and power columns.
+        Datapoints with the same timestamp are resolved with the duplicates policy, STREAM_DUPLICATES by default.
+        Returns None if the bucket is empty or its latest object was already returned.
         '''
-        contents = self.s3.list_objects_v2(Bucket = bucket_path).get("Contents")
-
         keys = {}
+        for page in self.s3.get_paginator("list_objects_v2").paginate(Bucket = bucket_path):
+            for obj in page.get("Contents", []):
+                keys[obj.get("Key")] = obj.get("LastModified")
 
-        for obj in contents:
-            keys[obj.get("Key")] = obj.get("LastModified")
-
+        if len(keys) == 0:
+            return None
         latest = max(keys, key=keys.get)
-        print(f"Last updated stream bucket at time {str(keys[latest])}")
         if keys[latest] <= self.last_read_stream:
-            return []
+            return None
         self.last_read_stream = keys[latest]
         response = self.s3.get_object(Bucket=bucket_path, Key=latest)
-        data = response.get("Body").readlines()
-        
-        power_data = {}
-        for line in data:
-            buffer = json.loads(line)
-            power = buffer.get("devicePower")
-            time = datetime.fromisoformat(buffer.get("Cur_Timestamp"))
-            power_data[time] = power
-        print(f"Power Data:\n{power_data} ")
-        return power_data
+        return StreamDecoder.decode_stream_body(response.get("Body"), duplicates=duplicates)
+
+    def get_new_in_bucket(self, bucket_path: str, max_workers: int = 8, device_field: str = None) -> tuple:
+        '''
+        Function to read every object added to the bucket since the last checkpoint, oldest first.
+
+        Stream objects are written with time ordered keys, so listing with StartAfter=<last read key> returns only
+        the new objects. The listing is paginated, so more than 1000 new objects are not silently dropped.
+        The new objects are downloaded concurrently on a bounded thread pool and decoded into two columns:
+        timestamps (datetime64[us], UTC) and power (float64). Objects are decoded as they are downloaded, and may be
+        gzip compressed. Datapoints with the same timestamp (and device) are resolved with the STREAM_DUPLICATES policy.
+        If device_field is given, a third column with the value of that field in every record (the device the
+        datapoint belongs to) is returned as well.
+        The checkpoint is persisted after every successful read, so a restart resumes without re-reading history.
+        Without a checkpoint for the bucket, the stream starts after its newest object (nothing is returned), so a
+        fresh deployment does not score, and send anomalies for, old data; unless replay_history is set. An empty
+        bucket is checkpointed as "" (before any key), so the first objects written to it are read.
+        '''
+        start = perf_counter()
+        params = {"Bucket": bucket_path}
+        last_key = self.checkpoint.get(bucket_path)
+        if last_key:
+            params["StartAfter"] = last_key
+
+        keys = []
+        for page in self.s3.get_paginator("list_objects_v2").paginate(**params):
+            keys += [obj.get("Key") for obj in page.get("Contents", [])]
+
+        if last_key is None and not self.replay_history:
+            self.checkpoint[bucket_path] = max(keys) if keys else ""
+            self._save_checkpoint()
+            print(f"No checkpoint for {bucket_path}, starting after its newest object {self.checkpoint[bucket_path] or '(none)'} (set STREAM_REPLAY_HISTORY=true to read the {len(keys)} existing objects)")
+            keys = []
+
+        if len(keys) == 0:
+            self.poll_seconds.observe(perf_counter() - start)
+            empty = (np.empty(0, dtype="datetime64[us]"), np.empty(0, dtype=float))
+            return empty if device_field is None else empty + (np.empty(0, dtype=object),)
+
+        keys.sort()
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+            columns = list(executor.map(lambda key: self._read_stream_object(bucket_path, key, device_field), keys))
+
+        timestamps = np.concatenate([column[0] for column in columns])
+        order = np.argsort(timestamps, kind="stable")
+        columns = tuple(np.concatenate([column[index] for column in columns])[order] for index in range(len(columns[0])))
+        columns, found = StreamDecoder.resolve_duplicates(columns, self.duplicates)
+
+        self.checkpoint[bucket_path] = keys[-1]
+        self._save_checkpoint()
+        self.objects_ingested.inc(len(keys))
+        self.duplicates_found.inc(found)
+        self.poll_seconds.observe(perf_counter() - start)
+        return columns
+
+    def _read_stream_object(self, bucket_path: str, key: str, device_field: str = None) -> tuple:
+        '''
+        Function to decode one stream object (JSON lines with devicePower and Cur_Timestamp, optionally gzip
+        compressed) into columns, as it is downloaded. Duplicates are resolved (and counted) once every new object is
+        read, see get_new_in_bucket.
+        '''
+        response = self.s3.get_object(Bucket=bucket_path, Key=key)
+        self.bytes_ingested.inc(response.get("ContentLength", 0))
+        return StreamDecoder.decode_stream_body(response.get("Body"), device_field=device_field, duplicates="keep", count=False)
+
+    def _load_checkpoint(self) -> dict:
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path) as checkpoint_file:
+            return json.load(checkpoint_file)
+
+    def _save_checkpoint(self) -> None:
+        '''
+        Write the checkpoint to a temporary file first, so a crash never leaves a half written checkpoint.
+        '''
+        if self.checkpoint_path is None:
+            return
+        temporary_path = f"{self.checkpoint_path}.tmp"
+        with open(temporary_path, "w") as checkpoint_file:
+            json.dump(self.checkpoint, checkpoint_file)
+        os.replace(temporary_path, self.checkpoint_path)
 
     def write_to_bucket(self, bucket_name: str, target_directory: str, body) -> None:
         print("Writing data to S3 bucket", bucket_name)
@@ -92,5 +277,15 @@ class AWSInterface:
         else:
             print(f"Unsuccessful S3 put_object response. Status - {status}")
 
+    def upload_to_bucket(self, bucket_name: str, target_directory: str, fileobj) -> None:
+        '''
+        Function to stream a file object to S3. Large files are sent as a multipart upload, so the body is never
+        held in memory as a whole.
+        '''
+        print("Uploading data to S3 bucket", bucket_name)
+        start = time()
+        self.s3.upload_fileobj(fileobj, bucket_name, target_directory)
+        print(f"Uploaded {target_directory}. Finished in {time() - start}")
+
     def get_status(self):
         return self.status
\ No newline at end of file
@@ -0,0 +1,297 @@
+import heapq
+import json
+import logging
+import os
+import random
+import threading
+import queue
+import uuid
+from time import sleep, time
+from api import Metrics
+
+ANOMALY_SPOOL_PATH = os.getenv("ANOMALY_SPOOL_PATH", "anomaly_spool.jsonl")
+logger = logging.getLogger(__name__)
+
+SPOOL_COMPACT_RECORDS = 10000 # Spool records (payloads and acknowledgements) before it is compacted while running
+SPOOL_COMPACT_RATIO = 0.5 # Fraction of the spool records that must be acknowledged payloads or their acknowledgements
+
+def read_spool(path: str) -> dict:
+    '''
+    The payloads of a spool that were never acknowledged, by id.
+    '''
+    pending = {}
+    with open(path) as spool:
+        for line in spool:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # A torn write from a crash, the payload was never acknowledged as queued
+            if "ack" in record:
+                pending.pop(record["ack"], None)
+            else:
+                pending[record["id"]] = record
+    return pending
+
+class AnomalyDispatcher:
+    '''
+    This class delivers anomaly notifications to the user backend without blocking the detection loop.
+
+    send() only puts the payload on a queue. A background thread drains the queue in batches, writes the new payloads
+    of every batch to an on-disk spool with a single fsync, and posts them over a pooled keep-alive session, retrying
+    failures with exponential backoff. The detection loop never waits on the disk or the network.
+    A payload is acknowledged in the spool once it is delivered (or rejected by the backend with a 4xx), so
+    anything still undelivered when the process stops is delivered again after a restart. A payload still failing
+    after its retries is put back on the queue later, after a delay that doubles every time (up to
+    max_requeue_delay), and the spool is compacted to the unacknowledged payloads whenever most of it is acknowledged.
+
+    url - endpoint that accepts a single Anomaly.dict() payload.
+    batch_url - optional endpoint that accepts a JSON list of payloads. When set, each batch is one request.
+    '''
+    def __init__(self, url: str, batch_url: str = None, batch_size: int = 32, max_retries: int = 5, backoff: float = 0.5, timeout: float = 5.0, pool_size: int = 4, spool_path: str = ANOMALY_SPOOL_PATH, requeue_delay: float = 5.0, max_requeue_delay: float = 300.0):
+        self.url = url
+        self.batch_url = batch_url
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.requeue_delay = requeue_delay
+        self.max_requeue_delay = max_requeue_delay
+        self.timeout = timeout
+        self.spool_path = spool_path
+        self.pool_size = pool_size
+        self.session = None # Created by the delivery thread on its first request, see _connect
+
+        self.queue = queue.Queue()
+        self.delivered = 0
+        self.failed = 0
+        self.requeued = 0
+        self.latencies = [] # Seconds from send() to successful delivery
+        self._delayed = [] # Heap of (due time, sequence, item, requeues) of the payloads waiting to be queued again
+        self._sequence = 0
+        self.delivery_seconds = Metrics.registry.histogram("anomaly_delivery_seconds", "Time from queueing an anomaly to its delivery")
+        self.post_seconds = Metrics.registry.histogram("anomaly_post_seconds", "Latency of one request to the backend")
+        self.delivery_failures = Metrics.registry.counter("anomaly_delivery_failures_total", "Anomalies not delivered after all retries, or rejected")
+        self.post_retries = Metrics.registry.counter("anomaly_post_retries_total", "Requests to the backend that failed and were retried or given up")
+        self._spool_lock = threading.Lock()
+        self._pending = {} # Spooled and not yet acknowledged payloads, by id
+        self._spool_records = 0 # Records in the spool file
+        self._stopping = threading.Event()
+
+        for entry in self._recover_spool():
+            self.queue.put((entry, time(), 0))
+        self._worker = threading.Thread(target=self._run, name="AnomalyDispatcher", daemon=True)
+        self._worker.start()
+
+    def send(self, payload: dict) -> None:
+        '''
+        Queue the payload for delivery. Returns immediately: it is spooled by the delivery thread.
+        '''
+        self.queue.put(({"id": uuid.uuid4().hex, "payload": payload}, time(), 0))
+
+    def close(self, timeout: float = 10.0) -> None:
+        '''
+        Wait up to timeout seconds for the queue to drain, then stop the worker. Undelivered payloads (including the
+        ones waiting to be queued again, and the ones still queued) stay spooled.
+        '''
+        deadline = time() + timeout
+        while self.queue.unfinished_tasks and time() < deadline:
+            sleep(0.01)
+        self._stopping.set()
+        self._worker.join(timeout=max(deadline - time(), 0.1))
+        leftover = []
+        while True:
+            try:
+                leftover.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        self._spool_new(leftover)
+        if self.session is not None:
+            self.session.close()
+
+    def adopt(self, path: str) -> int:
+        '''
+        Take over the undelivered payloads of another spool (of a dispatcher that is stopped for good): they are
+        synced to this spool, then the other spool is deleted and they are queued for delivery.
+        Returns the number of payloads taken over.
+        '''
+        if not os.path.exists(path):
+            return 0
+        records = [record for record in read_spool(path).values() if record["id"] not in self._pending]
+        self._append_spool(records)
+        os.remove(path)
+        for entry in records:
+            self.queue.put((entry, time(), 0))
+        return len(records)
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        percentile = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] if latencies else None
+        return {"delivered": self.delivered, "failed": self.failed, "pending": self.queue.qsize() + len(self._delayed), "requeued": self.requeued, "latency_p50": percentile(0.5), "latency_p99": percentile(0.99)}
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._requeue_due()
+            try:
+                batch = [self.queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._spool_new(batch)
+                self._deliver(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _deliver(self, batch: list) -> None:
+        if self.batch_url is not None:
+            if self._post(self.batch_url, [entry["payload"] for entry, _, _ in batch]):
+                self._acknowledge(batch)
+            else:
+                self._requeue_later(batch)
+            return
+        for item in batch:
+            if self._post(self.url, item[0]["payload"]):
+                self._acknowledge([item])
+            else:
+                self._requeue_later([item])
+
+    def _requeue_later(self, batch: list) -> None:
+        '''
+        Keep payloads that could not be delivered after all retries aside, to be queued again after requeue_delay
+        seconds, doubled every time the same payload fails again, up to max_requeue_delay.
+        '''
+        for entry, enqueued, requeues in batch:
+            delay = min(self.requeue_delay * (2 ** requeues), self.max_requeue_delay)
+            heapq.heappush(self._delayed, (time() + delay, self._sequence, (entry, enqueued), requeues + 1))
+            self._sequence += 1
+            self.requeued += 1
+
+    def _requeue_due(self) -> None:
+        '''
+        Put the payloads whose requeue delay has passed back on the queue. Only called from the delivery thread.
+        '''
+        now = time()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, (entry, enqueued), requeues = heapq.heappop(self._delayed)
+            self.queue.put((entry, enqueued, requeues))
+
+    def _post(self, url: str, body) -> bool:
+        '''
+        Post with bounded retries. Returns True when the payload should be acknowledged (delivered or rejected as
+        invalid), False when it should stay spooled.
+        '''
+        import requests
+        if self.session is None:
+            self.session = self._connect()
+        for attempt in range(self.max_retries + 1):
+            try:
+                start = time()
+                res = self.session.post(url, json=body, timeout=self.timeout)
+                self.post_seconds.observe(time() - start)
+                if res.status_code < 300:
+                    return True
+                if 400 <= res.status_code < 500 and res.status_code != 429:
+                    logger.warning("Backend rejected anomaly notification. Status: %s.\n%s", res.status_code, res.text)
+                    self.failed += 1
+                    self.delivery_failures.inc()
+                    return True
+                logger.debug("Failed to post request to backend user server. Status: %s.", res.status_code)
+            except requests.RequestException as error:
+                logger.debug("Failed to post request to backend user server. %s", error)
+            self.post_retries.inc()
+            if attempt < self.max_retries and not self._stopping.is_set():
+                sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+        self.failed += 1
+        self.delivery_failures.inc()
+        logger.debug("Anomaly notification not delivered after %d attempts, queued again later", self.max_retries + 1)
+        return False
+
+    def _connect(self):
+        '''
+        A pooled keep-alive session. requests is only imported once there is something to deliver, not at startup.
+        '''
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.headers.update({"Content-Type": "application/json", "Accept": "*/*"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _acknowledge(self, batch: list) -> None:
+        now = time()
+        self._append_spool([{"ack": entry["id"]} for entry, _, _ in batch], sync=False)
+        for entry, enqueued, _ in batch:
+            self.latencies.append(now - enqueued)
+            self.delivery_seconds.observe(now - enqueued)
+            self.delivered += 1
+        self._compact_spool()
+
+    def _spool_new(self, batch: list) -> None:
+        '''
+        Spool the payloads of a batch that are not spooled yet (the ones recovered or queued again already are).
+        '''
+        self._append_spool([entry for entry, _, _ in batch if entry["id"] not in self._pending])
+
+    def _append_spool(self, records: list, sync: bool = True) -> None:
+        '''
+        Append records to the spool with one write and, if sync, one fsync.
+        Acknowledgements are not synced: losing one only means the payload is delivered again after a restart.
+        '''
+        if self.spool_path is None or not records:
+            return
+        with self._spool_lock, open(self.spool_path, "a") as spool:
+            for record in records:
+                if "ack" in record:
+                    self._pending.pop(record["ack"], None)
+                else:
+                    self._pending[record["id"]] = record
+            spool.write("".join(json.dumps(record) + "\n" for record in records))
+            self._spool_records += len(records)
+            if sync:
+                spool.flush()
+                os.fsync(spool.fileno())
+
+    def _compact_spool(self) -> None:
+        '''
+        Rewrite the spool with only the unacknowledged payloads once it has SPOOL_COMPACT_RECORDS records, at least
+        SPOOL_COMPACT_RATIO of which are acknowledged payloads and their acknowledgements, so the spool of a long
+        running service does not grow without bound.
+        '''
+        if self.spool_path is None:
+            return
+        with self._spool_lock:
+            if self._spool_records < SPOOL_COMPACT_RECORDS or len(self._pending) > self._spool_records * (1 - SPOOL_COMPACT_RATIO):
+                return
+            self._rewrite_spool()
+
+    def _rewrite_spool(self) -> None:
+        '''
+        Replace the spool with the unacknowledged payloads, atomically. Called with the spool lock held.
+        '''
+        with open(f"{self.spool_path}.tmp", "w") as spool:
+            for record in self._pending.values():
+                spool.write(json.dumps(record) + "\n")
+            spool.flush()
+            os.fsync(spool.fileno())
+        os.replace(f"{self.spool_path}.tmp", self.spool_path)
+        self._spool_records = len(self._pending)
+
+    def _recover_spool(self) -> list:
+        '''
+        Read back the payloads that were spooled but never acknowledged, and compact the spool to only those.
+        '''
+        if self.spool_path is None or not os.path.exists(self.spool_path):
+            return []
+        pending = read_spool(self.spool_path)
+        with self._spool_lock:
+            self._pending = pending
+            self._rewrite_spool()
+        if pending:
+            print(f"Recovered {len(pending)} undelivered anomalies from {self.spool_path}")
+        return list(pending.values())
@@ -0,0 +1,188 @@
+import os
+import threading
+from bisect import bisect_left
+from time import perf_counter, sleep
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+METRICS_TRACING = os.getenv("METRICS_TRACING", "false").lower() == "true" # Per stage timing spans
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+class Counter:
+    '''
+    Updated from several threads (e.g. the S3 download pool and the anomaly delivery thread), so every update holds
+    the lock of the metric.
+    '''
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        bucket = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> tuple:
+        '''
+        Consistent copy of the bucket counts, sum and count.
+        '''
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+class Span:
+    '''
+    Times a block of code into a histogram.
+    '''
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(perf_counter() - self.start)
+
+class NullMetric:
+    '''
+    Stand-in for every metric (and span) while metrics are disabled, so instrumented code costs one no-op call.
+    '''
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+NULL_METRIC = NullMetric()
+
+class Registry:
+    '''
+    Collection of counters and histograms, rendered in the Prometheus text format.
+
+    Metrics are created with counter() and histogram() (optionally with labels) when a component is initialized,
+    so enable() has to be called before the components are created. While disabled, the NullMetric is handed out.
+    The metrics can be exposed on an HTTP endpoint with serve(), or periodically written to a file with
+    export_to_file().
+    '''
+    def __init__(self, enabled: bool = METRICS_ENABLED, tracing: bool = METRICS_TRACING):
+        self.enabled = enabled
+        self.tracing = tracing
+        self._metrics = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def enable(self, tracing: bool = False) -> None:
+        self.enabled = True
+        self.tracing = tracing
+
+    def _get(self, kind: str, name: str, help: str, labels: dict, factory):
+        if not self.enabled:
+            return NULL_METRIC
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._metrics:
+                self._metrics[key] = factory()
+                self._help[name] = (kind, help)
+            return self._metrics[key]
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        return self._get("counter", name, help, labels, Counter)
+
+    def histogram(self, name: str, help: str = "", buckets: tuple = LATENCY_BUCKETS, **labels) -> Histogram:
+        return self._get("histogram", name, help, labels, lambda: Histogram(buckets))
+
+    def span(self, stage: str, **labels):
+        '''
+        Timing span for one stage of the pipeline, only recorded when tracing is enabled.
+        Usage: with registry.span("classify"): ...
+        '''
+        if not (self.enabled and self.tracing):
+            return NULL_METRIC
+        return Span(self.histogram("stage_seconds", "Time spent in each pipeline stage", stage=stage, **labels))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.items(), key=lambda item: item[0])
+        lines = []
+        described = set()
+        for (name, labels), metric in metrics:
+            if name not in described:
+                kind, help = self._help[name]
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                described.add(name)
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+            if isinstance(metric, Counter):
+                lines.append(f"{name}{{{label_text}}} {metric.value}" if label_text else f"{name} {metric.value}")
+                continue
+            counts, total, count = metric.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(metric.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{{{label_text + ',' if label_text else ''}{le}}} {cumulative}")
+            suffix = f"{{{label_text}}}" if label_text else ""
+            lines += [f"{name}_sum{suffix} {total}", f"{name}_count{suffix} {count}"]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        '''
+        Expose the metrics on http://host:port/metrics from a background thread.
+        '''
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+        print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+    def export_to_file(self, path: str, interval: float = 15.0) -> threading.Thread:
+        '''
+        Write the metrics to a file every interval seconds from a background thread (e.g. for a node exporter
+        textfile collector). The file is replaced atomically.
+        '''
+        def export():
+            while True:
+                sleep(interval)
+                with open(f"{path}.tmp", "w") as metrics_file:
+                    metrics_file.write(self.render())
+                os.replace(f"{path}.tmp", path)
+
+        thread = threading.Thread(target=export, name="MetricsExporter", daemon=True)
+        thread.start()
+        return thread
+
+# Registry shared by every component of the process.
+registry = Registry()
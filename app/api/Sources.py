@@ -0,0 +1,202 @@
+import asyncio
+import glob
+import os
+from time import perf_counter
+import numpy as np
+from api.AWSInterface import decode_stream_lines
+
+try:
+    from watchfiles import awatch
+except ImportError: # Fall back to polling the directory
+    awatch = None
+
+def empty_columns(device_field: str = None) -> tuple:
+    columns = (np.empty(0, dtype="datetime64[us]"), np.empty(0, dtype=float))
+    return columns if device_field is None else columns + (np.empty(0, dtype=object),)
+
+class Source:
+    '''
+    Base class of the stream ingestion sources the Orchestrator consumes.
+
+    A source implements:
+    - receive(): return every datapoint available right now as columns (timestamps, power[, devices]),
+      without waiting. This is what Orchestrator.receive calls.
+    - wait(idle): wait until new datapoints may be available. idle tells whether the last receive() was empty.
+
+    batches() turns these into an async stream of (columns, arrival time) that yields as soon as data arrives.
+    Finite sources set exhausted once everything has been received, which ends the stream.
+    '''
+    name = "source"
+    blocking = False # True if receive() does blocking I/O and has to run on a worker thread
+    exhausted = False
+
+    def __init__(self, device_field: str = None):
+        self.device_field = device_field
+
+    def receive(self) -> tuple:
+        raise NotImplementedError
+
+    async def start(self) -> None:
+        pass
+
+    async def wait(self, idle: bool) -> None:
+        raise NotImplementedError
+
+    async def batches(self):
+        await self.start()
+        while not self.exhausted:
+            columns = await asyncio.to_thread(self.receive) if self.blocking else self.receive()
+            if len(columns[1]):
+                yield columns, perf_counter()
+            await self.wait(idle=len(columns[1]) == 0)
+
+class S3PollingSource(Source):
+    '''
+    Polls the S3 stream bucket (AWSInterface.get_new_in_bucket) with an adaptive interval: it polls again after
+    min_interval while data is flowing, and backs off exponentially up to max_interval while the bucket is idle.
+    '''
+    name = "s3"
+    blocking = True
+
+    def __init__(self, aws_api, bucket_path: str, device_field: str = None, min_interval: float = 0.5, max_interval: float = 10.0, backoff: float = 2.0):
+        super().__init__(device_field=device_field)
+        self.aws_api = aws_api
+        self.bucket_path = bucket_path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+
+    def receive(self) -> tuple:
+        if self.device_field is None:
+            return self.aws_api.get_new_in_bucket(bucket_path=self.bucket_path)
+        return self.aws_api.get_new_in_bucket(bucket_path=self.bucket_path, device_field=self.device_field)
+
+    async def wait(self, idle: bool) -> None:
+        self.interval = min(self.interval * self.backoff, self.max_interval) if idle else self.min_interval
+        await asyncio.sleep(self.interval)
+
+class DirectorySource(Source):
+    '''
+    Watches a local directory of JSON lines files (e.g. a mounted or synced stream directory) and tails them:
+    new files and lines appended to existing files are read as soon as they are complete. Uses filesystem
+    notifications (watchfiles) when available, otherwise polls every poll_interval seconds.
+    '''
+    name = "directory"
+
+    def __init__(self, path: str, pattern: str = "*.json*", device_field: str = None, poll_interval: float = 0.5):
+        super().__init__(device_field=device_field)
+        self.path = path
+        self.pattern = pattern
+        self.poll_interval = poll_interval
+        self.offsets = {} # Bytes already read from each file
+        self._changes = None
+
+    def receive(self) -> tuple:
+        lines = []
+        for file_path in sorted(glob.glob(os.path.join(self.path, self.pattern))):
+            offset = self.offsets.get(file_path, 0)
+            if os.path.getsize(file_path) <= offset:
+                continue
+            with open(file_path, "rb") as stream_file:
+                stream_file.seek(offset)
+                data = stream_file.read()
+            complete = data.rfind(b"\n") + 1 # Leave a partially written last line for the next read
+            if complete == 0:
+                continue
+            lines += data[:complete].splitlines()
+            self.offsets[file_path] = offset + complete
+        if not lines:
+            return empty_columns(self.device_field)
+        return decode_stream_lines(lines, device_field=self.device_field)
+
+    async def start(self) -> None:
+        if awatch is not None:
+            self._changes = awatch(self.path, rust_timeout=int(self.poll_interval * 1000), yield_on_timeout=True)
+
+    async def wait(self, idle: bool) -> None:
+        if self._changes is None:
+            await asyncio.sleep(self.poll_interval)
+            return
+        await self._changes.__anext__()
+
+class SocketSource(Source):
+    '''
+    Push source: producers connect to a local TCP port (or a unix socket if path is given) and write stream records
+    as JSON lines. Records are decoded as soon as their line is complete and handed to the scoring loop, without
+    any polling.
+    '''
+    name = "socket"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, path: str = None, device_field: str = None):
+        super().__init__(device_field=device_field)
+        self.host = host
+        self.port = port
+        self.path = path
+        self.server = None
+        self._lines = []
+        self._arrived = None
+
+    def receive(self) -> tuple:
+        lines, self._lines = self._lines, []
+        if not lines:
+            return empty_columns(self.device_field)
+        return decode_stream_lines(lines, device_field=self.device_field)
+
+    async def start(self) -> None:
+        self._arrived = asyncio.Event()
+        if self.path is not None:
+            self.server = await asyncio.start_unix_server(self._handle, path=self.path)
+        else:
+            self.server = await asyncio.start_server(self._handle, host=self.host, port=self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                self._lines.append(line)
+                self._arrived.set()
+        finally:
+            writer.close()
+
+    async def wait(self, idle: bool) -> None:
+        if self._lines:
+            await asyncio.sleep(0) # Let the connection handlers run, then take everything that is queued
+            return
+        self._arrived.clear()
+        await self._arrived.wait()
+
+class CSVSource(Source):
+    '''
+    Replays one appliance column of a recorded REFIT style CSV, chunksize rows per receive(), e.g. for the offline
+    backfill. The file is streamed, so it never has to fit in memory. Missing power readings are filled with 0, as
+    in the training set.
+
+    time_column - Unix timestamps in seconds (REFIT's "Unix" column), or date strings (REFIT's "Time" column, UTC).
+    '''
+    name = "csv"
+    blocking = True
+
+    def __init__(self, path: str, column: str, time_column: str = "Unix", chunksize: int = 100000):
+        super().__init__()
+        self.path = path
+        self.column = column
+        self.time_column = time_column
+        import pandas as pd # Only the CSV source needs pandas
+        self.reader = pd.read_csv(path, usecols=[time_column, column], chunksize=chunksize)
+
+    def receive(self) -> tuple:
+        chunk = next(self.reader, None)
+        if chunk is None:
+            self.exhausted = True
+            return empty_columns()
+        times = chunk[self.time_column]
+        import pandas as pd
+        if pd.api.types.is_numeric_dtype(times):
+            timestamps = (times.to_numpy(dtype=np.int64) * 1000000).astype("datetime64[us]")
+        else:
+            timestamps = pd.to_datetime(times, utc=True).dt.tz_localize(None).to_numpy().astype("datetime64[us]")
+        return timestamps, chunk[self.column].fillna(0).to_numpy(dtype=float)
+
+    async def wait(self, idle: bool) -> None:
+        await asyncio.sleep(0)
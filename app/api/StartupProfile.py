@@ -0,0 +1,42 @@
+import sys
+from time import perf_counter
+
+# Dependencies worth knowing about when they are imported during startup
+HEAVY_MODULES = ("boto3", "botocore", "pandas", "sklearn", "scipy", "requests", "dotenv")
+
+class StartupProfile:
+    '''
+    Time spent in every stage of the startup of the service (imports, connecting, loading the training set, training
+    or loading the models...), and the heavy dependencies each stage imported.
+
+    A stage ends when it is marked: mark(name) records the time since the previous mark (or since this module was
+    imported) under name. Marking is a perf_counter call and a scan of sys.modules, so stages are always recorded and
+    only reported with main.py --profile-startup.
+    '''
+    def __init__(self) -> None:
+        self.stages = []
+        self.start = perf_counter()
+        self._last = self.start
+        self._modules = set(sys.modules)
+
+    def mark(self, name: str) -> float:
+        '''
+        End the current stage under name. Returns its duration in seconds.
+        '''
+        now = perf_counter()
+        seconds = now - self._last
+        modules = set(sys.modules)
+        imported = sorted(module for module in modules - self._modules if module in HEAVY_MODULES)
+        self.stages.append({"stage": name, "seconds": seconds, "modules": len(modules - self._modules), "imported": imported})
+        self._last = now
+        self._modules = modules
+        return seconds
+
+    def report(self) -> str:
+        lines = [f"{'stage':40s} {'seconds':>8s} {'modules':>8s}  heavy imports"]
+        for stage in self.stages:
+            lines.append(f"{stage['stage']:40s} {stage['seconds']:8.3f} {stage['modules']:8d}  {', '.join(stage['imported'])}")
+        lines.append(f"{'total':40s} {self._last - self.start:8.3f} {len(sys.modules):8d}")
+        return "\n".join(lines)
+
+startup = StartupProfile()
@@ -0,0 +1,267 @@
+import json
+import os
+import re
+import zlib
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from api import Metrics
+
+TIMESTAMP_FIELD = "Cur_Timestamp"
+POWER_FIELD = "devicePower"
+READ_SIZE = 1 << 20 # Bytes read from a stream object at a time
+# What to do with datapoints of the same device that have the same timestamp (e.g. an object uploaded twice):
+# "keep" all of them, keep the "first" or the "last" one, or replace them by their "mean".
+DUPLICATE_POLICIES = ("keep", "first", "last", "mean")
+STREAM_DUPLICATES = os.getenv("STREAM_DUPLICATES", "keep")
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+BLANK_LINE = re.compile(rb"\n[ \t\r]*\n")
+BLANK_LINES = re.compile(rb"^[ \t\r]*$\n?", re.MULTILINE)
+# Layout of the date and time part of an ISO 8601 timestamp, e.g. 2024-01-01T12:00:00
+DATE_SEPARATORS = {4: b"-", 7: b"-", 13: b":", 16: b":"}
+DATE_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+
+def field_pattern(field: str, string: bool) -> re.Pattern:
+    '''
+    Regular expression capturing the value of a field of a JSON record: a string without escapes, or a number.
+    '''
+    value = rb'"([^"\\]*)"' if string else rb'(-?[0-9][0-9.eE+-]*|null|NaN)'
+    return re.compile(re.escape(json.dumps(field).encode()) + rb'\s*:\s*' + value)
+
+def records(block: bytes) -> int:
+    '''
+    Number of non blank lines in a block of JSON lines. Blank lines are rare, so they are only counted when there may
+    be one.
+    '''
+    if not block:
+        return 0
+    count = block.count(b"\n") + (0 if block.endswith(b"\n") else 1)
+    tail = block[block.rfind(b"\n") + 1:]
+    if block[:1].isspace() or BLANK_LINE.search(block) or (tail and tail.isspace()):
+        count -= len(BLANK_LINES.findall(block)) - (1 if block.endswith(b"\n") else 0)
+    return count
+
+def parse_timestamp(value) -> int:
+    '''
+    One ISO 8601 timestamp to microseconds since the epoch. Timestamps without an offset are in UTC.
+    '''
+    timestamp = datetime.fromisoformat(value.decode() if isinstance(value, bytes) else value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+def parse_timestamps(values) -> np.ndarray:
+    '''
+    ISO 8601 timestamps (bytes) to microseconds since the epoch (int64), vectorized.
+
+    Timestamps of the same length almost always share a layout (e.g. 2024-01-01T12:00:00.123456+00:00), so they are
+    parsed together as a matrix of characters: every field is read from fixed columns of digits. A group that does
+    not match the layout of its first timestamp is parsed one by one with datetime.fromisoformat instead.
+    '''
+    values = np.asarray(values, dtype=bytes)
+    parsed = np.empty(len(values), dtype=np.int64)
+    lengths = np.char.str_len(values)
+    for width in np.unique(lengths):
+        rows = np.flatnonzero(lengths == width)
+        group = parse_fixed_width(values[rows], int(width))
+        parsed[rows] = group if group is not None else [parse_timestamp(value) for value in values[rows]]
+    return parsed
+
+def parse_fixed_width(values: np.ndarray, width: int) -> np.ndarray | None:
+    '''
+    Timestamps of the same width and layout to microseconds since the epoch, or None if they do not share one.
+    '''
+    if width < 19:
+        return None
+    characters = values.astype(f"S{width}").view(np.uint8).reshape(len(values), width)
+    first = characters[0].tobytes()
+    if any(first[position:position + 1] != separator for position, separator in DATE_SEPARATORS.items()) or first[10:11] not in (b"T", b" "):
+        return None
+    tail = first[19:]
+    offset_width = 1 if tail.endswith(b"Z") else 6 if len(tail) >= 6 and tail[-6:-5] in (b"+", b"-") and tail[-3:-2] == b":" else 0
+    fraction = tail[:len(tail) - offset_width]
+    if fraction and (fraction[:1] != b"." or len(fraction) == 1 or not fraction[1:].isdigit()):
+        return None
+
+    # Every timestamp must have the digits and separators of the first one in the same columns.
+    digit_columns = DATE_DIGITS + list(range(20, 19 + len(fraction)))
+    if offset_width == 6:
+        digit_columns += [width - 5, width - 4, width - 2, width - 1]
+    digits = characters[:, digit_columns].astype(np.int64) - 48
+    fixed_columns = np.setdiff1d(np.arange(width), digit_columns + ([width - 6] if offset_width == 6 else []))
+    if ((digits < 0) | (digits > 9)).any() or (characters[:, fixed_columns] != characters[0, fixed_columns]).any():
+        return None
+    if offset_width == 6 and not np.isin(characters[:, width - 6], list(b"+-")).all():
+        return None
+
+    number = lambda columns: digits[:, columns] @ (10 ** np.arange(len(columns) - 1, -1, -1))
+    year, month, day = number([0, 1, 2, 3]), number([4, 5]), number([6, 7])
+    hour, minute, second = number([8, 9]), number([10, 11]), number([12, 13])
+    month_start = (year - 1970).astype("datetime64[Y]") + (month - 1).astype("timedelta64[M]")
+    days_in_month = ((month_start + 1).astype("datetime64[D]") - month_start.astype("datetime64[D]")).astype(np.int64)
+    if ((month < 1) | (month > 12) | (day < 1) | (day > days_in_month) | (hour > 23) | (minute > 59) | (second > 59)).any():
+        return None # Let datetime.fromisoformat report the invalid timestamp
+    microseconds = np.zeros(len(values), dtype=np.int64)
+    if fraction:
+        kept = min(len(fraction) - 1, 6) # Digits below a microsecond are truncated, like datetime.fromisoformat
+        microseconds = number(list(range(14, 14 + kept))) * 10 ** (6 - kept)
+    days = month_start.astype("datetime64[D]").astype(np.int64) + day - 1
+    parsed = (days * 86400 + hour * 3600 + minute * 60 + second) * 1000000 + microseconds
+    if offset_width == 6:
+        sign = np.where(characters[:, width - 6] == ord("-"), -1, 1)
+        parsed -= sign * (number([-4, -3]) * 60 + number([-2, -1])) * 60000000
+    return parsed
+
+def resolve_duplicates(columns: tuple, policy: str = STREAM_DUPLICATES) -> tuple:
+    '''
+    Apply a duplicate policy (see DUPLICATE_POLICIES) to decoded columns (timestamps, power[, devices]): datapoints
+    are duplicates when they have the same timestamp (and device). The order of the kept datapoints is unchanged.
+    Returns the columns and the number of duplicates found.
+    '''
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError(f"Unknown duplicate policy {policy}, use one of {DUPLICATE_POLICIES}")
+    timestamps, power = columns[0], columns[1]
+    if len(timestamps) < 2:
+        return columns, 0
+    if len(columns) > 2:
+        devices = np.unique(np.asarray(columns[2]).astype(str), return_inverse=True)[1]
+        order = np.lexsort((timestamps, devices))
+        same = (timestamps[order][1:] == timestamps[order][:-1]) & (devices[order][1:] == devices[order][:-1])
+    else:
+        order = np.argsort(timestamps, kind="stable")
+        same = timestamps[order][1:] == timestamps[order][:-1]
+    duplicates = int(np.count_nonzero(same))
+    if duplicates == 0 or policy == "keep":
+        return columns, duplicates
+
+    starts = np.flatnonzero(np.concatenate(([True], ~same))) # First datapoint of every run of equal keys
+    if policy == "last":
+        selected = order[np.append(starts[1:], len(order)) - 1]
+    else:
+        selected = order[starts]
+    if policy == "mean":
+        power = power.copy()
+        power[selected] = np.add.reduceat(power[order], starts) / np.diff(np.append(starts, len(order)))
+    kept = np.sort(selected)
+    return (timestamps[kept], power[kept]) + tuple(column[kept] for column in columns[2:]), duplicates
+
+class StreamDecoder:
+    '''
+    Incremental decoder of stream records (JSON lines with devicePower and Cur_Timestamp) into NumPy columns.
+
+    Bytes are fed in chunks of any size, and every complete line is decoded as soon as it arrives, so an object
+    never has to be held in memory as a whole. The fields are extracted from a whole chunk at once with regular
+    expressions, and the timestamps are parsed vectorized (see parse_timestamps), into preallocated arrays that
+    grow by doubling. A chunk whose records do not all hold each field exactly once as a plain value (e.g. missing
+    fields, escaped strings) is decoded record by record with json.loads instead.
+
+    device_field - optional field (or tuple of fields, joined with "/") of the device a record belongs to.
+    '''
+    def __init__(self, device_field = None, capacity: int = 4096):
+        self.device_field = device_field
+        self.fields = () if device_field is None else device_field if isinstance(device_field, tuple) else (device_field,)
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.power = np.empty(capacity, dtype=float)
+        self.devices = np.empty(capacity, dtype=object) if device_field is not None else None
+        self.size = 0
+        self.partial = b""
+        self.timestamp_pattern = field_pattern(TIMESTAMP_FIELD, string=True)
+        self.power_pattern = field_pattern(POWER_FIELD, string=False)
+        self.device_patterns = [field_pattern(field, string=True) for field in self.fields]
+
+    def feed(self, chunk: bytes) -> None:
+        data = self.partial + chunk if self.partial else chunk
+        complete = data.rfind(b"\n") + 1 # A partial last line waits for the next chunk
+        self.partial = data[complete:]
+        if complete:
+            self._decode(data[:complete])
+
+    def finish(self) -> tuple:
+        '''
+        Decode what is left and return the columns: timestamps (datetime64[us], UTC), power (float64) and, with a
+        device_field, the device of every record.
+        '''
+        if self.partial.strip():
+            self._decode(self.partial)
+        self.partial = b""
+        columns = (self.timestamps[:self.size].astype("datetime64[us]"), self.power[:self.size].copy())
+        return columns if self.devices is None else columns + (self.devices[:self.size].copy(),)
+
+    def _decode(self, block: bytes) -> None:
+        count = records(block)
+        timestamps = self.timestamp_pattern.findall(block)
+        power = self.power_pattern.findall(block)
+        devices = [pattern.findall(block) for pattern in self.device_patterns]
+        if b"\\" in block or any(len(column) != count for column in [timestamps, power] + devices):
+            self._decode_records(block)
+            return
+        if count == 0:
+            return
+        power = np.array(power)
+        if power.itemsize >= 4:
+            power[(power == b"null") | (power == b"NaN")] = b"nan"
+        device_names = None
+        if devices:
+            device_names = np.array([name.decode() for name in devices[0]], dtype=object)
+            for column in devices[1:]:
+                device_names = device_names + "/" + np.array([name.decode() for name in column], dtype=object)
+        self._append(parse_timestamps(timestamps), power.astype(float), device_names)
+
+    def _decode_records(self, block: bytes) -> None:
+        timestamps = []
+        power = []
+        devices = []
+        for line in block.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            timestamps.append(parse_timestamp(record.get(TIMESTAMP_FIELD)))
+            power.append(record.get(POWER_FIELD))
+            if isinstance(self.device_field, tuple):
+                devices.append("/".join(str(record.get(field)) for field in self.device_field))
+            elif self.device_field is not None:
+                devices.append(record.get(self.device_field))
+        self._append(np.array(timestamps, dtype=np.int64), np.array(power, dtype=float), np.array(devices, dtype=object) if self.devices is not None else None)
+
+    def _append(self, timestamps: np.ndarray, power: np.ndarray, devices: np.ndarray = None) -> None:
+        end = self.size + len(timestamps)
+        if end > len(self.timestamps):
+            capacity = 1 << (end - 1).bit_length()
+            self.timestamps = np.resize(self.timestamps, capacity)
+            self.power = np.resize(self.power, capacity)
+            if self.devices is not None:
+                self.devices = np.resize(self.devices, capacity)
+        self.timestamps[self.size:end] = timestamps
+        self.power[self.size:end] = power
+        if self.devices is not None:
+            self.devices[self.size:end] = devices
+        self.size = end
+
+def decode_stream_body(body, device_field = None, duplicates: str = STREAM_DUPLICATES, read_size: int = READ_SIZE, count: bool = True) -> tuple:
+    '''
+    Decode a stream object from a file like body (e.g. the StreamingBody of an S3 get_object response), reading it
+    read_size bytes at a time. gzip compressed objects (detected from their magic number) are decompressed on the fly.
+    Returns the columns of StreamDecoder.finish, with the duplicate policy applied.
+    count - set to False when the caller resolves (and counts) the duplicates of several objects together, so they
+            are not counted twice in stream_duplicates_total.
+    '''
+    decoder = StreamDecoder(device_field=device_field)
+    chunk = body.read(read_size)
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) if chunk[:2] == b"\x1f\x8b" else None
+    while chunk:
+        if decompressor is None:
+            decoder.feed(chunk)
+        while decompressor is not None and chunk:
+            # At most read_size decompressed bytes at a time, so memory stays bounded whatever the compression ratio.
+            decoder.feed(decompressor.decompress(chunk, read_size))
+            chunk = decompressor.unconsumed_tail
+            if not chunk and decompressor.eof and decompressor.unused_data: # Concatenated gzip members
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        chunk = body.read(read_size)
+    if decompressor is not None:
+        decoder.feed(decompressor.flush())
+    columns, found = resolve_duplicates(decoder.finish(), duplicates)
+    if count:
+        Metrics.registry.counter("stream_duplicates_total", "Datapoints with the same timestamp (and device) as another").inc(found)
+    return columns
@@ -0,0 +1,75 @@
+import json
+import os
+from hashlib import sha256
+import numpy as np
+import pandas as pd
+
+TRAINING_CACHE_DIR = os.getenv("TRAINING_CACHE_DIR", ".training_cache")
+
+class TrainingCache:
+    '''
+    On-disk cache for processed training sets downloaded from S3.
+
+    Entries are content addressed by bucket, key and ETag. Every numeric column of the processed frame is stored
+    as its own .npy file, so a caller can memory map only the appliance columns it needs instead of parsing the
+    whole CSV again. An index file per (bucket, key) remembers the ETag of the latest entry, which is what the
+    conditional If-None-Match request is made with.
+    '''
+    def __init__(self, cache_dir: str = TRAINING_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _entry_dir(self, bucket_path: str, file_name: str, etag: str) -> str:
+        digest = sha256(f"{bucket_path}/{file_name}@{etag}".encode()).hexdigest()[:32]
+        return os.path.join(self.cache_dir, digest)
+
+    def _index_path(self, bucket_path: str, file_name: str) -> str:
+        digest = sha256(f"{bucket_path}/{file_name}".encode()).hexdigest()[:32]
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def cached_etag(self, bucket_path: str, file_name: str) -> str | None:
+        '''
+        ETag of the cached entry for this object, or None if there is no complete entry.
+        '''
+        index_path = self._index_path(bucket_path, file_name)
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path) as index_file:
+            etag = json.load(index_file).get("etag")
+        if not os.path.exists(os.path.join(self._entry_dir(bucket_path, file_name, etag), "meta.json")):
+            return None
+        return etag
+
+    def store(self, bucket_path: str, file_name: str, etag: str, df: pd.DataFrame) -> None:
+        '''
+        Write the numeric columns of a processed frame to a new entry, then point the index at it.
+        The index is only updated once the entry is complete, so an interrupted write is never read back.
+        '''
+        entry_dir = self._entry_dir(bucket_path, file_name, etag)
+        os.makedirs(entry_dir, exist_ok=True)
+        columns = {}
+        for i, column in enumerate(df.select_dtypes(include="number").columns):
+            columns[column] = f"column_{i}.npy"
+            np.save(os.path.join(entry_dir, columns[column]), df[column].to_numpy())
+        with open(os.path.join(entry_dir, "meta.json"), "w") as meta_file:
+            json.dump({"bucket": bucket_path, "key": file_name, "etag": etag, "rows": len(df), "columns": columns}, meta_file)
+
+        index_path = self._index_path(bucket_path, file_name)
+        with open(f"{index_path}.tmp", "w") as index_file:
+            json.dump({"etag": etag}, index_file)
+        os.replace(f"{index_path}.tmp", index_path)
+
+    def load(self, bucket_path: str, file_name: str, etag: str, columns: list = None) -> pd.DataFrame:
+        '''
+        Load the requested columns (all numeric columns if None) of a cached entry. The .npy files are memory mapped,
+        so columns that are not requested are never read.
+        '''
+        entry_dir = self._entry_dir(bucket_path, file_name, etag)
+        with open(os.path.join(entry_dir, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        stored = meta["columns"]
+        if columns is None:
+            columns = list(stored)
+        missing = [column for column in columns if column not in stored]
+        if missing:
+            raise KeyError(f"Columns {missing} are not in the cached training set {bucket_path}/{file_name}")
+        return pd.DataFrame({column: np.load(os.path.join(entry_dir, stored[column]), mmap_mode="r") for column in columns})
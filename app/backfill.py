@@ -0,0 +1,44 @@
+from data import Backfill
+from api import AWSInterface
+from main import DEVICE_MAPPING
+import argparse
+import os
+import warnings
+import pandas as pd
+
+'''
+Offline backfill: score historical REFIT style CSVs with the same logic as the live loop.
+
+Example, from the app directory:
+    python backfill.py House_1.csv House_2.csv --appliances Appliance1 Appliance2 --output backfill
+'''
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Detect anomalous power cycles in historical CSVs.')
+    parser.add_argument('files', type=str, nargs='+',
+                        help='REFIT style CSVs to score, one per house')
+    parser.add_argument('--appliances', type=str, nargs='+', default=list(DEVICE_MAPPING),
+                        help='Appliance columns to score (default: every appliance in DEVICE_MAPPING)')
+    parser.add_argument('--output', type=str, default='backfill',
+                        help='Directory the labels and anomalies are written to')
+    parser.add_argument('--training', type=str,
+                        help='Local training CSV (default: the training set in S3)')
+    parser.add_argument('--chunksize', type=int, default=Backfill.BACKFILL_CHUNKSIZE,
+                        help='CSV rows read and scored at a time')
+    parser.add_argument('--time-column', type=str, default='Unix',
+                        help='Timestamp column, Unix seconds or UTC date strings')
+    parser.add_argument('--workers', type=int,
+                        help='Size of the process pool (default: the number of CPUs)')
+    args = parser.parse_args()
+
+    print("Starting backfill...")
+    warnings.filterwarnings(action='ignore')
+
+    devices = [DEVICE_MAPPING.get(column, column) for column in args.appliances]
+    if args.training is not None:
+        training = pd.read_csv(args.training).rename(index=str, columns=DEVICE_MAPPING).fillna(0)[devices]
+    else:
+        training = AWSInterface.AWSInterface().get_training_frame(bucket_path=os.getenv("AWS_S3_BUCKET_TRAINING"), file_name=Backfill.Orchestrator.TARGET_TRAINING_SET, device_mapping=DEVICE_MAPPING, columns=devices)
+
+    backfill = Backfill.Backfill(files=args.files, columns=args.appliances, device_mapping=DEVICE_MAPPING, training=training, output_dir=args.output, chunksize=args.chunksize, time_column=args.time_column, max_workers=args.workers)
+    print(backfill.run().to_string(index=False))
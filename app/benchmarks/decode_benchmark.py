@@ -0,0 +1,104 @@
+'''
+Throughput of decoding stream objects (JSON lines with devicePower and Cur_Timestamp) into columns.
+
+Compares, on the same synthetic object:
+  - latest dict: the previous get_latest_in_bucket, Body.readlines() then json.loads and datetime.fromisoformat per
+    line into a dict keyed by timestamp (duplicate timestamps collapse silently)
+  - per line: the previous decode_stream_lines, json.loads and datetime.fromisoformat per line into lists
+  - streaming: StreamDecoder.decode_stream_body, reading the body in chunks with vectorized field extraction and
+    timestamp parsing, on a plain and a gzip compressed object
+Reports records per second and the peak memory allocated while decoding (tracemalloc), and checks that the
+streaming decoder returns the same columns as the per line decoder.
+
+Run from the app directory:
+    python -m benchmarks.decode_benchmark --records 1000000 --duplicates 0.01
+'''
+import argparse
+import gzip
+import io
+import json
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+import numpy as np
+from api import StreamDecoder
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def stream_object(n: int, duplicates: float, seed: int = 0) -> bytes:
+    '''
+    n records 8 seconds apart, the way the stream writes them, with a fraction of them written twice.
+    '''
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    power = rng.normal(80, 20, n)
+    lines = []
+    for i in range(n):
+        line = json.dumps({"devicePower": round(float(power[i]), 3), "Cur_Timestamp": (start + timedelta(seconds=8 * i, microseconds=int(rng.integers(0, 1000000)))).isoformat()}).encode()
+        lines.append(line)
+        if rng.random() < duplicates:
+            lines.append(line)
+    return b"\n".join(lines) + b"\n"
+
+def latest_dict(body) -> dict:
+    '''The previous AWSInterface.get_latest_in_bucket decoding.'''
+    data = body.readlines()
+    power_data = {}
+    for line in data:
+        buffer = json.loads(line)
+        power = buffer.get("devicePower")
+        time = datetime.fromisoformat(buffer.get("Cur_Timestamp"))
+        power_data[time] = power
+    return power_data
+
+def per_line(body) -> tuple:
+    '''The previous AWSInterface.decode_stream_lines, over Body.iter_lines().'''
+    timestamps = []
+    power = []
+    for line in body:
+        if not line.strip():
+            continue
+        buffer = json.loads(line)
+        timestamp = datetime.fromisoformat(buffer.get("Cur_Timestamp"))
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        timestamps.append((timestamp - EPOCH) // timedelta(microseconds=1))
+        power.append(buffer.get("devicePower"))
+    return np.array(timestamps, dtype=np.int64).astype("datetime64[us]"), np.array(power, dtype=float)
+
+def measure(decode, data: bytes) -> tuple:
+    start = perf_counter()
+    result = decode(io.BytesIO(data))
+    elapsed = perf_counter() - start
+    tracemalloc.start()
+    decode(io.BytesIO(data))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main(n: int, duplicates: float) -> None:
+    data = stream_object(n, duplicates)
+    compressed = gzip.compress(data)
+    records = data.count(b"\n")
+    print(f"{records} records, {len(data) / 2**20:.1f} MiB ({len(compressed) / 2**20:.1f} MiB gzip)")
+
+    reference, _, _ = measure(per_line, data)
+    for name, decode, body in [
+        ("latest dict", latest_dict, data),
+        ("per line", per_line, data),
+        ("streaming", StreamDecoder.decode_stream_body, data),
+        ("streaming gzip", StreamDecoder.decode_stream_body, compressed),
+        ("streaming, last duplicate", lambda body: StreamDecoder.decode_stream_body(body, duplicates="last"), data),
+    ]:
+        result, elapsed, peak = measure(decode, body)
+        rows = len(result) if isinstance(result, dict) else len(result[0])
+        print(f"{name:26s} {records / elapsed:12.0f} records/s  {elapsed:7.3f}s  peak {peak / 2**20:8.1f} MiB  {rows} datapoints")
+        if name in ("streaming", "streaming gzip"):
+            assert all(np.array_equal(ours, theirs) for ours, theirs in zip(result, reference)), f"{name} does not match the per line decoder"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark decoding stream objects into columns.')
+    parser.add_argument('--records', type=int, default=1000000, help='Records in the stream object')
+    parser.add_argument('--duplicates', type=float, default=0.01, help='Fraction of records written twice')
+    args = parser.parse_args()
+    main(args.records, args.duplicates)
@@ -0,0 +1,86 @@
+'''
+Throughput and latency of anomaly delivery against a local stand-in backend.
+
+Compares the previous blocking requests.post per anomaly with the AnomalyDispatcher (pooled keep-alive session,
+background thread, optional batch endpoint), then checks that anomalies failing all their retries during a backend
+outage are delivered once it is back, without a restart, and that spooled anomalies survive a restart.
+
+Run from the app directory:
+    python -m benchmarks.delivery_benchmark --anomalies 500 --latency 0.01
+'''
+import argparse
+import os
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter, sleep
+import requests
+from api.AnomalyDispatcher import AnomalyDispatcher
+from data.Anomaly import Anomaly
+from benchmarks.stand_ins import StandInBackend
+
+def payloads(n: int) -> list:
+    now = datetime.now(timezone.utc)
+    return [Anomaly(device_label=f"device{i}", timestamp_start=now, timestamp_end=now, valid_anomaly=True, action_taken=False).dict() for i in range(n)]
+
+def blocking(url: str, data: list) -> tuple:
+    '''The previous Orchestrator.send: one new connection and a blocking post per anomaly.'''
+    start = perf_counter()
+    for payload in data:
+        requests.post(url, json=payload, headers={"Content-Type": "application/json", "Accept": "*/*"})
+    elapsed = perf_counter() - start
+    return elapsed, elapsed, "" # The scoring loop is blocked for the whole delivery time
+
+def dispatched(url: str, data: list, spool_path: str, batch_url: str = None) -> tuple:
+    dispatcher = AnomalyDispatcher(url=url, batch_url=batch_url, spool_path=spool_path)
+    start = perf_counter()
+    for payload in data:
+        dispatcher.send(payload)
+    blocked = perf_counter() - start
+    dispatcher.close(timeout=600)
+    elapsed = perf_counter() - start
+    return elapsed, blocked, f"\n    {dispatcher.stats()}"
+
+def main(n: int, latency: float) -> None:
+    data = payloads(n)
+    with tempfile.TemporaryDirectory() as directory:
+        for name, run in [
+            ("blocking requests.post", lambda backend: blocking(backend.url, data)),
+            ("dispatcher, single endpoint", lambda backend: dispatched(backend.url, data, os.path.join(directory, "single.jsonl"))),
+            ("dispatcher, batch endpoint", lambda backend: dispatched(backend.url, data, os.path.join(directory, "batch.jsonl"), batch_url=backend.batch_url)),
+        ]:
+            with StandInBackend(latency=latency) as backend:
+                elapsed, blocked, stats = run(backend)
+                print(f"{name:30s} delivered {len(backend.received):6d} in {elapsed:8.3f}s ({len(backend.received) / elapsed:9.1f}/s), {backend.requests} requests, scoring loop blocked {blocked:8.3f}s{stats}")
+
+        # Outage: every retry fails, the anomalies are queued again later and delivered once the backend is back.
+        spool_path = os.path.join(directory, "outage.jsonl")
+        with StandInBackend(failure_rate=1.0) as backend:
+            dispatcher = AnomalyDispatcher(url=backend.url, max_retries=1, backoff=0.01, requeue_delay=0.05, max_requeue_delay=0.2, spool_path=spool_path)
+            for payload in data[:10]:
+                dispatcher.send(payload)
+            sleep(0.5)
+            backend.failure_rate = 0.0
+            start = perf_counter()
+            while dispatcher.delivered < 10 and perf_counter() - start < 10:
+                sleep(0.01)
+            dispatcher.close()
+            print(f"Outage: {len(backend.received)}/10 anomalies delivered {perf_counter() - start:.3f}s after the backend came back, without a restart, {dispatcher.requeued} requeues")
+
+        # Restart: the backend is down, anomalies stay spooled, and a new dispatcher delivers them.
+        spool_path = os.path.join(directory, "restart.jsonl")
+        with StandInBackend(failure_rate=1.0) as backend:
+            dispatcher = AnomalyDispatcher(url=backend.url, max_retries=1, backoff=0.01, spool_path=spool_path)
+            for payload in data[:10]:
+                dispatcher.send(payload)
+            dispatcher.close()
+        with StandInBackend() as backend:
+            dispatcher = AnomalyDispatcher(url=backend.url, spool_path=spool_path)
+            dispatcher.close()
+            print(f"Restart recovery: {len(backend.received)}/10 spooled anomalies delivered after restart")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark anomaly delivery against a local stand-in backend.')
+    parser.add_argument('--anomalies', type=int, default=500, help='Number of anomalies to deliver')
+    parser.add_argument('--latency', type=float, default=0.01, help='Stand-in backend latency per request, in seconds')
+    args = parser.parse_args()
+    main(args.anomalies, args.latency)
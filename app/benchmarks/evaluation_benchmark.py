@@ -0,0 +1,88 @@
+'''
+Evaluation and model selection of the cycle detector on a synthetic fridge trace with known ON/OFF states.
+
+  - evaluation: the previous CycleDetection.evaluation, called once per metric (one prediction and list conversion
+    of the ground truth and predictions per metric, sklearn.metrics), against one call of the confusion matrix
+    evaluation returning every metric
+  - chunked: the same test set read from a CSV in chunks (evaluate_chunks) against read whole, peak memory
+  - sweep: the cross validated ModelSelection sweep on 1 worker process and on --workers worker processes
+
+Run from the app directory:
+    python -m benchmarks.evaluation_benchmark --samples 1000000 --workers 4
+'''
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import tracemalloc
+import warnings
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import sklearn.metrics as metrics
+from components import CycleDetection
+from data import ModelSelection
+from benchmarks.synthetic import fridge_trace
+
+def labelled_trace(n: int, seed: int = 0) -> pd.DataFrame:
+    power = fridge_trace(n, seed=seed)
+    return pd.DataFrame({"Fridge": power, "Power Cycle": (power > 40).astype(np.int8)}) # ON and OFF power never overlap
+
+def previous_evaluation(detector, ground_truth, test_data) -> dict:
+    '''The previous CycleDetection.evaluation, once per metric.'''
+    scores = {}
+    for metric, score in (("acc", metrics.accuracy_score), ("prec", metrics.precision_score), ("f1", metrics.f1_score)):
+        predicted_values = detector.is_on(detector.bulk_detect_on_off(test_data))
+        scores[metric] = score(y_true = list(ground_truth), y_pred = list(predicted_values))
+    return scores
+
+def timed(function, *args, **kwargs) -> tuple:
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    return result, perf_counter() - start
+
+def peak(function, *args, **kwargs) -> float:
+    tracemalloc.start()
+    function(*args, **kwargs)
+    result = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result / 2**20
+
+def main(samples: int, workers: int, sweep_samples: int, chunksize: int) -> None:
+    warnings.filterwarnings(action='ignore')
+    detector = CycleDetection.CycleDetection(df=None, device="Fridge", model="threshold", mode="test", aws_api=None)
+    detector.fit(fridge_trace(100000, seed=1))
+    test = labelled_trace(samples)
+
+    previous, previous_seconds = timed(previous_evaluation, detector, test["Power Cycle"], test)
+    current, current_seconds = timed(detector.evaluation, test["Power Cycle"], test, metric="all")
+    print(f"Evaluation of {samples} datapoints: previous {previous_seconds:.3f}s (3 calls), confusion matrix {current_seconds:.3f}s (1 call, {previous_seconds / current_seconds:.0f}x)")
+    assert all(np.isclose(previous[metric], current[metric]) for metric in previous), f"{previous} != {current}"
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "test.csv")
+        test.to_csv(path, index=False)
+        whole = peak(lambda: detector.evaluation(*(lambda frame: (frame["Power Cycle"], frame))(pd.read_csv(path)), metric="all"))
+        chunked = peak(lambda: detector.evaluate_chunks(pd.read_csv(path, chunksize=chunksize), label_column="Power Cycle").scores())
+        assert detector.evaluate_chunks(pd.read_csv(path, chunksize=chunksize), label_column="Power Cycle").scores() == current
+    print(f"Evaluation from CSV: read whole peak {whole:.1f} MiB, chunks of {chunksize} peak {chunked:.1f} MiB")
+
+    sweep = labelled_trace(sweep_samples, seed=2)
+    runs = {}
+    for max_workers in sorted({1, workers}):
+        selection = ModelSelection.ModelSelection(values=sweep["Fridge"], labels=sweep["Power Cycle"], max_workers=max_workers)
+        with contextlib.redirect_stdout(io.StringIO()):
+            runs[max_workers] = timed(selection.run)
+    table = runs[workers][0]
+    print(f"Sweep of {len(table)} models x {ModelSelection.SELECTION_FOLDS} folds on {sweep_samples} datapoints: " + ", ".join(f"{max_workers} workers {seconds:.2f}s" for max_workers, (_, seconds) in runs.items()) + f" ({os.cpu_count()} CPUs)")
+    print(table.to_string(index=False))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark evaluation and model selection of the cycle detector.')
+    parser.add_argument('--samples', type=int, default=1000000, help='Test datapoints of the evaluation')
+    parser.add_argument('--workers', type=int, default=4, help='Worker processes of the parallel sweep')
+    parser.add_argument('--sweep-samples', type=int, default=200000, help='Datapoints of the model selection sweep')
+    parser.add_argument('--chunksize', type=int, default=100000, help='CSV rows per chunk of the chunked evaluation')
+    args = parser.parse_args()
+    main(args.samples, args.workers, args.sweep_samples, args.chunksize)
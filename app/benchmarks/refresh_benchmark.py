@@ -0,0 +1,106 @@
+'''
+Drift aware refresh of the cycle detector on a synthetic fridge trace whose power levels drift.
+
+The cycle detector is trained on the undrifted trace. Then a trace whose ON power drifts from --on-start to --on-end
+watts (and OFF power from --off-start to --off-end) is replayed through a real Orchestrator, with the model refresh
+off, on a background thread and on a worker process (MODEL_REFRESH). Reports, for every mode:
+  - the ON/OFF segmentation accuracy against the known states of the trace, over the whole replay and its last
+    quarter (where the drift is the largest)
+  - the refreshes, their latency (drift detected to refreshed model swapped in) and retraining CPU time
+  - the pause of the scoring loop per batch (drift tracking and model swap), and the scoring time per batch, which
+    also shows a background retraining slowing the scoring loop down
+  - throughput and anomalies raised
+
+Run from the app directory:
+    python -m benchmarks.refresh_benchmark --samples 2000000 --modes off thread process
+'''
+import argparse
+import contextlib
+import io
+import tempfile
+import warnings
+from time import perf_counter
+import numpy as np
+from components import ModelStore
+from data import Orchestrator
+from benchmarks.stand_ins import StandInAWS, StandInDispatcher
+from benchmarks.synthetic import fridge_trace
+
+def drifting_trace(n: int, on_power: tuple, off_power: tuple, chunk_size: int = 50000, seed: int = 1) -> tuple:
+    '''
+    Power and ON/OFF state of a fridge trace whose ON and OFF power move linearly from their start to their end value.
+    '''
+    power, state = [], []
+    chunks = max(n // chunk_size, 1)
+    for index in range(chunks):
+        progress = index / max(chunks - 1, 1)
+        on = on_power[0] + (on_power[1] - on_power[0]) * progress
+        off = off_power[0] + (off_power[1] - off_power[0]) * progress
+        chunk = fridge_trace(chunk_size, seed=seed + index, on_power=on, off_power=off)
+        power.append(chunk)
+        state.append(chunk > (on + off) / 2) # The ON and OFF power of the trace never overlap
+    return np.concatenate(power), np.concatenate(state)
+
+def percentile(values, q: float) -> float:
+    return float(np.percentile(values, q)) * 1000 if len(values) else float("nan")
+
+def replay(mode: str, training: np.ndarray, power: np.ndarray, state: np.ndarray, batch_size: int, store_dir: str, sample_period_us: int = 8000000, start_us: int = 1704067200000000) -> dict:
+    aws = StandInAWS(training={"Fridge": training}, batches=[])
+    with contextlib.redirect_stdout(io.StringIO()):
+        orchestrator = Orchestrator.Orchestrator(device = "Fridge", device_mapping = {}, aws_api = aws, dispatcher = StandInDispatcher(), model_store = ModelStore.ModelStore(store_dir), source = Orchestrator.Sources.Source(), keep_history = False, model_refresh = mode)
+        orchestrator.train()
+    correct = np.zeros(len(power), dtype=bool)
+    batch_seconds = []
+    anomalies = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for offset in range(0, len(power), batch_size):
+            values = power[offset:offset + batch_size]
+            timestamps = (start_us + (offset + np.arange(len(values), dtype=np.int64)) * sample_period_us).astype("datetime64[us]")
+            detector = orchestrator.cycle_detector
+            correct[offset:offset + len(values)] = detector.is_on(detector.classify(values)) == state[offset:offset + len(values)]
+            start = perf_counter()
+            anomalies += len(orchestrator.process_batch(timestamps = timestamps, values = values))
+            batch_seconds.append(perf_counter() - start)
+    refresh = orchestrator.refresh
+    return {
+        "mode": mode,
+        "samples_per_s": round(len(power) / sum(batch_seconds)),
+        "accuracy": round(float(correct.mean()), 4),
+        "accuracy_last_quarter": round(float(correct[3 * len(power) // 4:].mean()), 4),
+        "anomalies": anomalies,
+        "refreshes": refresh.refreshes if refresh else 0,
+        "refresh_p50_ms": round(percentile(refresh.latencies, 50), 1) if refresh else None,
+        "refresh_max_ms": round(percentile(refresh.latencies, 100), 1) if refresh else None,
+        "fit_cpu_ms": round(float(np.mean(refresh.fit_seconds)) * 1000, 1) if refresh and refresh.fit_seconds else None,
+        "pause_p50_ms": round(percentile(refresh.pauses, 50), 3) if refresh else None,
+        "pause_max_ms": round(percentile(refresh.pauses, 100), 3) if refresh else None,
+        "batch_p50_ms": round(percentile(batch_seconds, 50), 3),
+        "batch_p99_ms": round(percentile(batch_seconds, 99), 3),
+        "batch_max_ms": round(percentile(batch_seconds, 100), 3),
+        "centroids": np.round(np.sort(orchestrator.cycle_detector.centroids), 1).tolist()
+    }
+
+def main(samples: int, training: int, batch_size: int, modes: list, on_power: tuple, off_power: tuple) -> None:
+    warnings.filterwarnings(action='ignore')
+    training_values = fridge_trace(training, seed=0, on_power=on_power[0], off_power=off_power[0])
+    power, state = drifting_trace(samples, on_power, off_power)
+    print(f"{len(power)} samples, ON power {on_power[0]} -> {on_power[1]} W, OFF power {off_power[0]} -> {off_power[1]} W, batches of {batch_size}")
+    rows = []
+    for mode in modes:
+        with tempfile.TemporaryDirectory() as store_dir:
+            rows.append(replay(mode, training_values, power, state, batch_size, store_dir))
+    for row in rows:
+        print(", ".join(f"{key} {value}" for key, value in row.items()))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the drift aware refresh of the cycle detector.')
+    parser.add_argument('--samples', type=int, default=2000000, help='Datapoints replayed')
+    parser.add_argument('--training', type=int, default=100000, help='Training datapoints, without drift')
+    parser.add_argument('--batch-size', type=int, default=500, help='Datapoints per received batch')
+    parser.add_argument('--modes', nargs='+', default=["off", "thread", "process"], help='MODEL_REFRESH modes to compare')
+    parser.add_argument('--on-start', type=float, default=85.0)
+    parser.add_argument('--on-end', type=float, default=45.0)
+    parser.add_argument('--off-start', type=float, default=1.5)
+    parser.add_argument('--off-end', type=float, default=20.0)
+    args = parser.parse_args()
+    main(args.samples, args.training, args.batch_size, args.modes, (args.on_start, args.on_end), (args.off_start, args.off_end))
@@ -0,0 +1,132 @@
+'''
+End-to-end replay benchmark of the detection loop.
+
+A synthetic REFIT style fridge trace (or a recorded trace from a CSV column) is replayed through a real Orchestrator,
+with in-process stand-ins for AWSInterface (training set and stream) and for the anomaly endpoint. Reports startup
+time, samples/sec, per-cycle detection latency percentiles, anomalies, peak RSS and the steady-state RSS once the
+models are trained and at the end of the replay. A second mode measures how one
+Gaussian update scales with the size of the normal operation history, for the batch and incremental paths.
+
+Run from the app directory:
+    python -m benchmarks.replay_benchmark --samples 10000 1000000 100000000
+    python -m benchmarks.replay_benchmark --trace House_1.csv --column Appliance1
+    python -m benchmarks.replay_benchmark --gaussian 10000 100000 1000000
+    python -m benchmarks.replay_benchmark --metrics  # instrumentation overhead, compare with a run without it
+'''
+import argparse
+import contextlib
+import os
+import resource
+import tempfile
+import warnings
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from api import Metrics
+from components import GaussianCalculator, ModelStore
+from data import Orchestrator
+from benchmarks.stand_ins import StandInAWS, StandInDispatcher
+from benchmarks.synthetic import fridge_trace, replay_batches
+
+def peak_rss_mib() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # ru_maxrss is in KiB on Linux
+
+def rss_mib() -> float:
+    with open("/proc/self/statm") as statm: # Linux only
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+def trace_batches(path: str, column: str, batch_size: int, sample_period_us: int = 8000000):
+    '''
+    Replay a recorded trace: one CSV column, read in chunks of batch_size.
+    '''
+    produced = 0
+    for chunk in pd.read_csv(path, usecols=[column], chunksize=batch_size):
+        power = chunk[column].fillna(0).to_numpy(dtype=float)
+        timestamps = ((produced + np.arange(len(power), dtype=np.int64)) * sample_period_us).astype("datetime64[us]")
+        produced += len(power)
+        yield timestamps, power
+
+def replay(batches, training: np.ndarray, quiet: bool = True) -> dict:
+    aws_api = StandInAWS(training={"Fridge": training}, batches=batches)
+    dispatcher = StandInDispatcher()
+    output = open(os.devnull, "w") if quiet else None
+    with tempfile.TemporaryDirectory() as store_dir, contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+        start = perf_counter()
+        orchestrator = Orchestrator.Orchestrator(device="Fridge", device_mapping={}, aws_api=aws_api, dispatcher=dispatcher, model_store=ModelStore.ModelStore(store_dir))
+        orchestrator.train()
+        startup = perf_counter() - start
+        aws_api.training = None # The stand-in's copy of the training set, the Orchestrator has released its own
+        rss_trained = rss_mib()
+
+        samples = 0
+        cycle_latencies = []
+        start = perf_counter()
+        while True:
+            received = perf_counter()
+            timestamps, values = orchestrator.receive()
+            if aws_api.exhausted:
+                break
+            cycles_before = orchestrator.cycles_scored
+            orchestrator.process_batch(timestamps=timestamps, values=values)
+            # Every cycle closed by this batch was detected with this batch's latency.
+            cycle_latencies.append((perf_counter() - received, orchestrator.cycles_scored - cycles_before))
+            samples += len(values)
+        elapsed = perf_counter() - start
+        rss_end = rss_mib()
+    if output is not None:
+        output.close()
+
+    latencies = np.repeat([latency for latency, closed in cycle_latencies], [closed for latency, closed in cycle_latencies])
+    percentile = lambda q: float(np.percentile(latencies, q) * 1000) if len(latencies) else float("nan")
+    return {"samples": samples, "startup_s": round(startup, 3), "samples_per_s": round(samples / elapsed), "latency_p50_ms": round(percentile(50), 3), "latency_p95_ms": round(percentile(95), 3), "latency_p99_ms": round(percentile(99), 3), "anomalies": len(dispatcher.sent), "peak_rss_mib": round(peak_rss_mib(), 1), "rss_trained_mib": round(rss_trained, 1), "rss_end_mib": round(rss_end, 1)}
+
+def gaussian_scaling(sizes: list, cycle_length: int = 20) -> pd.DataFrame:
+    '''
+    Time of one normal cycle update as the history grows: batch recompute over the whole history (update) versus
+    the incremental running moments (push).
+    '''
+    rows = []
+    cycle = fridge_trace(cycle_length, seed=2)
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        for size in sizes:
+            history = fridge_trace(size, seed=3)
+            batch = GaussianCalculator.GaussianCalculator(data=history)
+            start = perf_counter()
+            batch.update(data=np.concatenate((history, cycle)))
+            batch_seconds = perf_counter() - start
+            incremental = GaussianCalculator.GaussianCalculator(data=history, incremental=True)
+            start = perf_counter()
+            incremental.push(data=cycle)
+            incremental_seconds = perf_counter() - start
+            rows.append({"history": size, "batch_update_ms": round(batch_seconds * 1000, 3), "incremental_push_ms": round(incremental_seconds * 1000, 4)})
+    return pd.DataFrame(rows)
+
+def main(args) -> None:
+    warnings.filterwarnings(action='ignore')
+    if args.metrics:
+        Metrics.registry.enable(tracing=True)
+    if args.gaussian:
+        print(gaussian_scaling(args.gaussian).to_string(index=False))
+        return
+    training = fridge_trace(args.training, seed=0)
+    rows = []
+    if args.trace:
+        rows.append(replay(trace_batches(args.trace, args.column, args.batch), training, quiet=not args.verbose))
+    else:
+        for samples in args.samples:
+            rows.append(replay(replay_batches(samples, args.batch), training, quiet=not args.verbose))
+    print(pd.DataFrame(rows).to_string(index=False))
+    if args.metrics:
+        print(Metrics.registry.render())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay a power trace through the detection loop and measure it.')
+    parser.add_argument('--samples', type=int, nargs='+', default=[10000, 100000, 1000000], help='Synthetic trace lengths to replay')
+    parser.add_argument('--batch', type=int, default=1000, help='Datapoints per received batch')
+    parser.add_argument('--training', type=int, default=350000, help='Synthetic training set size')
+    parser.add_argument('--trace', type=str, help='Replay a recorded CSV trace instead of a synthetic one')
+    parser.add_argument('--column', type=str, default='Appliance1', help='Column of the recorded trace to replay')
+    parser.add_argument('--gaussian', type=int, nargs='+', help='Measure one Gaussian update at these history sizes instead')
+    parser.add_argument('--metrics', action='store_true', help='Enable metrics and stage spans, and print them at the end')
+    parser.add_argument('--verbose', action='store_true', help='Keep the pipeline console output')
+    main(parser.parse_args())
@@ -0,0 +1,106 @@
+'''
+Speed and detection quality of the cycle scorers: the 3 sigma rule of GaussianCalculator ("sigma") against the
+kernel density of KDECalculator ("kde") and the Mahalanobis distance of the cycle features, per ON/OFF cycle, of
+MultivariateGaussianCalculator ("mahalanobis").
+
+Both are seeded from a synthetic fridge training trace the way Orchestrator seeds them, then score the cycles of a
+test trace in order (updating with every cycle they find normal). A fraction of the test cycles is made anomalous:
+  - on_high: an ON cycle drawing more power (e.g. a struggling compressor)
+  - off_high: an OFF cycle that does not drop back to standby power
+  - partial: a cycle stuck between the ON and OFF levels
+Reports precision, recall and false positive rate against the injected anomalies, and the time to score and update
+one cycle.
+
+Run from the app directory:
+    python -m benchmarks.scorer_benchmark --training 350000 --samples 1000000 --anomaly-rate 0.02
+'''
+import argparse
+import contextlib
+import os
+import warnings
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from components import CycleFeatures, CycleSegmenter, GaussianCalculator, KDECalculator, MultivariateGaussianCalculator
+from components.CycleDetection import CycleDetection
+from benchmarks.synthetic import fridge_trace
+
+def segment(detector: CycleDetection, values: np.ndarray) -> CycleSegmenter.SegmentedCycles:
+    timestamps = (np.arange(len(values)) * 8).astype("datetime64[s]")
+    return CycleSegmenter.CycleSegmenter().segment(timestamps=timestamps, values=values, labels=detector.classify(values))
+
+def inject(cycles: CycleSegmenter.SegmentedCycles, detector: CycleDetection, rate: float, seed: int = 4) -> tuple:
+    '''
+    Returns the test cycles, with a fraction rate of them made anomalous, and the ground truth.
+    '''
+    rng = np.random.default_rng(seed)
+    anomalous = rng.random(len(cycles)) < rate
+    kinds = rng.integers(0, 3, len(cycles))
+    on_power, off_power = np.max(detector.centroids), np.min(detector.centroids)
+    datapoints = []
+    for k in range(len(cycles)):
+        cycle = cycles.cycle(k).copy()
+        if anomalous[k]:
+            match kinds[k]:
+                case 0:
+                    cycle = cycle * 1.4 if cycles.labels[k] == detector.cluster_on else cycle + on_power * 1.4
+                case 1:
+                    cycle = cycle + 0.2 * on_power
+                case 2:
+                    cycle = np.full(len(cycle), (on_power + off_power) / 2) + rng.normal(0, 1, len(cycle))
+        datapoints.append(cycle)
+    return CycleSegmenter.SegmentedCycles(np.concatenate(datapoints), cycles.bounds, cycles.labels, cycles.start_timestamps, cycles.end_timestamps), anomalous
+
+def score(name: str, training: np.ndarray, training_cycles: CycleSegmenter.SegmentedCycles, cycles: CycleSegmenter.SegmentedCycles, anomalous: np.ndarray) -> dict:
+    start = perf_counter()
+    if name == "kde":
+        scorer = KDECalculator.KDECalculator(data=training_cycles.means)
+    elif name == "mahalanobis":
+        training_features = CycleFeatures.CycleFeatures().extract(training_cycles)
+        scorer = {label: MultivariateGaussianCalculator.MultivariateGaussianCalculator(data=training_features[training_cycles.labels == label]) for label in np.unique(training_cycles.labels)}
+    else:
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            scorer = GaussianCalculator.GaussianCalculator(data=training, incremental=True)
+    seed_seconds = perf_counter() - start
+
+    alarms = np.zeros(len(cycles), dtype=bool)
+    start = perf_counter()
+    features = CycleFeatures.CycleFeatures().extract(cycles)
+    for k in range(len(cycles)):
+        average_power = cycles.means[k]
+        if name == "mahalanobis":
+            alarms[k] = scorer[cycles.labels[k]].is_anomalous(features[k])
+            if not alarms[k]:
+                scorer[cycles.labels[k]].push(data=features[k])
+        elif name == "kde":
+            alarms[k] = scorer.is_anomalous(datapoint=average_power)
+            if not alarms[k]:
+                scorer.push(data=[average_power])
+        else:
+            alarms[k] = scorer.sigma_rule(datapoint=average_power)
+            if not alarms[k]:
+                scorer.push(data=cycles.cycle(k))
+    elapsed = perf_counter() - start
+
+    true_positives = int(np.sum(alarms & anomalous))
+    precision = true_positives / max(int(alarms.sum()), 1)
+    recall = true_positives / max(int(anomalous.sum()), 1)
+    false_positive_rate = int(np.sum(alarms & ~anomalous)) / max(int((~anomalous).sum()), 1)
+    return {"scorer": name, "cycles": len(cycles), "anomalies": int(anomalous.sum()), "alarms": int(alarms.sum()), "precision": round(precision, 3), "recall": round(recall, 3), "false_positive_rate": round(false_positive_rate, 4), "seed_ms": round(seed_seconds * 1000, 2), "us_per_cycle": round(elapsed / len(cycles) * 1e6, 2)}
+
+def main(args) -> None:
+    warnings.filterwarnings(action='ignore')
+    training = fridge_trace(args.training, seed=0)
+    detector = CycleDetection(df=None, device="Fridge", model="threshold", mode="train", aws_api=None)
+    detector.fit(training)
+    training_cycles = segment(detector, training)
+    cycles, anomalous = inject(segment(detector, fridge_trace(args.samples, seed=5)), detector, args.anomaly_rate)
+    rows = [score(name, training, training_cycles, cycles, anomalous) for name in ("sigma", "kde", "mahalanobis")]
+    print(pd.DataFrame(rows).to_string(index=False))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the sigma rule, kernel density and Mahalanobis cycle scorers.')
+    parser.add_argument('--training', type=int, default=350000, help='Synthetic training set size')
+    parser.add_argument('--samples', type=int, default=1000000, help='Synthetic test trace length')
+    parser.add_argument('--anomaly-rate', type=float, default=0.02, help='Fraction of test cycles made anomalous')
+    main(parser.parse_args())
@@ -0,0 +1,168 @@
+'''
+Sharded processing of a fleet of houses, with local stand-ins for S3 (the training sets) and the user backend.
+
+Every (house, device) stream is scored twice:
+  - reference: each stream straight through its own Orchestrator, in this process
+  - sharded: the interleaved stream of every house routed by ShardedRunner to worker processes, while one worker is
+    killed (SIGKILL) a third of the way through, a worker is added two thirds of the way through, and removed again
+    five sixths of the way through while the backend is down (from three quarters of the way through)
+The anomalies the stand-in backend receives from the workers, and the ones still spooled at the end (delivered on the
+next run), are compared with the reference: with the checkpoints and the replay of the batches after them, no cycle is
+lost or scored twice (anomalies of replayed batches may be delivered twice, they are counted as duplicates), and the
+anomalies spooled by the removed worker are taken over by the runner. Exits with status 1 if any anomaly is missing.
+Also reports throughput, the streams moved by the rebalance, the
+size of a checkpoint and the time to restore a stream from its checkpoint, against building it from its training set.
+
+Run from the app directory:
+    python -m benchmarks.shard_benchmark --houses 8 --workers 3 --samples 200000
+'''
+import argparse
+import contextlib
+import functools
+import glob
+import io
+import os
+import signal
+import sys
+import tempfile
+import warnings
+from collections import Counter
+from time import perf_counter, sleep
+import numpy as np
+from components import CheckpointStore, ModelStore
+from api import AnomalyDispatcher
+from data import Orchestrator, ShardedRunner
+from benchmarks.synthetic import fridge_trace
+from benchmarks.stand_ins import StandInAWS, StandInBackend, StandInDispatcher
+
+DEVICES = ["Fridge", "Chest Freezer"]
+
+def trace(house: int, device: int, n: int, seed: int) -> np.ndarray:
+    '''
+    A fridge like trace with its own power levels per stream, and a few ON cycles stuck at a higher power.
+    '''
+    power = fridge_trace(n, seed=seed + 100 * house + device, on_power=70.0 + 10 * house + 25 * device)
+    rng = np.random.default_rng(seed + 100 * house + device)
+    for start in rng.integers(0, n - 30, n // 5000):
+        power[start:start + 30] *= 2.5
+    return power
+
+def fleet(houses: int, samples: int, training: int, batch_size: int, sample_period_us: int = 8000000, start_us: int = 1704067200000000) -> tuple:
+    '''
+    Returns the training sets per house, the test trace per stream, and the interleaved stream as (timestamps, power,
+    keys) batches with batch_size datapoints of every stream.
+    '''
+    names = [f"House_{house + 1}" for house in range(houses)]
+    training_sets = {Orchestrator.TRAINING_SET_TEMPLATE.format(house=name): {device: trace(house, index, training, seed=0) for index, device in enumerate(DEVICES)} for house, name in enumerate(names)}
+    traces = {ShardedRunner.stream_key(name, device): trace(house, index, samples, seed=1) for house, name in enumerate(names) for index, device in enumerate(DEVICES)}
+    timestamps = (start_us + np.arange(samples, dtype=np.int64) * sample_period_us).astype("datetime64[us]")
+    batches = []
+    for offset in range(0, samples, batch_size):
+        part = slice(offset, offset + batch_size)
+        batches.append((
+            np.concatenate([timestamps[part]] * len(traces)),
+            np.concatenate([power[part] for power in traces.values()]),
+            np.concatenate([np.full(len(timestamps[part]), key, dtype=object) for key in traces])))
+    return names, training_sets, traces, timestamps, batches
+
+def anomaly_key(payload: dict) -> tuple:
+    return payload["device_label"], str(payload["timestamp_start"]), str(payload["timestamp_end"])
+
+def reference(names: list, training_sets: dict, traces: dict, timestamps: np.ndarray, batch_size: int, store_dir: str) -> Counter:
+    dispatcher = StandInDispatcher()
+    aws = StandInAWS(training={}, batches=[], training_sets=training_sets)
+    for key, power in traces.items():
+        house, device = key.split("/", 1)
+        orchestrator = Orchestrator.Orchestrator(device = device, device_mapping = {}, aws_api = aws, device_label = key, dispatcher = dispatcher, model_store = ModelStore.ModelStore(store_dir), source = ShardedRunner.Sources.Source(), house = house, keep_history = False)
+        orchestrator.train()
+        for offset in range(0, len(power), batch_size):
+            orchestrator.process_batch(timestamps = timestamps[offset:offset + batch_size], values = power[offset:offset + batch_size])
+    return Counter(anomaly_key(payload) for payload in dispatcher.sent)
+
+def restore_seconds(training_sets: dict, keys: list, directory: str, store_dir: str, repeat: int = 5) -> tuple:
+    '''
+    Seconds to restore one stream from its checkpoint, from the checkpoint alone against training set load then restore.
+    '''
+    checkpoints = CheckpointStore.CheckpointStore(os.path.join(directory, "checkpoints"))
+    key = next(key for key in keys if checkpoints.load(key) is not None)
+    house, device = key.split("/", 1)
+    state = checkpoints.load(key)["state"]
+    aws = StandInAWS(training={}, batches=[], training_sets=training_sets)
+    common = dict(device = device, device_mapping = {}, aws_api = aws, device_label = key, dispatcher = StandInDispatcher(), model_store = ModelStore.ModelStore(store_dir), source = ShardedRunner.Sources.Source(), house = house, keep_history = False)
+    timings = {"training set": [], "checkpoint": []}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = perf_counter()
+            Orchestrator.Orchestrator(**common).restore(state)
+            timings["training set"].append(perf_counter() - start)
+            start = perf_counter()
+            Orchestrator.Orchestrator(**common, checkpoint = state)
+            timings["checkpoint"].append(perf_counter() - start)
+    return float(np.median(timings["training set"])), float(np.median(timings["checkpoint"]))
+
+def sharded(names: list, training_sets: dict, batches: list, workers: int, checkpoint_every: int, directory: str, backend: StandInBackend) -> dict:
+    runner = ShardedRunner.ShardedRunner(houses = names, devices = DEVICES, device_mapping = {}, workers = workers, source = ShardedRunner.Sources.Source(), aws_factory = functools.partial(StandInAWS, training={}, batches=[], training_sets=training_sets), api_url = backend.url, checkpoint_dir = os.path.join(directory, "checkpoints"), store_dir = os.path.join(directory, "models"), checkpoint_every = checkpoint_every)
+    runner.start()
+    start = perf_counter()
+    moves = {}
+    for index, (timestamps, power, keys) in enumerate(batches):
+        if index == len(batches) // 3:
+            victim = runner.processes["worker-0"]
+            os.kill(victim.pid, signal.SIGKILL)
+            victim.join()
+        if index == 2 * len(batches) // 3:
+            moves = runner.resize(workers + 1)
+        if index == 3 * len(batches) // 4:
+            backend.failure_rate = 1.0
+        if index == 5 * len(batches) // 6:
+            runner.resize(workers)
+            backend.failure_rate = 0.0
+        runner.route(timestamps = timestamps, values = power, keys = keys)
+    report = runner.report()
+    runner.stop()
+    elapsed = perf_counter() - start
+    checkpoints = glob.glob(os.path.join(directory, "checkpoints", "*.json"))
+    return {"seconds": elapsed, "restarts": runner.restarts, "moves": moves, "report": report, "checkpoint_bytes": np.mean([os.path.getsize(path) for path in checkpoints])}
+
+def main(houses: int, workers: int, samples: int, training: int, batch_size: int, checkpoint_every: int) -> None:
+    names, training_sets, traces, timestamps, batches = fleet(houses, samples, training, batch_size)
+    with tempfile.TemporaryDirectory() as directory:
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = reference(names, training_sets, traces, timestamps, batch_size, os.path.join(directory, "models"))
+        with StandInBackend() as backend:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = sharded(names, training_sets, batches, workers, checkpoint_every, directory, backend)
+                from_training, from_checkpoint = restore_seconds(training_sets, list(traces), directory, os.path.join(directory, "models"))
+            deadline = perf_counter() + 30
+            while sum(expected.values()) > len(backend.received) and perf_counter() < deadline:
+                sleep(0.1) # Spooled anomalies of the killed worker are delivered by its restarted process
+            received = Counter(anomaly_key(payload) for payload in backend.received)
+            spools = glob.glob(os.path.join(directory, "checkpoints", f"*{ShardedRunner.SPOOL_SUFFIX}"))
+            spooled = Counter(anomaly_key(record["payload"]) for path in spools for record in AnomalyDispatcher.read_spool(path).values())
+
+    streams = len(traces)
+    print(f"{streams} streams ({houses} houses x {len(DEVICES)} devices), {samples} samples each, {workers} workers, checkpoint every {checkpoint_every} batches")
+    print(result["report"].to_string())
+    print(f"Sharded: {streams * samples / result['seconds']:.0f} samples/s, {result['restarts']} worker restarts")
+    print(f"Rebalance to {workers + 1} workers moved {len(result['moves'])}/{streams} streams (consistent hashing ideal: {streams / (workers + 1):.1f})")
+    print(f"Checkpoint size: {result['checkpoint_bytes']:.0f} bytes per stream")
+    print(f"Stream restore: {from_checkpoint * 1000:.1f} ms from the checkpoint alone, {from_training * 1000:.1f} ms with the training set loaded first")
+    missing = expected - received - spooled
+    extra = Counter({key: count for key, count in received.items() if key not in expected})
+    duplicates = sum(count - 1 for key, count in received.items() if key in expected and count > 1)
+    print(f"Anomalies: {sum(expected.values())} expected, {len(backend.received)} received, {sum(spooled.values())} still spooled, {sum(missing.values())} missing, {sum(extra.values())} unexpected, {duplicates} duplicate deliveries")
+    if missing:
+        print(f"Missing anomalies: {dict(missing)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark sharded multi-house processing with checkpoints, a worker crash and a rebalance.')
+    parser.add_argument('--houses', type=int, default=8, help='Number of houses, each with every device in DEVICES')
+    parser.add_argument('--workers', type=int, default=3, help='Initial number of worker processes')
+    parser.add_argument('--samples', type=int, default=200000, help='Datapoints per stream')
+    parser.add_argument('--training', type=int, default=100000, help='Training datapoints per stream')
+    parser.add_argument('--batch-size', type=int, default=500, help='Datapoints per stream in every received batch')
+    parser.add_argument('--checkpoint-every', type=int, default=50, help='Batches between two checkpoints')
+    args = parser.parse_args()
+    warnings.filterwarnings(action='ignore')
+    main(args.houses, args.workers, args.samples, args.training, args.batch_size, args.checkpoint_every)
@@ -0,0 +1,132 @@
+'''
+End-to-end latency benchmark of the ingestion sources.
+
+A producer thread emits a synthetic fridge trace in real time (rate datapoints per second, each stamped with the
+wall clock time it was produced) through one ingestion source, and a real Orchestrator consumes and scores it the
+way Orchestrator.consume does. Reports, per source, the event-to-score latency percentiles (from a datapoint being
+produced to its batch being scored), batches and datapoints scored.
+  - s3: adaptive polling of an in-process stand-in of the stream bucket (S3PollingSource)
+  - s3-fixed: the previous fixed interval poll loop (S3PollingSource with min_interval = max_interval)
+  - directory: JSON lines appended to a watched directory (DirectorySource)
+  - socket: JSON lines pushed over a local TCP connection (SocketSource)
+
+Run from the app directory:
+    python -m benchmarks.source_latency_benchmark --sources s3 directory socket --duration 10 --rate 20
+    python -m benchmarks.source_latency_benchmark --sources s3-fixed --fixed-interval 10 --duration 60
+'''
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import tempfile
+import threading
+import warnings
+from datetime import datetime, timezone
+from time import sleep
+import numpy as np
+import pandas as pd
+from api import Sources
+from components import ModelStore
+from data import Orchestrator
+from benchmarks.stand_ins import StandInAWS, StandInDispatcher
+from benchmarks.synthetic import fridge_trace
+
+SOURCES = ("s3", "s3-fixed", "directory", "socket")
+
+class StreamBucket(StandInAWS):
+    '''
+    Stand-in for the stream bucket: get_new_in_bucket returns every record put since the previous call.
+    '''
+    def __init__(self, training: dict):
+        super().__init__(training=training, batches=[])
+        self.records = []
+        self._lock = threading.Lock()
+
+    def put(self, line: bytes) -> None:
+        with self._lock:
+            self.records.append(line)
+
+    def get_new_in_bucket(self, bucket_path: str, max_workers: int = 8, device_field: str = None) -> tuple:
+        with self._lock:
+            lines, self.records = self.records, []
+        return Sources.decode_stream_lines(lines, device_field=device_field)
+
+def record(power: float) -> bytes:
+    return json.dumps({"devicePower": power, "Cur_Timestamp": datetime.now(timezone.utc).isoformat()}).encode() + b"\n"
+
+def produce(write, values: np.ndarray, rate: float) -> None:
+    for power in values:
+        write(record(float(power)))
+        sleep(1 / rate)
+
+def producer(name: str, source: Sources.Source, bucket: StreamBucket, watch_dir: str, values: np.ndarray, rate: float) -> threading.Thread:
+    '''
+    Thread that emits values through the transport the source reads from.
+    '''
+    def run():
+        if name in ("s3", "s3-fixed"):
+            produce(bucket.put, values, rate)
+        elif name == "directory":
+            with open(os.path.join(watch_dir, "stream.jsonl"), "ab", buffering=0) as stream_file:
+                produce(stream_file.write, values, rate)
+        else:
+            while source.server is None:
+                sleep(0.01)
+            with socket.create_connection((source.host, source.port)) as connection:
+                produce(connection.sendall, values, rate)
+
+    return threading.Thread(target=run, name=f"{name}-producer", daemon=True)
+
+def make_source(name: str, bucket: StreamBucket, watch_dir: str, fixed_interval: float) -> Sources.Source:
+    match name:
+        case "s3":
+            return Sources.S3PollingSource(aws_api=bucket, bucket_path=Orchestrator.STREAM_FILE_PATH)
+        case "s3-fixed":
+            return Sources.S3PollingSource(aws_api=bucket, bucket_path=Orchestrator.STREAM_FILE_PATH, min_interval=fixed_interval, max_interval=fixed_interval)
+        case "directory":
+            return Sources.DirectorySource(path=watch_dir)
+        case "socket":
+            return Sources.SocketSource(port=0)
+
+async def consume(orchestrator: Orchestrator.Orchestrator, latencies: list, counts: list) -> None:
+    async for (timestamps, values), arrived in orchestrator.source.batches():
+        orchestrator.process_batch(timestamps=timestamps, values=values)
+        now = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), "us")
+        latencies += list((now - timestamps) / np.timedelta64(1, "s"))
+        counts.append(len(values))
+
+def measure(name: str, training: np.ndarray, duration: float, rate: float, fixed_interval: float) -> dict:
+    bucket = StreamBucket(training={"Fridge": training})
+    values = fridge_trace(int(duration * rate), seed=1)
+    latencies = []
+    counts = []
+    with tempfile.TemporaryDirectory() as store_dir, tempfile.TemporaryDirectory() as watch_dir, contextlib.redirect_stdout(open(os.devnull, "w")):
+        source = make_source(name, bucket, watch_dir, fixed_interval)
+        orchestrator = Orchestrator.Orchestrator(device="Fridge", device_mapping={}, aws_api=bucket, dispatcher=StandInDispatcher(), model_store=ModelStore.ModelStore(store_dir), source=source)
+        orchestrator.train()
+        producer(name, source, bucket, watch_dir, values, rate).start()
+
+        async def run():
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(consume(orchestrator, latencies, counts), timeout=duration + max(1.0, fixed_interval if name == "s3-fixed" else 0))
+
+        asyncio.run(run())
+    percentile = lambda q: round(float(np.percentile(latencies, q) * 1000), 2) if latencies else float("nan")
+    return {"source": name, "datapoints": len(latencies), "batches": len(counts), "latency_p50_ms": percentile(50), "latency_p95_ms": percentile(95), "latency_p99_ms": percentile(99), "latency_max_ms": round(max(latencies) * 1000, 2) if latencies else float("nan")}
+
+def main(args) -> None:
+    warnings.filterwarnings(action='ignore')
+    training = fridge_trace(args.training, seed=0)
+    rows = [measure(name, training, args.duration, args.rate, args.fixed_interval) for name in args.sources]
+    print(pd.DataFrame(rows).to_string(index=False))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure the end-to-end latency of the ingestion sources.')
+    parser.add_argument('--sources', choices=SOURCES, nargs='+', default=["s3", "directory", "socket"], help='Sources to measure')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of stream to produce per source')
+    parser.add_argument('--rate', type=float, default=20.0, help='Datapoints produced per second')
+    parser.add_argument('--fixed-interval', type=float, default=10.0, help='Poll interval of the s3-fixed source')
+    parser.add_argument('--training', type=int, default=100000, help='Synthetic training set size')
+    main(parser.parse_args())
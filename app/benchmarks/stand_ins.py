@@ -0,0 +1,107 @@
+import json
+import random
+import threading
+from time import sleep
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+
+class StandInBackend:
+    '''
+    Local stand-in for the user backend's anomaly endpoint.
+    Every POSTed payload (or list of payloads) is recorded in received.
+
+    latency - seconds to wait before answering each request.
+    failure_rate - fraction of requests answered with a 503.
+    '''
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, port: int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.received = []
+        self.requests = 0
+        self._lock = threading.Lock()
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real backend
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if backend.latency:
+                    sleep(backend.latency)
+                with backend._lock:
+                    backend.requests += 1
+                    failed = random.random() < backend.failure_rate
+                    if not failed:
+                        backend.received += body if isinstance(body, list) else [body]
+                self.send_response(503 if failed else 200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/anomalies/createAnomaly"
+        self.batch_url = f"http://127.0.0.1:{self.server.server_address[1]}/anomalies/createAnomalies"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+class StandInAWS:
+    '''
+    In-process stand-in for AWSInterface.
+
+    training - dict of device column name to training values, served by get_training_frame.
+    training_sets - optional dict of training set file name to such a dict, e.g. one training set per house.
+    batches - iterable of (timestamps, power) batches, one per get_new_in_bucket call. Once it is exhausted, every
+              call returns empty columns and exhausted is set.
+    '''
+    def __init__(self, training: dict, batches, training_sets: dict = None):
+        self.training = training
+        self.training_sets = training_sets if training_sets is not None else {}
+        self.batches = iter(batches)
+        self.exhausted = False
+        self.uploads = {}
+        self.status = 200
+
+    def get_training_frame(self, bucket_path: str, file_name: str, device_mapping: dict, columns: list = None, cache = None) -> pd.DataFrame:
+        training = self.training_sets.get(file_name, self.training)
+        columns = columns if columns is not None else list(training)
+        return pd.DataFrame({column: training[column] for column in columns})
+
+    def get_new_in_bucket(self, bucket_path: str, max_workers: int = 8, device_field: str = None) -> tuple:
+        try:
+            return next(self.batches)
+        except StopIteration:
+            self.exhausted = True
+            empty = (np.empty(0, dtype="datetime64[us]"), np.empty(0, dtype=float))
+            return empty if device_field is None else empty + (np.empty(0, dtype=object),)
+
+    def upload_to_bucket(self, bucket_name: str, target_directory: str, fileobj) -> None:
+        self.uploads[target_directory] = len(fileobj.read())
+
+    def write_to_bucket(self, bucket_name: str, target_directory: str, body) -> None:
+        self.uploads[target_directory] = len(body)
+
+    def get_status(self):
+        return self.status
+
+class StandInDispatcher:
+    '''
+    In-process stand-in for the anomaly delivery queue: records every payload.
+    '''
+    def __init__(self):
+        self.sent = []
+
+    def send(self, payload: dict) -> None:
+        self.sent.append(payload)
+
+    def close(self, timeout: float = 10.0) -> None:
+        pass
@@ -0,0 +1,97 @@
+'''
+Cold start of the detection service, every scenario in a fresh interpreter:
+
+  - import: importing data.Orchestrator, and the heavy dependencies it loads
+  - cold: an Orchestrator on a stand-in training set with an empty model store (trains the cycle detector)
+  - warm: the same Orchestrator once the model is stored (loads the stored centroids, never imports sklearn)
+  - connect: AWSInterface start up against a stand-in S3 client with --latency seconds per request, with the
+    connectivity check (list_buckets) waited for before loading the training set, as before, and running
+    concurrently with it
+Every scenario reports the time to its first scored batch (or to the training set for connect) and the stages of
+StartupProfile.
+
+Run from the app directory:
+    python -m benchmarks.startup_benchmark --training 350000 --latency 0.2
+'''
+import argparse
+import contextlib
+import io
+import json
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, sleep
+
+HEAVY_MODULES = ("boto3", "pandas", "sklearn", "scipy", "requests")
+
+def scenario(name: str, training: int, latency: float, store_dir: str) -> dict:
+    '''Runs in the child interpreter.'''
+    start = perf_counter()
+    from api import StartupProfile
+    from data import Orchestrator
+    StartupProfile.startup.mark("import data.Orchestrator")
+    result = {}
+    if name in ("cold", "warm"):
+        from components import ModelStore
+        from benchmarks.synthetic import fridge_trace, replay_batches
+        from benchmarks.stand_ins import StandInAWS, StandInDispatcher
+        StartupProfile.startup.mark("benchmark stand-ins")
+        aws = StandInAWS(training={"Fridge": fridge_trace(training)}, batches=[])
+        with contextlib.redirect_stdout(io.StringIO()):
+            orchestrator = Orchestrator.Orchestrator(device = "Fridge", device_mapping = {}, aws_api = aws, dispatcher = StandInDispatcher(), model_store = ModelStore.ModelStore(store_dir), source = Orchestrator.Sources.Source(), keep_history = False)
+            orchestrator.train()
+            timestamps, power = next(replay_batches(500, 500))
+            orchestrator.process_batch(timestamps = timestamps, values = power)
+        StartupProfile.startup.mark("first batch scored")
+    elif name.startswith("connect"):
+        from api import AWSInterface
+        from api.TrainingCache import TrainingCache
+        body = ("Appliance1\n" + "\n".join(["1.5", "85.0"] * (training // 2)) + "\n").encode()
+
+        class StandInS3:
+            def list_buckets(self):
+                sleep(latency)
+                return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+            def get_object(self, **params):
+                sleep(latency)
+                return {"ResponseMetadata": {"HTTPStatusCode": 200}, "Body": io.BytesIO(body)}
+
+        class StandInS3Interface(AWSInterface.AWSInterface):
+            s3 = StandInS3()
+
+        with tempfile.TemporaryDirectory() as cache_dir, contextlib.redirect_stdout(io.StringIO()):
+            aws = StandInS3Interface(checkpoint_path = None)
+            if name == "connect sequential":
+                aws.get_status()
+            StartupProfile.startup.mark("AWS interface")
+            aws.get_training_frame(bucket_path = "training", file_name = "training.csv", device_mapping = {"Appliance1": "Fridge"}, cache = TrainingCache(cache_dir))
+            result["status"] = aws.get_status()
+        StartupProfile.startup.mark("training set loaded")
+    result.update({"seconds": perf_counter() - start, "stages": StartupProfile.startup.stages, "heavy": [module for module in HEAVY_MODULES if module in sys.modules]})
+    return result
+
+def run(name: str, training: int, latency: float, store_dir: str) -> dict:
+    command = [sys.executable, "-m", "benchmarks.startup_benchmark", "--scenario", name, "--training", str(training), "--latency", str(latency), "--store-dir", store_dir]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main(training: int, latency: float) -> None:
+    with tempfile.TemporaryDirectory() as store_dir:
+        for name in ("import", "cold", "warm", "connect sequential", "connect concurrent"):
+            result = run(name, training, latency, store_dir)
+            print(f"{name}: {result['seconds']:.3f}s, heavy modules loaded: {', '.join(result['heavy']) or 'none'}")
+            for stage in result["stages"]:
+                print(f"    {stage['stage']:40s} {stage['seconds']:8.3f}s  {', '.join(stage['imported'])}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the cold start of the detection service.')
+    parser.add_argument('--training', type=int, default=350000, help='Training datapoints')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds per request of the stand-in S3 client')
+    parser.add_argument('--scenario', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--store-dir', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.scenario is not None:
+        print(json.dumps(scenario(args.scenario, args.training, args.latency, args.store_dir)))
+    else:
+        main(args.training, args.latency)
@@ -0,0 +1,36 @@
+import numpy as np
+
+def fridge_trace(n: int, seed: int = 0, on_power: float = 85.0, off_power: float = 1.5, mean_on: int = 20, mean_off: int = 40) -> np.ndarray:
+    '''
+    Synthetic REFIT style fridge power trace: alternating ON and OFF cycles with geometric lengths, a compressor
+    start-up spike at the beginning of every ON cycle, and measurement noise.
+    '''
+    rng = np.random.default_rng(seed)
+    cycles = max(2 * n // (mean_on + mean_off) + 2, 2)
+    lengths = np.empty(cycles, dtype=np.int64)
+    lengths[0::2] = rng.geometric(1 / mean_off, size=len(lengths[0::2]))
+    lengths[1::2] = rng.geometric(1 / mean_on, size=len(lengths[1::2]))
+    while lengths.sum() < n:
+        lengths = np.concatenate((lengths, lengths))
+    state = np.repeat(np.arange(len(lengths)) % 2, lengths)[:n]
+    power = np.where(state == 1, on_power + rng.normal(0, 4, n), off_power + np.abs(rng.normal(0, 0.5, n)))
+    starts = np.flatnonzero(np.diff(state, prepend=0) == 1)
+    power[starts] += 60 # Compressor start-up spike
+    return power
+
+def replay_batches(n: int, batch_size: int, chunk_size: int = 1000000, seed: int = 1, sample_period_us: int = 8000000, start_us: int = 1704067200000000):
+    '''
+    Yield a synthetic trace of n samples as (timestamps, power) batches of batch_size, the way the stream is received.
+    The trace is generated chunk by chunk, so replaying 100M samples never holds the whole trace in memory.
+    '''
+    produced = 0
+    chunk_index = 0
+    while produced < n:
+        chunk = fridge_trace(min(chunk_size, n - produced), seed=seed + chunk_index)
+        for offset in range(0, len(chunk), batch_size):
+            power = chunk[offset:offset + batch_size]
+            first = produced + offset
+            timestamps = (start_us + (first + np.arange(len(power), dtype=np.int64)) * sample_period_us).astype("datetime64[us]")
+            yield timestamps, power
+        produced += len(chunk)
+        chunk_index += 1
@@ -0,0 +1,45 @@
+'''
+Fit time, peak memory and label agreement of the cycle detector training engines.
+
+Every engine is trained on the same synthetic fridge trace and compared against the full batch KMeans ("knn").
+Run from the app directory:
+    python -m benchmarks.training_benchmark --sizes 100000 1000000 10000000
+'''
+import argparse
+import tracemalloc
+import warnings
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from components.CycleDetection import CycleDetection, MODELS
+from benchmarks.synthetic import fridge_trace
+
+def train(model: str, values: np.ndarray) -> tuple:
+    detector = CycleDetection(df=None, device="Fridge", model=model, mode="train", aws_api=None)
+    tracemalloc.start()
+    start = perf_counter()
+    detector.fit(values)
+    elapsed = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return detector, elapsed, peak
+
+def main(sizes: list) -> None:
+    warnings.filterwarnings(action='ignore')
+    rows = []
+    for size in sizes:
+        values = fridge_trace(size)
+        reference = None
+        for model in MODELS:
+            detector, elapsed, peak = train(model, values)
+            on = detector.is_on(detector.classify(values))
+            if reference is None:
+                reference = on
+            rows.append({"samples": size, "model": model, "fit_seconds": round(elapsed, 4), "peak_mib": round(peak / 2**20, 1), "centroids": np.round(np.sort(detector.centroids), 2).tolist(), "on_agreement_vs_knn": float(np.mean(on == reference))})
+    print(pd.DataFrame(rows).to_string(index=False))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the cycle detector training engines.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000], help='Training set sizes')
+    args = parser.parse_args()
+    main(args.sizes)
@@ -0,0 +1,49 @@
+import json
+import os
+from time import time
+
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", ".checkpoints")
+CHECKPOINT_FORMAT_VERSION = 1
+
+class CheckpointStore:
+  '''
+  Local store of the detection state of streams (see Orchestrator.checkpoint), so a stream can be restored on another
+  worker process, or after a restart, without retraining and without losing the cycle in progress.
+
+  One file per stream key, replaced atomically: a crash leaves either the previous checkpoint or the new one.
+  Every checkpoint carries the sequence number of the last batch it includes, so the batches received after it can
+  be replayed exactly once on top of it.
+  '''
+
+  def __init__(self, checkpoint_dir: str = CHECKPOINT_DIR) -> None:
+    self.checkpoint_dir = checkpoint_dir
+
+  def _path(self, key: str) -> str:
+    name = "".join(character if character.isalnum() else "_" for character in key)
+    return os.path.join(self.checkpoint_dir, f"{name}.json")
+
+  def load(self, key: str) -> dict | None:
+    '''
+    Returns the last checkpoint of the stream, or None if there is no usable one.
+    '''
+    path = self._path(key)
+    if not os.path.exists(path):
+      return None
+    with open(path) as checkpoint_file:
+      checkpoint = json.load(checkpoint_file)
+    if checkpoint.get("version") != CHECKPOINT_FORMAT_VERSION or checkpoint.get("key") != key:
+      return None
+    return checkpoint
+
+  def save(self, key: str, sequence: int, state: dict) -> None:
+    '''
+    sequence - the number of the last batch of the stream included in state.
+    state - Orchestrator.checkpoint()
+    '''
+    os.makedirs(self.checkpoint_dir, exist_ok=True)
+    checkpoint = {"version": CHECKPOINT_FORMAT_VERSION, "key": key, "sequence": sequence, "state": state, "created": time()}
+    path = self._path(key)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as checkpoint_file:
+      json.dump(checkpoint, checkpoint_file)
+    os.replace(temporary_path, path)
@@ -1,59 +1,273 @@
-import io
 import os
+import tempfile
+import numpy as np
+from time import process_time
 from dotenv import load_dotenv
-from api import AWSInterface
-
-from sklearn.cluster import KMeans
-import sklearn.metrics as metrics
+from components import Evaluation
 
 load_dotenv()
 
 # General constants
 AWS_S3_BUCKET_TRAINING = os.getenv("AWS_S3_BUCKET_TRAINING")
 
+MODELS = ("knn", "minibatch", "threshold", "gmm")
+CHUNK_SIZE = 100000 # Datapoints per partial_fit call of the "minibatch" model
+GMM_SUBSAMPLE = 100000 # Datapoints the "gmm" model is fitted on
+
+def chunks(values, chunk_size: int = CHUNK_SIZE):
+  '''
+  Split an array of datapoints into consecutive chunks.
+  '''
+  for start in range(0, len(values), chunk_size):
+    yield values[start:start + chunk_size]
+
+def two_means_1d(values) -> tuple:
+  '''
+  Exact two-cluster k-means in one dimension.
+
+  The optimal partition of sorted values is a prefix and a suffix, so every split point is evaluated at once from
+  prefix sums of the distinct values (weighted by their counts) and the one with the lowest within-cluster sum of
+  squares is kept. Costs one sort, with no iterations and no dependence on initialisation.
+  Returns the low and high cluster means.
+  '''
+  distinct, counts = np.unique(np.asarray(values, dtype=float), return_counts=True)
+  if len(distinct) == 1:
+    return distinct[0], distinct[0]
+  shift = distinct.mean() # Centre the values so the prefix sums of squares do not lose precision
+  centred = distinct - shift
+  n = np.cumsum(counts, dtype=float)
+  s1 = np.cumsum(counts * centred)
+  s2 = np.cumsum(counts * centred * centred)
+  n_left, s1_left, s2_left = n[:-1], s1[:-1], s2[:-1]
+  n_right, s1_right, s2_right = n[-1] - n_left, s1[-1] - s1_left, s2[-1] - s2_left
+  sse = (s2_left - s1_left * s1_left / n_left) + (s2_right - s1_right * s1_right / n_right)
+  split = int(np.argmin(sse))
+  return s1_left[split] / n_left[split] + shift, s1_right[split] / n_right[split] + shift
+
+def on_clusters(centroids) -> np.ndarray:
+  '''
+  Which clusters are ON states, as a boolean per cluster. The centroids themselves are split in two with two_means_1d
+  and every centroid above the split is ON, so with more than two clusters every ON state (e.g. a compressor running
+  at different speeds) counts as ON, not only the highest. With two clusters this is the highest one.
+  '''
+  centroids = np.asarray(centroids, dtype=float).ravel()
+  low, high = two_means_1d(centroids)
+  on = centroids > (low + high) / 2
+  on[np.argmax(centroids)] = True
+  return on
+
+def refit_state(model: str, n_clusters: int, covariance_type: str, trained_state: dict, values) -> tuple:
+  '''
+  Worker (thread or process) entry point of the model refresh: retrain a cycle detector on recent datapoints,
+  starting from its trained state (see CycleDetection.refit). Only the new trained state is sent back.
+  Returns the trained state and the CPU time spent retraining.
+  '''
+  start = process_time()
+  detector = CycleDetection(df = None, device = None, model = model, mode = "test", aws_api = None, n_clusters = n_clusters, covariance_type = covariance_type)
+  detector.load_trained(**trained_state)
+  detector.refit(values)
+  return detector.trained_state(), process_time() - start
+
 class CycleDetection:
 
-  def __init__(self, df, device, model, mode, aws_api, n_clusters = 2):
+  def __init__(self, df, device, model, mode, aws_api, n_clusters = 2, covariance_type = "full", house = "House_1"):
     '''
     df - the data frame which we want to train on.
     n_clusters - defines the number of clusters we want.
     device - the name of the device, for which you want to detect cycles.
-    model - either "knn" or "gmm". User needs to pass in this parameter
+    model - one of the following. User needs to pass in this parameter
+            1. "knn" - full batch KMeans
+            2. "minibatch" - MiniBatchKMeans, trained chunk by chunk with partial_fit
+            3. "threshold" - exact 1-D two-cluster solver, prediction is a single threshold comparison
+            4. "gmm" - Gaussian mixture, fitted on a random subsample of GMM_SUBSAMPLE datapoints
     mode - "test" or "train"
+    covariance_type - covariance type of the "gmm" model.
+    house - the house the training set comes from, used to name the labelled training set.
     '''
     self.n_clusters = n_clusters
     self.df = df
     self.device = device
+    self.house = house
     self.mode = mode
     self.aws_api = aws_api
-    if model == "knn":
-      self.model = KMeans(n_clusters= self.n_clusters, random_state=0) # Two states of the device: ON cycle and OFF cycle
-    elif model!="knn" or model!="gmm":
-      raise ValueError("The value passed in for the value paramter is incorrect")
+    self.model_name = model
+    self.covariance_type = covariance_type
+    self.cluster_on = None # The highest cluster
+    self.clusters_on = None # ON/OFF of every cluster (see on_clusters)
+    self.centroids = None
+    self.variances = None # Only for "gmm": per cluster variance and weight
+    self.weights = None
+    if model not in MODELS:
+      raise ValueError(f"The value passed in for the model parameter is incorrect. Use one of {MODELS}")
+    if model == "threshold" and n_clusters != 2:
+      raise ValueError("The threshold model only supports n_clusters = 2")
+    self.model = None # The sklearn model, only created when fitting (see estimator)
 
-  def KMeansTraining(self):
+  def estimator(self, warm_start: bool = False):
     '''
-    Function will return a dataframe, and also dump it into a csv file.
+    The sklearn model that fits the selected model, created (and sklearn imported) on first use. A detector restored
+    with load_trained classifies with NumPy alone, so a warm start never imports sklearn.
+    warm_start - replace the sklearn model with one initialised from the trained state instead (see refit).
     '''
+    if self.model is None or warm_start:
+      init = {}
+      match self.model_name:
+        case "knn":
+          from sklearn.cluster import KMeans
+          if warm_start:
+            init = {"init": self.centroids.reshape(-1, 1), "n_init": 1}
+          self.model = KMeans(n_clusters= self.n_clusters, random_state=0, **init) # Two states of the device: ON cycle and OFF cycle
+        case "minibatch":
+          from sklearn.cluster import MiniBatchKMeans
+          init = {"init": self.centroids.reshape(-1, 1), "n_init": 1} if warm_start else {"n_init": 3}
+          self.model = MiniBatchKMeans(n_clusters= self.n_clusters, random_state=0, batch_size=4096, **init)
+        case "gmm":
+          from sklearn.mixture import GaussianMixture
+          if warm_start:
+            precisions = 1 / self.variances
+            precisions = {"spherical": precisions, "diag": precisions.reshape(-1, 1), "tied": np.array([[precisions.mean()]]), "full": precisions.reshape(-1, 1, 1)}[self.covariance_type]
+            init = {"means_init": self.centroids.reshape(-1, 1), "weights_init": self.weights / self.weights.sum(), "precisions_init": precisions}
+          self.model = GaussianMixture(n_components= self.n_clusters, covariance_type=self.covariance_type, random_state=0, **init)
+    return self.model
 
-    # Data frame creation
-    self.df['Power Cycle'] = self.model.fit_predict(self.df[[self.device]]) # Add a new column called power cycle. This becomes z_k
+  def parameters(self) -> dict:
+    '''
+    The parameters that define a trained model, used to fingerprint stored models.
+    '''
+    parameters = {"model": self.model_name, "n_clusters": self.n_clusters, "random_state": 0}
+    if self.model_name == "gmm":
+      parameters["covariance_type"] = self.covariance_type
+      parameters["subsample"] = GMM_SUBSAMPLE
+    return parameters
+
+  def trained_state(self) -> dict:
+    '''
+    Everything needed to classify datapoints with the trained model (see load_trained and ModelStore).
+    '''
+    return {
+      "centroids" : self.centroids.tolist(),
+      "cluster_on" : self.cluster_on,
+      "variances" : self.variances.tolist() if self.variances is not None else None,
+      "weights" : self.weights.tolist() if self.weights is not None else None
+    }
+
+  def load_trained(self, centroids, cluster_on: int, variances = None, weights = None) -> None:
+    '''
+    Function to restore a trained model from its centroids and ON cluster (see ModelStore), without refitting.
+    '''
+    self.centroids = np.asarray(centroids, dtype=float).ravel()
+    self.cluster_on = int(cluster_on)
+    self.clusters_on = on_clusters(self.centroids)
+    self.variances = np.asarray(variances, dtype=float).ravel() if variances is not None else None
+    self.weights = np.asarray(weights, dtype=float).ravel() if weights is not None else None
+
+  def release_training_data(self) -> None:
+    '''
+    Function to drop the training frame (with its labelled column) and the per datapoint labels the fitted sklearn
+    model keeps. Classification only needs the trained state.
+    '''
+    self.df = None
+    if self.model is not None and hasattr(self.model, "labels_"):
+      del self.model.labels_
+
+  def fit_chunks(self, data_chunks) -> None:
+    '''
+    Function to train the "minibatch" model from an iterable of chunks of datapoints (e.g. read_csv with chunksize),
+    so the training history never has to be in memory at once.
+    '''
+    if self.model_name != "minibatch":
+      raise ValueError("fit_chunks is only available for the minibatch model")
+    self.estimator()
+    for chunk in data_chunks:
+      self.model.partial_fit(np.asarray(chunk, dtype=float).reshape(-1, 1))
+    self.load_trained(centroids = self.model.cluster_centers_, cluster_on = int(np.argmax(self.model.cluster_centers_)))
+
+  def fit(self, values) -> None:
+    '''
+    Function to train the selected model on an array of datapoints.
+    '''
+    values = np.asarray(values, dtype=float).reshape(-1)
+    match self.model_name:
+      case "knn":
+        self.estimator().fit(values.reshape(-1, 1))
+        centroids = self.model.cluster_centers_
+      case "minibatch":
+        self.fit_chunks(chunks(values))
+        return
+      case "threshold":
+        centroids = np.array(two_means_1d(values))
+      case "gmm":
+        sample = values
+        if len(values) > GMM_SUBSAMPLE:
+          sample = values[np.random.default_rng(0).integers(0, len(values), GMM_SUBSAMPLE)]
+        self.estimator().fit(sample.reshape(-1, 1))
+        centroids = self.model.means_
+        self.variances = np.broadcast_to(np.asarray(self.model.covariances_, dtype=float).reshape(-1), (self.n_clusters,)).copy()
+        self.weights = self.model.weights_.copy()
+    centroids = np.asarray(centroids, dtype=float).ravel()
+    # The ON cluster is the one with the highest mean power
+    self.load_trained(centroids = centroids, cluster_on = int(np.argmax(centroids)), variances = self.variances, weights = self.weights)
+
+  def refit(self, values) -> None:
+    '''
+    Function to retrain the trained model on new datapoints (e.g. the recent stream, see ModelRefresh), starting from
+    its current clusters instead of from scratch, so a model whose power levels drifted converges in a few iterations.
+    The new clusters take the indices of the clusters they replace (in order of power), so a cycle in progress keeps
+    its label across the refit.
+    '''
+    previous = self.centroids.copy()
+    values = np.asarray(values, dtype=float).reshape(-1)
+    if self.model_name == "gmm":
+      # EM started from drifted components can leave a component without any datapoint. It is started from the
+      # datapoints nearest to every previous centroid instead.
+      labels = np.abs(values[:, None] - previous[None, :]).argmin(axis=1)
+      counts = np.bincount(labels, minlength=self.n_clusters)
+      sums = np.bincount(labels, weights=values, minlength=self.n_clusters)
+      means = np.where(counts > 0, sums / np.maximum(counts, 1), previous)
+      squares = np.bincount(labels, weights=(values - means[labels]) ** 2, minlength=self.n_clusters)
+      variances = np.where(counts > 1, squares / np.maximum(counts, 1), self.variances)
+      self.load_trained(centroids = means, cluster_on = self.cluster_on, variances = np.maximum(variances, 1e-6), weights = np.maximum(counts, 1) / max(counts.sum(), 1))
+    if self.model_name != "threshold":
+      self.estimator(warm_start = True)
+    self.fit(values)
+    order = np.empty(len(previous), dtype=int)
+    order[np.argsort(previous)] = np.argsort(self.centroids)
+    self.load_trained(
+      centroids = self.centroids[order],
+      cluster_on = int(np.argmax(self.centroids[order])),
+      variances = self.variances[order] if self.variances is not None else None,
+      weights = self.weights[order] if self.weights is not None else None)
+
+  def KMeansTraining(self, upload: bool = True):
+    '''
+    Function will train the selected model, return a dataframe, and also dump it into a gzip compressed csv file.
+    upload - set to False to skip dumping the labelled dataframe into S3 (e.g. when training in a worker process).
+    '''
 
-    cluster_on = self.df.groupby('Power Cycle')[self.device].mean().idxmax()
+    # Data frame creation
+    self.fit(self.df[self.device].to_numpy())
+    self.df['Power Cycle'] = self.classify(self.df[self.device].to_numpy()) # Add a new column called power cycle. This becomes z_k
 
     # Uncomment the line below, if ON or OFF output is preferred to 1s and 0s.
-    # self.df['Power Cycle'] = self.df['Power Cycle'].map({cluster_on: 'ON', 1 - cluster_on: 'OFF'})
+    # self.df['Power Cycle'] = self.df['Power Cycle'].map({self.cluster_on: 'ON', 1 - self.cluster_on: 'OFF'})
+
+    if not upload:
+      return self.df
 
     # Data dump into csv file.
-    target_directory = f"training/refrigerator/House_1_{self.device}_{self.mode}_labelled.csv"
+    target_directory = f"training/refrigerator/{self.house}_{self.device}_{self.mode}_labelled.csv.gz"
 
     '''
     Data will be put into a file with the following format:
-    "./drive/MyDrive/Datasets/House_1_{self.device}_labelled.csv"
+    "./drive/MyDrive/Datasets/{self.house}_{self.device}_labelled.csv.gz"
+    The csv is written in chunks to a compressed temporary file and streamed to S3 from there, instead of being
+    built as one string in memory.
     '''
-    with io.StringIO() as csv_buffer:
-      self.df.to_csv(csv_buffer, index=False)
-      self.aws_api.write_to_bucket(bucket_name=AWS_S3_BUCKET_TRAINING, target_directory=target_directory, body=csv_buffer.getvalue())
+    with tempfile.TemporaryDirectory() as directory:
+      csv_path = os.path.join(directory, "labelled.csv.gz")
+      self.df.to_csv(csv_path, index=False, compression="gzip", chunksize=100000)
+      with open(csv_path, "rb") as csv_file:
+        self.aws_api.upload_to_bucket(bucket_name=AWS_S3_BUCKET_TRAINING, target_directory=target_directory, fileobj=csv_file)
 
     return self.df
 
@@ -62,53 +276,84 @@ class CycleDetection:
     Function takes in a single datapoint and tells you if it is part of
     an on cycle or an off cycle.
     '''
-    # Use the KMeans model to predict the cluster for the single data point
-    power_cycle = self.model.predict(datapoint)[0]
+    # Use the trained centroids to predict the cluster for the single data point
+    power_cycle = self.classify(datapoint)[0]
 
-    # Determine the cluster representing ON and OFF states
-    cluster_on = self.df.groupby('Power Cycle')[self.device].mean().idxmax()
-
-    # Map the cluster label to 'ON' or 'OFF'
-    # power_cycle_label = 'ON' if power_cycle == cluster_on else 'OFF'
+    # Map the cluster label to 'ON' or 'OFF', using the ON cluster cached at training time
+    # power_cycle_label = 'ON' if power_cycle == self.cluster_on else 'OFF'
     return power_cycle #, power_cycle_label
 
+  def classify(self, values) -> np.ndarray:
+    '''
+    Function to assign a whole batch of datapoints to their clusters in one NumPy call, without the per-call
+    input validation of the sklearn models.
+      - Gaussian mixture: the cluster with the highest weighted log likelihood (as GaussianMixture.predict).
+      - Two centroids: a single comparison against the midpoint between them (nearest centroid).
+      - Otherwise: the nearest centroid (as KMeans.predict).
+    '''
+    values = np.asarray(values, dtype=float).reshape(-1)
+    if self.variances is not None:
+      log_likelihood = np.log(self.weights) - 0.5 * np.log(2 * np.pi * self.variances) - (values[:, None] - self.centroids[None, :]) ** 2 / (2 * self.variances)
+      return log_likelihood.argmax(axis=1)
+    if len(self.centroids) == 2:
+      low, high = (0, 1) if self.centroids[0] <= self.centroids[1] else (1, 0)
+      threshold = (self.centroids[0] + self.centroids[1]) / 2
+      labels = np.where(values > threshold, high, low)
+      labels[values == threshold] = 0 # Equidistant datapoints go to the lowest cluster index, like KMeans.predict
+      return labels
+    return np.abs(values[:, None] - self.centroids[None, :]).argmin(axis=1)
+
+  def is_on(self, labels) -> np.ndarray:
+    '''
+    Function to map cluster labels to True for ON and False for OFF. Every cluster above the ON/OFF split of the
+    centroids is ON (see on_clusters).
+    '''
+    return self.clusters_on[np.asarray(labels)]
+
   def bulk_detect_on_off(self, data):
     '''
     Function to detect if a group of points "data" is on or off individually.
     '''
-    return self.model.predict(data[[self.device]])
+    return self.classify(data[self.device].to_numpy())
 
   def evaluation(self, ground_truth, test_data, metric = "acc"):
     '''
     Function to evaluate the trained dataset against the test data set, according the metric
-    provided in the argument.
+    provided in the argument. The datapoints are classified once and every metric comes from the same confusion
+    matrix (see Evaluation).
 
-    ground_truth - dataframe object that represents the ground truth
+    ground_truth - the ON (1) / OFF (0) state of every datapoint of test_data.
     metric -  can be one of the following:
               1. "acc" - accuracy
               2. "prec" - precision
-              3. "f1" - f1 score
+              3. "rec" - recall
+              4. "f1" - f1 score
+              5. "all" - a dict with every metric above
     '''
-
-    #Step 1: Calculate the predicted values first
-    predicted_values = self.bulk_detect_on_off(test_data)
-    print(type(predicted_values), type(ground_truth))
-
-    print(f"Ground truth values: {ground_truth}\n")
-    print(f"Obtained predicted values: {predicted_values}\nComputing {metric} metric now...")
-
-    match metric:
-      case "acc":
-        return metrics.accuracy_score(y_true = list(ground_truth), y_pred = list(predicted_values))
-      case "prec":
-        return metrics.precision_score(y_true = list(ground_truth), y_pred = list(predicted_values))
-      case "f1":
-        return metrics.f1_score(y_true = list(ground_truth), y_pred = list(predicted_values))
-      case _:
-        raise ValueError('''
+    if metric != "all" and metric not in Evaluation.METRICS:
+      raise ValueError('''
               Provide a valid metric:\n
               \t1. "acc" - accuracy\n
               \t2. "prec" - precision\n
-              \t3. "f1" - f1 score"\n
+              \t3. "rec" - recall\n
+              \t4. "f1" - f1 score\n
+              \t5. "all" - every metric above\n
             '''
-            )
\ No newline at end of file
+            )
+
+    #Step 1: Calculate the predicted values first
+    predicted_on = self.is_on(self.bulk_detect_on_off(test_data))
+
+    scores = Evaluation.Evaluation().update(ground_truth = np.asarray(ground_truth), predicted = predicted_on).scores()
+    return scores if metric == "all" else scores[metric]
+
+  def evaluate_chunks(self, data_chunks, label_column: str) -> Evaluation.Evaluation:
+    '''
+    Function to evaluate the trained model on a test set read in chunks (e.g. read_csv with chunksize), for test sets
+    that do not fit in memory. Every chunk is a dataframe with the device column and its ON/OFF ground truth in
+    label_column. Returns the Evaluation, see Evaluation.scores for the metrics.
+    '''
+    evaluation = Evaluation.Evaluation()
+    for chunk in data_chunks:
+      evaluation.update(ground_truth = chunk[label_column].to_numpy(), predicted = self.is_on(self.bulk_detect_on_off(chunk)))
+    return evaluation
@@ -0,0 +1,48 @@
+import numpy as np
+
+FEATURES = ("duration", "energy", "peak", "variance", "gap")
+
+class CycleFeatures:
+  '''
+  Extracts a feature vector for every cycle closed by CycleSegmenter.segment:
+    - duration: seconds from the cycle's first datapoint to the next cycle's first datapoint
+    - energy: Wh used during the cycle (average power times duration)
+    - peak: highest power of the cycle
+    - variance: variance of the power within the cycle
+    - gap: duration of the cycle before it, e.g. the OFF period before an ON cycle. The previous cycle is carried
+      across batches, so only the very first cycle has no gap (NaN).
+
+  Every feature is a reduction over the cycles' datapoints, computed for all cycles of a batch at once (reusing the
+  sums and squared deviations of SegmentedCycles), and written into a preallocated buffer that grows on demand.
+  '''
+
+  def __init__(self, capacity: int = 256, log_scale: bool = True) -> None:
+    '''
+    log_scale - return log(1 + feature) instead of the raw features. Durations, energies and gaps are heavily skewed,
+                so on a log scale they are much closer to the Gaussian the Mahalanobis scorer assumes.
+    '''
+    self.buffer = np.empty((capacity, len(FEATURES)))
+    self.log_scale = log_scale
+    self.previous_duration = np.nan
+
+  def extract(self, cycles) -> np.ndarray:
+    '''
+    Returns a (cycles, FEATURES) array. It is a view into the buffer, only valid until the next call.
+    '''
+    count = len(cycles)
+    if count > len(self.buffer):
+      self.buffer = np.empty((1 << (count - 1).bit_length(), len(FEATURES)))
+    features = self.buffer[:count]
+    if count == 0:
+      return features
+    duration, energy, peak, variance, gap = features.T
+    np.divide(np.asarray(cycles.end_timestamps, dtype="datetime64[us]") - np.asarray(cycles.start_timestamps, dtype="datetime64[us]"), np.timedelta64(1, "s"), out=duration)
+    np.multiply(cycles.means, duration / 3600, out=energy)
+    peak[:] = np.maximum.reduceat(cycles.values[:cycles.bounds[-1]], cycles.bounds[:-1])
+    np.divide(cycles.m2, cycles.lengths, out=variance)
+    gap[0] = self.previous_duration
+    gap[1:] = duration[:-1]
+    self.previous_duration = duration[-1]
+    if self.log_scale:
+      np.log1p(np.maximum(features, 0, out=features), out=features) # NaN gaps stay NaN
+    return features
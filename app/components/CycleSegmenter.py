@@ -0,0 +1,114 @@
+import numpy as np
+
+class SegmentedCycles:
+  '''
+  The cycles closed by one call to CycleSegmenter.segment, as parallel arrays (one entry per cycle).
+
+  values - the datapoints the cycles were cut from (pending datapoints from earlier batches first).
+  bounds - offsets into values, cycle k is values[bounds[k]:bounds[k+1]].
+  '''
+  def __init__(self, values, bounds, labels, start_timestamps, end_timestamps) -> None:
+    self.values = values
+    self.bounds = bounds
+    self.labels = labels
+    self.start_timestamps = start_timestamps
+    self.end_timestamps = end_timestamps
+    self.lengths = np.diff(bounds)
+    if len(self.lengths):
+      self.sums = np.add.reduceat(values[:bounds[-1]], bounds[:-1])
+      self.means = self.sums / self.lengths
+      deviations = values[:bounds[-1]] - np.repeat(self.means, self.lengths)
+      self.m2 = np.add.reduceat(deviations * deviations, bounds[:-1])
+    else:
+      self.sums = self.means = self.m2 = np.empty(0)
+
+  def __len__(self) -> int:
+    return len(self.lengths)
+
+  def cycle(self, k: int) -> np.ndarray:
+    return self.values[self.bounds[k]:self.bounds[k + 1]]
+
+class CycleSegmenter:
+  '''
+  Splits a stream of classified datapoints into power cycles, one batch at a time.
+
+  Cycle boundaries are found with a vectorized run-length pass over the labels (the indices where the label
+  changes), and the per-cycle reductions are done with np.add.reduceat. The unfinished cycle at the end of a
+  batch is kept, together with its label and start timestamp, and continued by the next batch.
+  '''
+  def __init__(self, min_cycle_length: int = 2) -> None:
+    self.min_cycle_length = min_cycle_length
+    self.previous_cycle = -1
+    self.cycle_label = -1
+    self.start_timestamp = None
+    self.buffer = np.empty(0)
+
+  def segment(self, timestamps, values, labels) -> SegmentedCycles:
+    '''
+    timestamps - the timestamp of every datapoint in the batch.
+    values - the power datapoints.
+    labels - the cluster label (ON/OFF cycle) of every datapoint.
+    '''
+    timestamps = np.asarray(timestamps)
+    values = np.asarray(values, dtype=float)
+    labels = np.asarray(labels)
+    if len(values) == 0:
+      return SegmentedCycles(self.buffer, np.zeros(1, dtype=np.intp), labels, [], [])
+
+    if self.previous_cycle == -1:
+      # If the previous cycle is uninitialized, the first datapoint starts the first cycle.
+      self.previous_cycle = labels[0]
+      self.cycle_label = labels[0]
+      self.start_timestamp = timestamps[0]
+
+    previous_labels = np.empty_like(labels)
+    previous_labels[0] = self.previous_cycle
+    previous_labels[1:] = labels[:-1]
+    changes = np.flatnonzero(labels != previous_labels)
+
+    # The minimum number of datapoints to qualify as a cycle is 2. If the power cycle oscillates between ON and OFF
+    # before the current cycle has accumulated enough datapoints, the change is absorbed into the current cycle.
+    # Only change points are visited here, so this loop is short compared to the batch.
+    pending = len(self.buffer)
+    cycle_start = -pending
+    ends = []
+    for change in changes:
+      if change - cycle_start >= self.min_cycle_length:
+        ends.append(change)
+        cycle_start = change
+
+    ends = np.asarray(ends, dtype=np.intp)
+    combined = np.concatenate((self.buffer, values)) if pending else values
+    bounds = np.concatenate(([0], ends + pending)) if len(ends) else np.zeros(1, dtype=np.intp)
+    start_timestamps = [self.start_timestamp] + list(timestamps[ends[:-1]])
+    end_timestamps = list(timestamps[ends])
+    cycle_labels = np.concatenate(([self.cycle_label], labels[ends[:-1]])) if len(ends) else np.empty(0, dtype=labels.dtype)
+    cycles = SegmentedCycles(combined, bounds, cycle_labels, start_timestamps[:len(ends)], end_timestamps)
+
+    if len(ends):
+      self.start_timestamp = timestamps[ends[-1]]
+      self.cycle_label = labels[ends[-1]]
+    self.buffer = combined[cycle_start + pending:].copy()
+    self.previous_cycle = labels[-1]
+    return cycles
+
+  def state(self) -> dict:
+    '''
+    The cycle in progress: its label, start timestamp and the datapoints received so far, for checkpointing.
+    '''
+    return {
+      "min_cycle_length" : self.min_cycle_length,
+      "previous_cycle" : int(self.previous_cycle),
+      "cycle_label" : int(self.cycle_label),
+      "start_timestamp" : str(np.datetime64(self.start_timestamp, "us")) if self.start_timestamp is not None else None,
+      "buffer" : self.buffer.tolist()
+    }
+
+  @classmethod
+  def from_state(cls, state: dict) -> "CycleSegmenter":
+    segmenter = cls(min_cycle_length=state["min_cycle_length"])
+    segmenter.previous_cycle = state["previous_cycle"]
+    segmenter.cycle_label = state["cycle_label"]
+    segmenter.start_timestamp = np.datetime64(state["start_timestamp"], "us") if state["start_timestamp"] is not None else None
+    segmenter.buffer = np.asarray(state["buffer"], dtype=float)
+    return segmenter
@@ -0,0 +1,94 @@
+import numpy as np
+
+DRIFT_HALF_LIFE = 20000 # Datapoints after which an observation of the cluster assignments weighs half
+DRIFT_CYCLE_HALF_LIFE = 200 # Cycles after which an observation of the cycle scores weighs half
+DRIFT_CENTROID_SHIFT = 0.1 # Largest shift of the mean power of a cluster, relative to the gap between the trained centroids
+DRIFT_ALARM_RATE = 0.05 # Largest fraction of recent cycles raising an alarm, about 20 times the false alarm rate of the sigma rule
+DRIFT_MIN_SAMPLES = 20000 # Datapoints observed since the (re)training before drift can be reported
+
+class DriftMonitor:
+  '''
+  Drift statistics of a trained cycle detector on the stream it classifies.
+
+  - Cluster assignments: the exponentially weighted mean power of the datapoints assigned to every cluster. Right
+    after training it matches the centroid of the cluster. When the power levels of the appliance drift, it moves
+    away from it, and is reported relative to the smallest gap between two centroids (the margin of the
+    segmentation).
+  - Cycle scores: the exponentially weighted fraction of scored cycles that raised an alarm. A broken segmentation
+    cuts cycles at the wrong places, which shows as a burst of anomalous cycles.
+
+  Both are updated with a couple of bincounts per batch, so they can be tracked in the scoring loop.
+  '''
+
+  def __init__(self, centroids, half_life: int = DRIFT_HALF_LIFE, cycle_half_life: int = DRIFT_CYCLE_HALF_LIFE, centroid_shift: float = DRIFT_CENTROID_SHIFT, alarm_rate: float = DRIFT_ALARM_RATE, min_samples: int = DRIFT_MIN_SAMPLES) -> None:
+    '''
+    centroids - the centroids of the trained cycle detector, in cluster order.
+    centroid_shift, alarm_rate - the thresholds above which drift is reported (see drifted).
+    '''
+    self.half_life = half_life
+    self.cycle_half_life = cycle_half_life
+    self.centroid_shift = centroid_shift
+    self.alarm_rate = alarm_rate
+    self.min_samples = min_samples
+    self.reset(centroids)
+
+  def reset(self, centroids) -> None:
+    '''
+    Start over from a (re)trained cycle detector.
+    '''
+    self.centroids = np.asarray(centroids, dtype=float).ravel()
+    gaps = np.diff(np.sort(self.centroids))
+    self.gap = max(float(gaps.min()), np.finfo(float).tiny) if len(gaps) else 1.0
+    self.weights = np.zeros(len(self.centroids))
+    self.sums = np.zeros(len(self.centroids))
+    self.cycles = 0.0
+    self.alarms = 0.0
+    self.samples = 0
+
+  def observe(self, values, labels) -> None:
+    '''
+    Fold in a classified batch: its datapoints and their cluster labels.
+    '''
+    labels = np.asarray(labels).reshape(-1)
+    if len(labels) == 0:
+      return
+    decay = 0.5 ** (len(labels) / self.half_life)
+    self.weights = self.weights * decay + np.bincount(labels, minlength=len(self.centroids))
+    self.sums = self.sums * decay + np.bincount(labels, weights=np.asarray(values, dtype=float).reshape(-1), minlength=len(self.centroids))
+    self.samples += len(labels)
+
+  def observe_cycles(self, cycles: int, alarms: int) -> None:
+    '''
+    Fold in the verdicts of a batch: the number of cycles scored and how many of them raised an alarm.
+    '''
+    if cycles == 0:
+      return
+    decay = 0.5 ** (cycles / self.cycle_half_life)
+    self.cycles = self.cycles * decay + cycles
+    self.alarms = self.alarms * decay + alarms
+
+  def statistics(self) -> dict:
+    '''
+    centroid_shift - the largest shift of the mean power of a cluster from its centroid, relative to the gap.
+    alarm_rate - the fraction of recent cycles that raised an alarm.
+    '''
+    seen = self.weights > 0
+    shifts = np.abs(self.sums[seen] / self.weights[seen] - self.centroids[seen]) / self.gap
+    return {
+      "centroid_shift" : float(shifts.max()) if len(shifts) else 0.0,
+      "alarm_rate" : self.alarms / self.cycles if self.cycles else 0.0,
+      "samples" : self.samples
+    }
+
+  def drifted(self) -> str | None:
+    '''
+    Returns why the cycle detector should be retrained, or None while the statistics are within their thresholds.
+    '''
+    if self.samples < self.min_samples:
+      return None
+    statistics = self.statistics()
+    if statistics["centroid_shift"] > self.centroid_shift:
+      return f"cluster mean shifted by {statistics['centroid_shift']:.2f} of the gap between centroids"
+    if statistics["alarm_rate"] > self.alarm_rate:
+      return f"{statistics['alarm_rate']:.1%} of recent cycles raised an alarm"
+    return None
@@ -0,0 +1,75 @@
+import numpy as np
+
+METRICS = ("acc", "prec", "rec", "f1")
+
+def parse_ground_truth(labels) -> np.ndarray:
+  '''
+  ON/OFF ground truth as booleans. Numeric or boolean labels are ON when non zero, text labels must be "ON" or "OFF"
+  (any case): any other text raises a ValueError instead of counting as ON.
+  '''
+  labels = np.asarray(labels).reshape(-1)
+  if labels.dtype.kind in "biuf":
+    return labels.astype(bool, copy=False)
+  text = np.char.upper(np.char.strip(labels.astype(str)))
+  on = text == "ON"
+  unknown = ~on & (text != "OFF")
+  if unknown.any():
+    raise ValueError(f"Unknown ON/OFF labels {sorted(set(text[unknown].tolist()))[:10]}, use ON/OFF or 1/0")
+  return on
+
+def confusion_matrix(ground_truth, predicted) -> np.ndarray:
+  '''
+  Counts of binary labels (see parse_ground_truth) as [[true OFF, false ON], [false OFF, true ON]], from three counts
+  over boolean arrays instead of one pass per metric.
+  '''
+  truth = parse_ground_truth(ground_truth)
+  predicted = np.asarray(predicted).reshape(-1).astype(bool, copy=False)
+  if len(truth) != len(predicted):
+    raise ValueError(f"ground_truth and predicted have different lengths ({len(truth)} and {len(predicted)})")
+  true_on = np.count_nonzero(truth & predicted)
+  false_on = np.count_nonzero(predicted) - true_on
+  false_off = np.count_nonzero(truth) - true_on
+  true_off = len(truth) - true_on - false_on - false_off
+  return np.array([[true_off, false_on], [false_off, true_on]], dtype=np.int64)
+
+def scores(confusion: np.ndarray) -> dict:
+  '''
+  Every metric in METRICS from a confusion matrix. A metric without any predicted or actual ON datapoint is 0, as
+  in sklearn.metrics.
+  '''
+  (true_off, false_on), (false_off, true_on) = np.asarray(confusion).tolist()
+  total = true_off + false_on + false_off + true_on
+  precision = true_on / (true_on + false_on) if true_on + false_on else 0.0
+  recall = true_on / (true_on + false_off) if true_on + false_off else 0.0
+  return {
+    "acc" : (true_on + true_off) / total if total else 0.0,
+    "prec" : precision,
+    "rec" : recall,
+    "f1" : 2 * true_on / (2 * true_on + false_on + false_off) if true_on else 0.0
+  }
+
+class Evaluation:
+  '''
+  Running confusion matrix of ON/OFF predictions against the ground truth.
+
+  Chunks of datapoints (e.g. read_csv with chunksize) are added with update, so a test set larger than memory is
+  evaluated one chunk at a time, and the evaluations of separate chunks or processes are combined with merge.
+  '''
+
+  def __init__(self) -> None:
+    self.confusion = np.zeros((2, 2), dtype=np.int64)
+
+  @property
+  def samples(self) -> int:
+    return int(self.confusion.sum())
+
+  def update(self, ground_truth, predicted) -> "Evaluation":
+    self.confusion += confusion_matrix(ground_truth, predicted)
+    return self
+
+  def merge(self, other: "Evaluation") -> "Evaluation":
+    self.confusion += other.confusion
+    return self
+
+  def scores(self) -> dict:
+    return scores(self.confusion)
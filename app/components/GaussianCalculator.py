@@ -1,10 +1,35 @@
 from statistics import NormalDist, mean, stdev
+from components.RunningMoments import RunningMoments
+from components.HistoryStore import HistoryStore
 
 class GaussianCalculator:
 
-  def __init__(self, data: list) -> None:
-    self._mean = self.mean(data)
-    self._stdev = self.stdev(data, xbar = self._mean)
+  def __init__(self, data: list = None, incremental: bool = False, decay: float = 1.0, window: int = None, moments: RunningMoments = None, history: HistoryStore = None) -> None:
+    '''
+    data - the normal operation datapoints used to seed the distribution.
+    moments - alternatively, previously computed running moments (e.g. from a stored model). Implies incremental mode.
+    incremental - if True, keep running moments so that push() updates the mean and stdev in constant time,
+                  instead of recomputing them over the whole history on every update().
+    decay, window - optional forgetting for the incremental mode. See RunningMoments.
+    history - alternatively, a bounded store of the normal operation datapoints. Implies incremental mode: push()
+              appends to the store, and the distribution follows the moments of the datapoints it retains.
+    '''
+    self.incremental = incremental or moments is not None or history is not None
+    self.history = history
+    if history is not None:
+      self._mean = history.moments.mean
+      self._stdev = history.moments.stdev()
+    elif moments is not None:
+      self._moments = moments
+      self._mean = self._moments.mean
+      self._stdev = self._moments.stdev()
+    elif self.incremental:
+      self._moments = RunningMoments.from_values(data, decay=decay, window=window)
+      self._mean = self._moments.mean
+      self._stdev = self._moments.stdev()
+    else:
+      self._mean = self.mean(data)
+      self._stdev = self.stdev(data, xbar = self._mean)
     print(f"Mean: {self._mean}\nStdev: {self._stdev}")
     self._pdf = 0
 
@@ -15,9 +40,48 @@ class GaussianCalculator:
     self._pdf = NormalDist(self._mean, self._stdev).pdf(datapoint)
 
   def update(self, data: list) -> None:
-    self._mean = self.mean(data)
-    self._stdev = self.stdev(data, xbar = self._mean)
-    print(f"Mean: {self._mean}\nStdev: {self._stdev}")
+    '''
+    Recompute the distribution from the complete normal operation history.
+    '''
+    if self.history is not None:
+      raise ValueError("update is not available with a history store, push the new datapoints instead")
+    if self.incremental:
+      self._moments = RunningMoments.from_values(data, decay=self._moments.decay, window=self._moments.window)
+      self._mean = self._moments.mean
+      self._stdev = self._moments.stdev()
+    else:
+      self._mean = self.mean(data)
+      self._stdev = self.stdev(data, xbar = self._mean)
+
+  def push(self, data: list) -> None:
+    '''
+    Add only the new normal operation datapoints (e.g. the last normal cycle) to the distribution.
+    Requires incremental mode.
+    '''
+    if not self.incremental:
+      raise ValueError("push is only available in incremental mode, use update with the full history instead")
+    if self.history is not None:
+      self.history.append(data)
+      self._mean = self.history.moments.mean
+      self._stdev = self.history.moments.stdev()
+      return
+    if self._moments.window is None:
+      # Summarise the new datapoints on their own, then merge them in a single step.
+      self._moments.merge(RunningMoments.from_values(data, decay=self._moments.decay))
+    else:
+      self._moments.extend(data)
+    self._mean = self._moments.mean
+    self._stdev = self._moments.stdev()
+
+  def state(self) -> dict:
+    '''
+    The running moments, for storing alongside a trained model. Requires incremental mode.
+    '''
+    if not self.incremental:
+      raise ValueError("state is only available in incremental mode")
+    if self.history is not None:
+      return self.history.moments.state()
+    return self._moments.state()
 
   def mean(self, data: list) -> None:
     return mean(data)
@@ -29,4 +93,4 @@ class GaussianCalculator:
     if datapoint > (self._mean + (3*self._stdev)) or datapoint < (self._mean - (3*self._stdev)):
       return True
     else:
-      return False
\ No newline at end of file
+      return False
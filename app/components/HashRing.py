@@ -0,0 +1,53 @@
+from bisect import bisect, insort
+from hashlib import md5
+
+REPLICAS = 128 # Points per node on the ring. More points spread the keys more evenly.
+
+def point(key: str) -> int:
+  return int.from_bytes(md5(key.encode()).digest()[:8], "big")
+
+class HashRing:
+  '''
+  Consistent hashing of stream keys (e.g. "House_1/Fridge") onto nodes (e.g. worker processes).
+
+  Every node is placed on a ring of 64 bit hashes at replicas points, and a key belongs to the node of the first
+  point at or after the key's own hash. Adding or removing a node only moves the keys between its points and the
+  points before them, about 1 / nodes of all keys, so the other nodes keep their streams (and their state).
+  '''
+
+  def __init__(self, nodes: list = (), replicas: int = REPLICAS) -> None:
+    self.replicas = replicas
+    self.points = []
+    self.owners = {}
+    for node in nodes:
+      self.add(node)
+
+  @property
+  def nodes(self) -> list:
+    return sorted(set(self.owners.values()))
+
+  def add(self, node: str) -> None:
+    for replica in range(self.replicas):
+      position = point(f"{node}#{replica}")
+      if position not in self.owners:
+        insort(self.points, position)
+      self.owners[position] = node
+
+  def remove(self, node: str) -> None:
+    for replica in range(self.replicas):
+      position = point(f"{node}#{replica}")
+      if self.owners.get(position) == node:
+        del self.owners[position]
+        self.points.remove(position)
+
+  def node(self, key: str) -> str:
+    '''
+    The node a key belongs to.
+    '''
+    if not self.points:
+      raise ValueError("The hash ring has no nodes")
+    index = bisect(self.points, point(key)) % len(self.points)
+    return self.owners[self.points[index]]
+
+  def assignment(self, keys) -> dict:
+    return {key: self.node(key) for key in keys}
@@ -0,0 +1,171 @@
+import json
+import os
+import numpy as np
+from time import time
+from components.RunningMoments import RunningMoments
+
+DROP_BLOCKS = 64 # A full history drops 1 / DROP_BLOCKS of its capacity at a time
+
+def summarise(values) -> RunningMoments:
+  '''
+  Moments of a batch of datapoints, with a vectorized two-pass sum in float64.
+  '''
+  moments = RunningMoments()
+  if len(values) == 0:
+    return moments
+  values = np.asarray(values, dtype=np.float64)
+  moments.count = moments.weight_sq = float(len(values))
+  moments.samples = len(values)
+  moments.mean = float(np.add.reduce(values)) / len(values)
+  deviations = values - moments.mean
+  moments.m2 = float(np.dot(deviations, deviations))
+  return moments
+
+class HistoryStore:
+  '''
+  Bounded history of normal operation datapoints, in a typed ring buffer.
+
+  The datapoints are kept as a fixed size array of dtype (float64 by default, so the moments match the ones of the
+  datapoints themselves; float32 halves the memory at about 1e-8 relative error in the moments) together with
+  their timestamps, optionally memory-mapped from files under path so the history stays out of the process heap and
+  survives restarts. Retention is by count (capacity) and optionally by age (max_age seconds): appending past the
+  capacity overwrites the oldest datapoints, a block of 1 / DROP_BLOCKS of the capacity at a time, and expire() drops
+  the ones older than max_age.
+
+  The running moments of the retained datapoints are kept up to date as datapoints are added and dropped (see
+  RunningMoments.merge and subtract), and recomputed exactly from the buffer every capacity drops to stop rounding
+  errors from accumulating.
+  '''
+
+  def __init__(self, capacity: int, max_age: float = None, dtype: str = "float64", path: str = None) -> None:
+    self.capacity = int(capacity)
+    self.dtype = np.dtype(dtype)
+    self.max_age = max_age
+    self.path = path
+    self.start = 0 # Index of the oldest datapoint
+    self.size = 0
+    self.dropped = 0 # Datapoints dropped since the moments were last recomputed
+    if path is not None:
+      os.makedirs(path, exist_ok=True)
+      header = self._load_header()
+      mode = "r+" if header is not None else "w+"
+      self.values = np.lib.format.open_memmap(os.path.join(path, "values.npy"), mode=mode, dtype=dtype, shape=(self.capacity,))
+      self.timestamps = np.lib.format.open_memmap(os.path.join(path, "timestamps.npy"), mode=mode, dtype="datetime64[us]", shape=(self.capacity,))
+      if header is not None:
+        self.start, self.size = header["start"], header["size"]
+    else:
+      self.values = np.empty(self.capacity, dtype=dtype)
+      self.timestamps = np.empty(self.capacity, dtype="datetime64[us]")
+    self.moments = summarise(self.ordered())
+
+  def _load_header(self) -> dict | None:
+    '''
+    The position of a history persisted under path, if it was written with the same capacity and dtype.
+    '''
+    header_path = os.path.join(self.path, "history.json")
+    if not os.path.exists(header_path):
+      return None
+    with open(header_path) as header_file:
+      header = json.load(header_file)
+    # Histories written before the dtype was recorded are float32
+    if header.get("capacity") != self.capacity or header.get("dtype", "float32") != self.dtype.name or not os.path.exists(os.path.join(self.path, "values.npy")):
+      return None
+    return header
+
+  def __len__(self) -> int:
+    return self.size
+
+  @property
+  def nbytes(self) -> int:
+    return self.values.nbytes + self.timestamps.nbytes
+
+  def ordered(self, timestamps: bool = False) -> np.ndarray:
+    '''
+    Copy of the retained datapoints (or their timestamps), oldest first.
+    '''
+    array = self.timestamps if timestamps else self.values
+    end = self.start + self.size
+    if end <= self.capacity:
+      return array[self.start:end].copy()
+    return np.concatenate((array[self.start:], array[:end - self.capacity]))
+
+  def append(self, values, timestamps = None, moments: RunningMoments = None) -> None:
+    '''
+    Add datapoints (stamped with the current time if no timestamps are given), dropping the oldest ones beyond the
+    capacity, then the ones older than max_age.
+    moments - the moments of values, when they are already known (e.g. stored with a trained model), instead of
+              summarising them again. Ignored if only part of values can be retained.
+    '''
+    values = np.asarray(values, dtype=self.values.dtype).reshape(-1)
+    if len(values) == 0:
+      return
+    if timestamps is None: # A single stamp, assigned to every slot
+      timestamps = np.datetime64(int(time() * 1000000), "us")
+    else:
+      timestamps = np.asarray(timestamps, dtype="datetime64[us]").reshape(-1)
+    if len(values) > self.capacity: # Only the newest capacity datapoints can be retained
+      moments = None
+      values = values[-self.capacity:]
+      timestamps = timestamps[-self.capacity:] if timestamps.ndim else timestamps
+    overflow = self.size + len(values) - self.capacity
+    if overflow > 0: # Drop a whole block of the oldest datapoints at once, so most appends do not drop any
+      self._drop(max(overflow, self.capacity // DROP_BLOCKS))
+    begin = (self.start + self.size) % self.capacity
+    head = min(len(values), self.capacity - begin)
+    self.values[begin:begin + head] = values[:head]
+    self.timestamps[begin:begin + head] = timestamps[:head] if timestamps.ndim else timestamps
+    if head < len(values): # Wrapped around the end of the ring
+      self.values[:len(values) - head] = values[head:]
+      self.timestamps[:len(values) - head] = timestamps[head:] if timestamps.ndim else timestamps
+    self.size += len(values)
+    self.moments.merge(moments if moments is not None else summarise(values))
+    if self.max_age is not None:
+      self.expire(now = timestamps[-1] if timestamps.ndim else timestamps)
+
+  def expire(self, now = None) -> None:
+    '''
+    Drop the datapoints older than max_age seconds before now (the newest timestamp, or the current time).
+    '''
+    if self.max_age is None or self.size == 0:
+      return
+    now = np.datetime64(int(time() * 1000000), "us") if now is None else np.datetime64(now, "us")
+    cutoff = now - np.timedelta64(int(self.max_age * 1000000), "us")
+    if self.timestamps[self.start] >= cutoff:
+      return
+    # Timestamps are appended in order, so the expired datapoints are a prefix of the history: binary search the
+    # two contiguous parts of the ring in place.
+    end = self.start + self.size
+    first = self.timestamps[self.start:min(end, self.capacity)]
+    expired = int(np.searchsorted(first, cutoff, side="left"))
+    if expired == len(first) and end > self.capacity:
+      expired += int(np.searchsorted(self.timestamps[:end - self.capacity], cutoff, side="left"))
+    self._drop(expired)
+
+  def _drop(self, count: int) -> None:
+    if count <= 0:
+      return
+    count = min(count, self.size)
+    head = min(count, self.capacity - self.start)
+    dropped = (self.values[self.start:self.start + head], self.values[:count - head])
+    self.start = (self.start + count) % self.capacity
+    self.size -= count
+    self.dropped += count
+    if self.dropped >= self.capacity:
+      self.moments = summarise(self.ordered())
+      self.dropped = 0
+    else:
+      for part in dropped:
+        self.moments.subtract(summarise(part))
+
+  def flush(self) -> None:
+    '''
+    Persist a memory-mapped history, so it is reopened where it was left after a restart.
+    '''
+    if self.path is None:
+      return
+    self.values.flush()
+    self.timestamps.flush()
+    header_path = os.path.join(self.path, "history.json")
+    with open(f"{header_path}.tmp", "w") as header_file:
+      json.dump({"capacity": self.capacity, "dtype": self.dtype.name, "start": self.start, "size": self.size}, header_file)
+    os.replace(f"{header_path}.tmp", header_path)
@@ -0,0 +1,140 @@
+import numpy as np
+
+GRID_SIZE = 1024 # Bins of the density grid
+KERNEL_RADIUS = 4.0 # The Gaussian kernel is truncated at this many bandwidths
+GRID_PADDING = 0.5 # Fraction of the seed range added on both sides of the grid, so new cycles still land on it
+ANOMALY_QUANTILE = 0.003 # Fraction of the seed cycles below the anomaly threshold, as the 3 sigma rule for a Gaussian
+
+class KDECalculator:
+  '''
+  Kernel density estimate of the average power of normal cycles, on a fixed grid.
+
+  Unlike the single Gaussian of GaussianCalculator, the density follows every mode of the cycle powers (e.g. the
+  ON and OFF cycles of a fridge, or a defrost cycle), so a cycle is anomalous when it is unlikely under all of them.
+
+  - The seed values are linearly binned onto GRID_SIZE bins and convolved with the Gaussian kernel through an FFT,
+    so fitting costs O(n + GRID_SIZE log GRID_SIZE) instead of O(n * GRID_SIZE).
+  - The log-density of every grid point is kept as a lookup table, and scoring a cycle is a linear interpolation
+    into it, in constant time.
+  - A new normal cycle adds its kernel to the grid points within KERNEL_RADIUS bandwidths of it, and only that slice
+    of the lookup table is recomputed. The bandwidth and grid are fixed when seeding.
+  - The anomaly threshold is the ANOMALY_QUANTILE quantile of the log-density of the seed values.
+  '''
+
+  def __init__(self, data: list = None, bandwidth: float = None, grid_size: int = GRID_SIZE, quantile: float = ANOMALY_QUANTILE) -> None:
+    '''
+    data - the average power of the normal cycles used to seed the density.
+    bandwidth - kernel bandwidth. Defaults to Silverman's rule of thumb on data.
+    '''
+    self.grid_size = grid_size
+    self.quantile = quantile
+    if data is None:
+      return
+    values = np.asarray(data, dtype=float).reshape(-1)
+    if len(values) < 2:
+      raise ValueError("At least two normal cycles are needed to seed the density")
+    self.bandwidth = float(bandwidth) if bandwidth is not None else self.silverman_bandwidth(values)
+    spread = max(values.max() - values.min(), self.bandwidth)
+    self.low = values.min() - GRID_PADDING * spread - KERNEL_RADIUS * self.bandwidth
+    self.high = values.max() + GRID_PADDING * spread + KERNEL_RADIUS * self.bandwidth
+    self.counts = np.zeros(grid_size)
+    self._setup()
+    self._bin(values)
+    self._convolve()
+    self.threshold = float(np.quantile(self.log_density(values), quantile))
+
+  @staticmethod
+  def silverman_bandwidth(values: np.ndarray) -> float:
+    spread = min(values.std(ddof=1), np.subtract(*np.percentile(values, [75, 25])) / 1.34)
+    if spread <= 0:
+      spread = values.std(ddof=1) if values.std(ddof=1) > 0 else max(abs(values.mean()) * 0.01, 1e-3)
+    return float(0.9 * spread * len(values) ** -0.2)
+
+  def _setup(self) -> None:
+    self.delta = (self.high - self.low) / (self.grid_size - 1)
+    self.radius = int(np.ceil(KERNEL_RADIUS * self.bandwidth / self.delta))
+    offsets = np.arange(-self.radius, self.radius + 1) * self.delta
+    self.kernel = np.exp(-0.5 * (offsets / self.bandwidth) ** 2) / (self.bandwidth * np.sqrt(2 * np.pi))
+
+  def _positions(self, values: np.ndarray) -> tuple:
+    '''
+    Left grid index and the weight of the right grid index of every value (clamped onto the grid).
+    '''
+    position = np.clip((values - self.low) / self.delta, 0, self.grid_size - 1)
+    left = np.minimum(position.astype(np.intp), self.grid_size - 2)
+    return left, position - left
+
+  def _bin(self, values: np.ndarray) -> None:
+    left, fraction = self._positions(values)
+    np.add.at(self.counts, left, 1 - fraction)
+    np.add.at(self.counts, left + 1, fraction)
+
+  def _convolve(self) -> None:
+    '''
+    Density of the whole grid: the binned counts convolved with the kernel, through an FFT.
+    '''
+    size = self.grid_size + len(self.kernel) - 1
+    size = 1 << (size - 1).bit_length()
+    full = np.fft.irfft(np.fft.rfft(self.counts, size) * np.fft.rfft(self.kernel, size), size)
+    self.raw_density = np.maximum(full[self.radius:self.radius + self.grid_size], 0) # Unnormalized, sum of kernels
+    self.total = float(self.counts.sum())
+    self.log_total = np.log(self.total)
+    self.log_table = np.log(self.raw_density + np.finfo(float).tiny)
+
+  def log_density(self, values) -> np.ndarray:
+    '''
+    Log-density of values, interpolated from the lookup table. Values off the grid have no density.
+    '''
+    values = np.asarray(values, dtype=float)
+    left, fraction = self._positions(values)
+    log_density = self.log_table[left] * (1 - fraction) + self.log_table[left + 1] * fraction - self.log_total
+    return np.where((values < self.low) | (values > self.high), -np.inf, log_density)
+
+  def is_anomalous(self, datapoint: float) -> bool:
+    '''
+    Datapoint here refers to the average power of last cycle.
+    '''
+    datapoint = float(datapoint)
+    if not self.low <= datapoint <= self.high:
+      return True
+    position = (datapoint - self.low) / self.delta
+    left = min(int(position), self.grid_size - 2)
+    fraction = position - left
+    return bool(self.log_table[left] * (1 - fraction) + self.log_table[left + 1] * fraction - self.log_total < self.threshold)
+
+  def push(self, data: list) -> None:
+    '''
+    Add the average power of new normal cycles to the density, updating only the grid points they affect.
+    '''
+    for value in np.asarray(data, dtype=float).reshape(-1).tolist():
+      position = min(max((value - self.low) / self.delta, 0.0), self.grid_size - 1.0)
+      left = min(int(position), self.grid_size - 2)
+      fraction = position - left
+      # Kernels of the two grid points the value is binned onto, over the grid points left - radius .. left + 1 + radius
+      contribution = np.zeros(len(self.kernel) + 1)
+      contribution[:-1] += (1 - fraction) * self.kernel
+      contribution[1:] += fraction * self.kernel
+      start, end = left - self.radius, left + self.radius + 2
+      contribution = contribution[max(-start, 0):len(contribution) - max(end - self.grid_size, 0)]
+      start, end = max(start, 0), min(end, self.grid_size)
+      self.counts[left] += 1 - fraction
+      self.counts[left + 1] += fraction
+      self.raw_density[start:end] += contribution
+      self.log_table[start:end] = np.log(self.raw_density[start:end] + np.finfo(float).tiny)
+      self.total += 1
+    self.log_total = np.log(self.total)
+
+  def state(self) -> dict:
+    '''
+    The grid and binned counts, for storing alongside a trained model. The lookup table is rebuilt from them.
+    '''
+    return {"low": float(self.low), "high": float(self.high), "bandwidth": self.bandwidth, "threshold": self.threshold, "quantile": self.quantile, "counts": self.counts.tolist()}
+
+  @classmethod
+  def from_state(cls, state: dict) -> "KDECalculator":
+    kde = cls(grid_size=len(state["counts"]), quantile=state["quantile"])
+    kde.low, kde.high, kde.bandwidth, kde.threshold = state["low"], state["high"], state["bandwidth"], state["threshold"]
+    kde.counts = np.asarray(state["counts"], dtype=float)
+    kde._setup()
+    kde._convolve()
+    return kde
@@ -0,0 +1,72 @@
+import json
+import os
+from hashlib import sha256
+from time import time
+import numpy as np
+
+MODEL_STORE_DIR = os.getenv("MODEL_STORE_DIR", ".model_store")
+MODEL_FORMAT_VERSION = 3
+
+class ModelStore:
+  '''
+  Local store of trained cycle detection models, so that a restart does not retrain on the whole training set.
+
+  An artifact holds the trained cycle detector (centroids, ON cluster and, for mixtures, variances and weights), the
+  running moments of the training set (restored as the Gaussian instead of summarising the training set again) and,
+  with the kde or mahalanobis scorers, the state of that scorer, for one device.
+  It is keyed by a fingerprint of the training data and the model parameters, so a model is only reused when it
+  was trained on exactly the same data with the same parameters. Artifacts also carry a format version; artifacts
+  written by another version are ignored and the model is retrained.
+  '''
+
+  def __init__(self, store_dir: str = MODEL_STORE_DIR) -> None:
+    self.store_dir = store_dir
+
+  @staticmethod
+  def fingerprint(values, parameters: dict) -> str:
+    '''
+    Hash of the training values (as contiguous float64) and the model parameters.
+    '''
+    digest = sha256(json.dumps(parameters, sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+  def _path(self, device: str, fingerprint: str) -> str:
+    name = "".join(character if character.isalnum() else "_" for character in device)
+    return os.path.join(self.store_dir, f"{name}-{fingerprint[:32]}.json")
+
+  def load(self, device: str, fingerprint: str) -> dict | None:
+    '''
+    Returns the stored artifact for this device and fingerprint, or None if there is no usable one.
+    '''
+    path = self._path(device, fingerprint)
+    if not os.path.exists(path):
+      return None
+    with open(path) as artifact_file:
+      artifact = json.load(artifact_file)
+    if artifact.get("version") != MODEL_FORMAT_VERSION or artifact.get("fingerprint") != fingerprint:
+      return None
+    return artifact
+
+  def save(self, device: str, fingerprint: str, parameters: dict, model_state: dict, gaussian_state: dict, scorer_state: dict = None) -> None:
+    '''
+    model_state - CycleDetection.trained_state()
+    gaussian_state - RunningMoments.state() of the training set
+    scorer_state - the kind and state of the cycle scorer if it is not the Gaussian (see Orchestrator.scorer_state)
+    '''
+    os.makedirs(self.store_dir, exist_ok=True)
+    artifact = {
+      "version" : MODEL_FORMAT_VERSION,
+      "device" : device,
+      "fingerprint" : fingerprint,
+      "parameters" : parameters,
+      "model" : model_state,
+      "gaussian" : gaussian_state,
+      "scorer" : scorer_state,
+      "created" : time()
+    }
+    path = self._path(device, fingerprint)
+    temporary_path = f"{path}.{os.getpid()}.tmp" # Several processes may store the same model at once
+    with open(temporary_path, "w") as artifact_file:
+      json.dump(artifact, artifact_file)
+    os.replace(temporary_path, path)
@@ -0,0 +1,101 @@
+import numpy as np
+
+SIGMA_RULE_PROBABILITY = 0.0027 # Probability outside 3 sigma of a Gaussian, the false alarm rate of the sigma rule
+REFACTOR_EVERY = 1000 # Incremental inverse updates between two exact refactorizations
+RIDGE = 1e-6 # Added to the diagonal (relative to the average variance), so constant features stay invertible
+
+class MultivariateGaussianCalculator:
+  '''
+  Multivariate Gaussian of normal cycle feature vectors (see CycleFeatures), scored with the Mahalanobis distance.
+
+  The mean and the scatter matrix (sum of outer products of the deviations) are updated with Welford's algorithm,
+  which adds a rank-1 term per new vector. The inverse of the scatter matrix is updated with the Sherman-Morrison
+  formula for the same rank-1 term, so scoring and updating stay O(features^2) as the history grows, with no matrix
+  inversion per cycle. Every REFACTOR_EVERY updates the inverse is recomputed exactly from a Cholesky factorization
+  to stop rounding errors from accumulating.
+
+  A vector is anomalous when its squared Mahalanobis distance exceeds the threshold: the chi-square quantile with as
+  many degrees of freedom as features, at the same false alarm probability as the 3 sigma rule. Cycle features are
+  heavy tailed, so if more seed vectors than that lie beyond it, the threshold is raised to the same quantile of the
+  seed vectors' distances.
+  '''
+
+  def __init__(self, data = None, probability: float = SIGMA_RULE_PROBABILITY) -> None:
+    '''
+    data - the (cycles, features) feature vectors of normal cycles used to seed the distribution. Rows with
+           missing (non-finite) features are ignored.
+    probability - false alarm probability of a normal cycle.
+    '''
+    self.probability = probability
+    if data is None:
+      return
+    data = np.asarray(data, dtype=float)
+    data = data[np.isfinite(data).all(axis=1)]
+    if len(data) <= data.shape[1]:
+      raise ValueError(f"At least {data.shape[1] + 1} normal cycles are needed to seed the distribution")
+    self.count = len(data)
+    self.mean = data.mean(axis=0)
+    deviations = data - self.mean
+    self.m2 = deviations.T @ deviations
+    self._refactor()
+    distances = np.einsum("ij,jk,ik->i", deviations, self.m2_inverse, deviations) * (self.count - 1)
+    from scipy.stats import chi2 # Only needed to seed the distribution, not to restore or score with a stored one
+    self.threshold = max(float(chi2.ppf(1 - probability, df=data.shape[1])), float(np.quantile(distances, 1 - probability)))
+
+  def _refactor(self) -> None:
+    '''
+    Exact inverse of the regularized scatter matrix, through its Cholesky factor.
+    '''
+    ridge = RIDGE * max(np.trace(self.m2) / len(self.m2), np.finfo(float).tiny)
+    lower_inverse = np.linalg.inv(np.linalg.cholesky(self.m2 + ridge * np.eye(len(self.m2))))
+    self.m2_inverse = lower_inverse.T @ lower_inverse
+    self.updates = 0
+
+  def mahalanobis(self, vector) -> float:
+    '''
+    Squared Mahalanobis distance of a feature vector from the mean.
+    '''
+    deviation = np.asarray(vector, dtype=float) - self.mean
+    return float(deviation @ self.m2_inverse @ deviation) * (self.count - 1) # The covariance is m2 / (count - 1)
+
+  def is_anomalous(self, vector) -> bool:
+    '''
+    Vectors with missing features (e.g. the gap of the very first cycle) are never anomalous.
+    '''
+    if not np.isfinite(vector).all():
+      return False
+    return self.mahalanobis(vector) > self.threshold
+
+  def push(self, data) -> None:
+    '''
+    Add the feature vectors of new normal cycles.
+    '''
+    for vector in np.atleast_2d(np.asarray(data, dtype=float)):
+      if not np.isfinite(vector).all():
+        continue
+      self.count += 1
+      delta = vector - self.mean
+      self.mean += delta / self.count
+      weight = (self.count - 1) / self.count # Welford: m2 += weight * delta delta^T
+      self.m2 += weight * np.outer(delta, delta)
+      projected = self.m2_inverse @ delta
+      self.m2_inverse -= weight * np.outer(projected, projected) / (1 + weight * (delta @ projected))
+      self.updates += 1
+      if self.updates >= REFACTOR_EVERY:
+        self._refactor()
+
+  def state(self) -> dict:
+    '''
+    The count, mean and scatter matrix, for storing alongside a trained model.
+    '''
+    return {"count": self.count, "mean": self.mean.tolist(), "m2": self.m2.tolist(), "probability": self.probability, "threshold": self.threshold}
+
+  @classmethod
+  def from_state(cls, state: dict) -> "MultivariateGaussianCalculator":
+    calculator = cls(probability=state["probability"])
+    calculator.count = state["count"]
+    calculator.mean = np.asarray(state["mean"], dtype=float)
+    calculator.m2 = np.asarray(state["m2"], dtype=float)
+    calculator.threshold = state["threshold"]
+    calculator._refactor()
+    return calculator
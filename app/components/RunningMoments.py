@@ -0,0 +1,173 @@
+from collections import deque
+from math import fsum, sqrt
+
+class RunningMoments:
+  '''
+  Running estimate of the mean and variance of a stream of power readings.
+
+  The state is the (weighted) count, the mean and M2 - the sum of squared deviations from the mean.
+  Each new datapoint is folded in with Welford's update, and two states can be combined with Chan's
+  parallel formula, so a whole cycle can be summarised on its own and merged in a single step.
+
+  decay - optional exponential forgetting factor in (0, 1]. 1 keeps every datapoint at full weight.
+  window - optional number of most recent datapoints to keep. Older datapoints are removed from the
+           moments as new ones arrive.
+  '''
+
+  def __init__(self, decay: float = 1.0, window: int = None) -> None:
+    if not 0 < decay <= 1:
+      raise ValueError("decay must be in the interval (0, 1]")
+    if window is not None and window < 2:
+      raise ValueError("window must hold at least 2 datapoints")
+    if window is not None and decay != 1.0:
+      raise ValueError("Use either decay or window, not both")
+    self.decay = decay
+    self.window = window
+    self.count = 0.0
+    self.mean = 0.0
+    self.m2 = 0.0
+    self.weight_sq = 0.0 # Sum of squared weights. Equal to count unless decay < 1.
+    self.samples = 0 # Number of datapoints pushed so far, regardless of their weight.
+    self._window = deque() if window is not None else None
+
+  @classmethod
+  def from_values(cls, data: list, decay: float = 1.0, window: int = None) -> "RunningMoments":
+    '''
+    Build the moments for a batch of datapoints.
+    Without decay or window this is done with an exact two-pass sum, matching statistics.mean/stdev.
+    '''
+    moments = cls(decay=decay, window=window)
+    if decay != 1.0 or window is not None:
+      moments.extend(data)
+      return moments
+    n = len(data)
+    if n == 0:
+      return moments
+    moments.count = float(n)
+    moments.weight_sq = float(n)
+    moments.samples = n
+    moments.mean = fsum(data) / n
+    moments.m2 = fsum((x - moments.mean) ** 2 for x in data)
+    return moments
+
+  def push(self, datapoint: float) -> None:
+    '''
+    Add a single datapoint to the moments in constant time.
+    '''
+    if self._window is not None:
+      if len(self._window) == self.window:
+        self._remove(self._window.popleft())
+      self._window.append(datapoint)
+    elif self.decay != 1.0:
+      self.count *= self.decay
+      self.m2 *= self.decay
+      self.weight_sq *= self.decay * self.decay
+    self.count += 1.0
+    self.weight_sq += 1.0
+    self.samples += 1
+    delta = datapoint - self.mean
+    self.mean += delta / self.count
+    self.m2 += delta * (datapoint - self.mean)
+
+  def extend(self, data: list) -> None:
+    for datapoint in data:
+      self.push(datapoint)
+
+  def _remove(self, datapoint: float) -> None:
+    '''
+    Inverse Welford update, used to drop the oldest datapoint of a sliding window.
+    '''
+    if self.count <= 1:
+      self.count = self.mean = self.m2 = self.weight_sq = 0.0
+      self.samples = 0
+      return
+    mean_without = (self.count * self.mean - datapoint) / (self.count - 1)
+    self.m2 -= (datapoint - mean_without) * (datapoint - self.mean)
+    self.m2 = max(self.m2, 0.0)
+    self.mean = mean_without
+    self.count -= 1.0
+    self.weight_sq -= 1.0
+    self.samples -= 1
+
+  def merge(self, other: "RunningMoments") -> None:
+    '''
+    Fold another set of moments into this one (Chan et al.). With decay, the current state is aged
+    by the other's number of datapoints before merging, as if its datapoints had been pushed one by one.
+    '''
+    if self._window is not None:
+      raise ValueError("Windowed moments cannot be merged, push the datapoints instead")
+    if other.count == 0:
+      return
+    if self.decay != 1.0:
+      aging = self.decay ** other.samples
+      self.count *= aging
+      self.m2 *= aging
+      self.weight_sq *= aging * aging
+    total = self.count + other.count
+    delta = other.mean - self.mean
+    self.mean += delta * other.count / total
+    self.m2 += other.m2 + delta * delta * self.count * other.count / total
+    self.weight_sq += other.weight_sq
+    self.samples += other.samples
+    self.count = total
+
+  def subtract(self, other: "RunningMoments") -> None:
+    '''
+    Remove a subset of the datapoints, summarised as other, from the moments (the inverse of merge). Used to drop
+    datapoints that fall out of a bounded history. Not available with decay.
+    '''
+    if self.decay != 1.0 or other.decay != 1.0:
+      raise ValueError("Decayed moments cannot be subtracted")
+    if other.count == 0:
+      return
+    remaining = self.count - other.count
+    if remaining <= 0:
+      self.count = self.mean = self.m2 = self.weight_sq = 0.0
+      self.samples = 0
+      return
+    mean = (self.count * self.mean - other.count * other.mean) / remaining
+    delta = other.mean - mean
+    self.m2 = max(self.m2 - other.m2 - delta * delta * remaining * other.count / self.count, 0.0)
+    self.mean = mean
+    self.count = remaining
+    self.weight_sq -= other.weight_sq
+    self.samples -= other.samples
+
+  def variance(self) -> float:
+    '''
+    Unbiased (sample) variance. For decayed weights this uses the reliability-weights correction,
+    which reduces to m2 / (n - 1) when every weight is 1.
+    '''
+    if self.count == 0:
+      raise ValueError("variance requires at least two data points")
+    denominator = self.count - self.weight_sq / self.count
+    if denominator <= 0:
+      raise ValueError("variance requires at least two data points")
+    return self.m2 / denominator
+
+  def stdev(self) -> float:
+    return sqrt(self.variance())
+
+  def state(self) -> dict:
+    return {
+      "decay" : self.decay,
+      "window" : self.window,
+      "count" : self.count,
+      "mean" : self.mean,
+      "m2" : self.m2,
+      "weight_sq" : self.weight_sq,
+      "samples" : self.samples,
+      "window_data" : list(self._window) if self._window is not None else None
+    }
+
+  @classmethod
+  def from_state(cls, state: dict) -> "RunningMoments":
+    moments = cls(decay=state["decay"], window=state["window"])
+    moments.count = state["count"]
+    moments.mean = state["mean"]
+    moments.m2 = state["m2"]
+    moments.weight_sq = state["weight_sq"]
+    moments.samples = state.get("samples", int(state["count"]))
+    if moments._window is not None:
+      moments._window.extend(state.get("window_data") or [])
+    return moments
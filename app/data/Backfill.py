@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import pandas as pd
+from time import time
+from concurrent.futures import ProcessPoolExecutor
+from components import CycleDetection, HistoryStore, ModelStore
+from data import Orchestrator, MultiOrchestrator
+from api import Sources
+
+BACKFILL_CHUNKSIZE = 100000 # CSV rows read and scored at a time
+
+class DiscardingDispatcher:
+  '''
+  Anomaly queue of the offline backfill: anomalies are written to the output files, not delivered to the backend.
+  '''
+  def send(self, payload: dict) -> None:
+    pass
+
+  def close(self, timeout: float = 10.0) -> None:
+    pass
+
+def backfill_device(path: str, column: str, device: str, training_values: np.ndarray, trained_state: dict, output_dir: str, chunksize: int, time_column: str, store_dir: str) -> dict:
+  '''
+  Worker process entry point: score one appliance column of one house's CSV.
+
+  The file is replayed chunk by chunk through a real Orchestrator (the same classification, segmentation and
+  scoring as the live loop, with the cycles spanning two chunks carried over by its CycleSegmenter, and without the
+  model refresh, so every datapoint is labelled by the trained model), and the
+  ON/OFF label of every datapoint and the anomalous cycles are written to output_dir/<house>_<device>.npz.
+  Returns a summary of the run.
+  '''
+  start = time()
+  house = os.path.splitext(os.path.basename(path))[0]
+  training = pd.DataFrame({device: training_values})
+  detector = CycleDetection.CycleDetection(df = training, device = device, model = Orchestrator.CYCLE_DETECTION_MODEL, mode = "test", aws_api = None)
+  detector.load_trained(**trained_state)
+  source = Sources.CSVSource(path = path, column = column, time_column = time_column, chunksize = chunksize)
+  orchestrator = Orchestrator.Orchestrator(device = device, device_mapping = {}, df = training, cycle_detector = detector, device_label = f"{house}/{device}", dispatcher = DiscardingDispatcher(), model_store = ModelStore.ModelStore(store_dir), source = source, history = HistoryStore.HistoryStore(capacity = Orchestrator.NORMAL_HISTORY_SIZE, max_age = Orchestrator.NORMAL_HISTORY_MAX_AGE, dtype = Orchestrator.NORMAL_HISTORY_DTYPE), model_refresh = "off")
+  orchestrator.train()
+
+  timestamps, on, anomaly_start, anomaly_end = [], [], [], []
+  while True:
+    batch_timestamps, values = orchestrator.receive()
+    if source.exhausted:
+      break
+    anomalies = orchestrator.process_batch(timestamps = batch_timestamps, values = values)
+    # The labels the batch was scored with. Without the model refresh, the detector that labelled them is still in use.
+    on.append(orchestrator.cycle_detector.is_on(orchestrator.labels))
+    timestamps.append(batch_timestamps)
+    anomaly_start += [anomaly.timestamp_start.replace(tzinfo=None) for anomaly in anomalies]
+    anomaly_end += [anomaly.timestamp_end.replace(tzinfo=None) for anomaly in anomalies]
+
+  os.makedirs(output_dir, exist_ok=True)
+  output_path = os.path.join(output_dir, f"{house}_{device.replace(' ', '_')}.npz")
+  np.savez_compressed(output_path,
+    timestamps = np.concatenate(timestamps) if timestamps else np.empty(0, dtype="datetime64[us]"),
+    on = np.concatenate(on) if on else np.empty(0, dtype=bool),
+    anomaly_start = np.array(anomaly_start, dtype="datetime64[us]"),
+    anomaly_end = np.array(anomaly_end, dtype="datetime64[us]"))
+  return {"house": house, "device": device, "samples": int(sum(len(batch) for batch in on)), "cycles": orchestrator.cycles_scored, "anomalies": len(anomaly_start), "seconds": round(time() - start, 2), "output": output_path}
+
+class Backfill:
+  '''
+    Function to score historical REFIT style CSVs offline, e.g. months of several houses.
+
+    The cycle detector of every appliance is trained once (in parallel, or loaded from the model store), then every
+    (house, appliance) pair is scored on a process pool by backfill_device, streaming its CSV in chunks.
+  '''
+
+  def __init__(self, files: list, columns: list, device_mapping: dict, training: pd.DataFrame, output_dir: str, chunksize: int = BACKFILL_CHUNKSIZE, time_column: str = "Unix", max_workers: int = None, store_dir: str = ModelStore.MODEL_STORE_DIR) -> None:
+    '''
+    files - the CSVs to score, one per house.
+    columns - the raw appliance columns to score (e.g. "Appliance1"), renamed to devices with device_mapping.
+    training - the training set, with renamed columns (see AWSInterface.get_training_frame).
+    output_dir - where the labels and anomalies of every (house, appliance) are written.
+    '''
+    self.files = files
+    self.columns = columns
+    self.device_mapping = device_mapping
+    self.devices = {column: device_mapping.get(column, column) for column in columns}
+    self.training = training
+    self.output_dir = output_dir
+    self.chunksize = chunksize
+    self.time_column = time_column
+    self.max_workers = max_workers
+    self.store_dir = store_dir
+
+  def run(self) -> pd.DataFrame:
+    print(f"Backfilling {len(self.files)} files x {len(self.columns)} appliances")
+    start = time()
+    trained = {}
+    model_store = ModelStore.ModelStore(self.store_dir)
+    for device in set(self.devices.values()):
+      parameters = CycleDetection.CycleDetection(df = None, device = device, model = Orchestrator.CYCLE_DETECTION_MODEL, mode = "test", aws_api = None).parameters()
+      artifact = model_store.load(device, ModelStore.ModelStore.fingerprint(self.training[device].to_numpy(), parameters))
+      if artifact is not None:
+        trained[device] = artifact["model"]
+    with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+      untrained = {device: executor.submit(MultiOrchestrator.train_detector, device, self.training[device].to_numpy()) for device in set(self.devices.values()) if device not in trained}
+      trained.update({device: future.result()[0] for device, future in untrained.items()})
+      print(f"Trained {len(untrained)} cycle detectors. Time taken: {time() - start}")
+      futures = [executor.submit(backfill_device, path, column, device, self.training[device].to_numpy(), trained[device], self.output_dir, self.chunksize, self.time_column, self.store_dir) for path in self.files for column, device in self.devices.items()]
+      summary = pd.DataFrame([future.result() for future in futures])
+    print(f"Time taken: {time() - start}")
+    return summary
@@ -0,0 +1,131 @@
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+from components import CycleDetection, DriftMonitor, HistoryStore
+from api import Metrics
+
+# Where the cycle detector is retrained when its drift statistics cross their thresholds (see DriftMonitor): "off",
+# "thread" (a background thread of the scoring process) or "process" (a worker process, so retraining never competes
+# with scoring for the interpreter).
+MODEL_REFRESH = os.getenv("MODEL_REFRESH", "off")
+REFRESH_WINDOW = int(os.getenv("REFRESH_WINDOW", "100000")) # Most recent datapoints the cycle detector is retrained on
+PAUSE_SAMPLES = 10000 # Scoring loop pauses kept for stats
+
+_executors = {}
+
+def shared_executor(kind: str):
+  '''
+  The executor refreshes run on, one per kind, shared by every stream of the process. It has a single worker, so
+  the streams of a process never retrain at the same time. A daemon process (e.g. a ShardedRunner worker) cannot
+  start worker processes, so there "process" falls back to the background thread.
+  '''
+  if kind == "process" and multiprocessing.current_process().daemon:
+    if kind not in _executors:
+      print("Model refresh on a worker process is not available in a daemon process, refreshing on a background thread")
+      _executors[kind] = shared_executor("thread")
+    return _executors[kind]
+  if kind not in _executors:
+    if kind == "thread":
+      _executors[kind] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ModelRefresh")
+    elif kind == "process":
+      _executors[kind] = ProcessPoolExecutor(max_workers=1)
+      _executors[kind].submit(int).result() # Start the worker process now rather than in the scoring loop
+    else:
+      raise ValueError(f"Unknown model refresh {kind}, use \"off\", \"thread\" or \"process\"")
+  return _executors[kind]
+
+class ModelRefresh:
+  '''
+  Drift aware refresh of the cycle detector of one stream, off the scoring loop.
+
+  The scoring loop hands over every classified batch (observe). The batch is appended to a bounded window of the
+  most recent datapoints (a HistoryStore) and folded into the DriftMonitor. When the monitor reports drift, the
+  window is retrained on the executor, starting from the current clusters (CycleDetection.refit_state), while
+  scoring continues with the current model. Once the retrained state is back, the next observe returns a new cycle
+  detector for the scoring loop to swap in between two batches: the model in use is never modified, so a batch is
+  always classified by one model.
+
+  Measured: the refresh latency (from drift detected to the new model swapped in) and the pause of the scoring loop
+  (the time observe takes, per batch).
+  '''
+
+  def __init__(self, detector: CycleDetection.CycleDetection, executor = None, window: int = REFRESH_WINDOW, monitor: DriftMonitor.DriftMonitor = None, device: str = None) -> None:
+    '''
+    detector - the trained cycle detector in use.
+    executor - where refreshes run. Defaults to the shared background thread.
+    window - number of recent datapoints a refresh retrains on.
+    '''
+    self.detector = detector
+    self.executor = executor if executor is not None else shared_executor("thread")
+    self.recent = HistoryStore.HistoryStore(capacity = window, dtype = "float32") # Only retrained on, half the memory
+    self.monitor = monitor if monitor is not None else DriftMonitor.DriftMonitor(detector.centroids)
+    self.pending = None
+    self.reason = None
+    self.triggered = None
+    self.refreshes = 0
+    self.failures = 0
+    self.latencies = [] # Seconds from drift detected to the refreshed model swapped in
+    self.fit_seconds = [] # CPU seconds of every retraining
+    self.pauses = deque(maxlen=PAUSE_SAMPLES) # Seconds the scoring loop spent in observe, per batch
+    labels = {"device": device} if device is not None else {}
+    self.refresh_seconds = Metrics.registry.histogram("model_refresh_seconds", "Time from drift being detected to the refreshed cycle detector being swapped in", **labels)
+    self.pause_seconds = Metrics.registry.histogram("model_refresh_pause_seconds", "Time the scoring loop spends tracking drift and swapping models, per batch", **labels)
+    self.refreshes_total = Metrics.registry.counter("model_refreshes_total", "Cycle detectors retrained after drift", **labels)
+
+  def observe(self, timestamps, values, labels, cycles: int, alarms: int) -> CycleDetection.CycleDetection | None:
+    '''
+    Function to track a scored batch: its datapoints, their cluster labels, the number of cycles scored and how many
+    raised an alarm. Starts a refresh when drift is detected. Returns the refreshed cycle detector once a refresh
+    finished, to be used from the next batch on, and None otherwise.
+    '''
+    start = perf_counter()
+    self.recent.append(values, timestamps)
+    self.monitor.observe(values, labels)
+    self.monitor.observe_cycles(cycles, alarms)
+    refreshed = None
+    if self.pending is not None:
+      if self.pending.done():
+        refreshed = self._finish()
+    else:
+      reason = self.monitor.drifted()
+      if reason is not None:
+        self._start(reason)
+    pause = perf_counter() - start
+    self.pauses.append(pause)
+    self.pause_seconds.observe(pause)
+    return refreshed
+
+  def _start(self, reason: str) -> None:
+    print(f"Cycle detector drift ({reason}), retraining on the last {len(self.recent)} datapoints")
+    self.reason = reason
+    self.triggered = perf_counter()
+    detector = self.detector
+    self.pending = self.executor.submit(CycleDetection.refit_state, detector.model_name, detector.n_clusters, detector.covariance_type, detector.trained_state(), self.recent.ordered())
+
+  def _finish(self) -> CycleDetection.CycleDetection | None:
+    '''
+    Build the refreshed cycle detector from the retrained state. A failed refresh keeps the current model.
+    '''
+    future, self.pending = self.pending, None
+    try:
+      trained_state, cpu_seconds = future.result()
+    except Exception as error:
+      print(f"Cycle detector refresh failed, keeping the current model. {error}")
+      self.failures += 1
+      self.monitor.reset(self.detector.centroids)
+      return None
+    current = self.detector
+    detector = CycleDetection.CycleDetection(df = None, device = current.device, model = current.model_name, mode = current.mode, aws_api = current.aws_api, n_clusters = current.n_clusters, covariance_type = current.covariance_type, house = current.house)
+    detector.load_trained(**trained_state)
+    self.detector = detector
+    self.monitor.reset(detector.centroids)
+    latency = perf_counter() - self.triggered
+    self.refreshes += 1
+    self.latencies.append(latency)
+    self.fit_seconds.append(cpu_seconds)
+    self.refresh_seconds.observe(latency)
+    self.refreshes_total.inc()
+    print(f"Cycle detector refreshed: centroids {current.centroids.round(2).tolist()} -> {detector.centroids.round(2).tolist()}. Time taken: {latency}")
+    return detector
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+from time import time, process_time
+from concurrent.futures import ProcessPoolExecutor
+from components import CycleDetection, Evaluation
+
+SELECTION_FOLDS = 5
+SELECTION_CHUNKSIZE = 100000 # CSV rows read at a time by from_csv
+CLUSTER_COUNTS = (2, 3, 4)
+COVARIANCE_TYPES = ("spherical", "diag", "tied", "full") # Only used by the "gmm" model
+
+_shared = {} # Datapoints and ground truth of the sweep, set once per worker process by share
+
+def share(values: np.ndarray, labels: np.ndarray) -> None:
+  '''
+  Worker process initializer: keep the datapoints and the ground truth, so they are sent to every worker process
+  once instead of with every task.
+  '''
+  _shared["values"] = values
+  _shared["labels"] = labels
+
+def fold_bounds(n: int, fold: int, folds: int) -> tuple:
+  '''
+  Start and end of the test datapoints of a fold. Folds are contiguous blocks, so a model is never tested on
+  datapoints interleaved with the ones it was trained on.
+  '''
+  return n * fold // folds, n * (fold + 1) // folds
+
+def test_chunks(values: np.ndarray, labels: np.ndarray, start: int, end: int):
+  '''
+  The test datapoints of a fold as data frames of CycleDetection.CHUNK_SIZE rows, with the "power" and "label" columns
+  CycleDetection.evaluate_chunks expects.
+  '''
+  for offset in range(start, end, CycleDetection.CHUNK_SIZE):
+    test = slice(offset, min(offset + CycleDetection.CHUNK_SIZE, end))
+    yield pd.DataFrame({"power": values[test], "label": labels[test]})
+
+def evaluate_candidate(candidate: dict, fold: int, folds: int) -> dict:
+  '''
+  Worker process entry point: train a candidate model on every fold but one and evaluate it on the remaining fold,
+  chunk by chunk (CycleDetection.evaluate_chunks). Only the confusion matrix is sent back to the parent process.
+  '''
+  values, labels = _shared["values"], _shared["labels"]
+  start, end = fold_bounds(len(values), fold, folds)
+  detector = CycleDetection.CycleDetection(df = None, device = "power", model = candidate["model"], mode = "test", aws_api = None, n_clusters = candidate["n_clusters"], covariance_type = candidate["covariance_type"] or "full")
+  fit_start = process_time()
+  detector.fit(np.concatenate((values[:start], values[end:])))
+  fit_seconds = process_time() - fit_start
+  evaluation = detector.evaluate_chunks(test_chunks(values, labels, start, end), label_column = "label")
+  return {**candidate, "fold": fold, "fit_seconds": fit_seconds, "confusion": evaluation.confusion}
+
+class ModelSelection:
+  '''
+    Function to select the cycle detection model with cross validation.
+
+    Every combination of model, number of clusters and covariance type is trained and evaluated on every fold, all
+    on one process pool, and the confusion matrices of the folds of a combination are summed into its metrics.
+  '''
+
+  def __init__(self, values, labels, models: tuple = CycleDetection.MODELS, cluster_counts: tuple = CLUSTER_COUNTS, covariance_types: tuple = COVARIANCE_TYPES, folds: int = SELECTION_FOLDS, max_workers: int = None) -> None:
+    '''
+    values - the power datapoints.
+    labels - the ON / OFF ground truth of every datapoint, see Evaluation.parse_ground_truth.
+    folds - number of cross validation folds, at least 2.
+    max_workers - size of the process pool. Defaults to the number of CPUs.
+    '''
+    self.values = np.asarray(values, dtype=float).reshape(-1)
+    self.labels = Evaluation.parse_ground_truth(labels)
+    if len(self.values) != len(self.labels):
+      raise ValueError(f"values and labels have different lengths ({len(self.values)} and {len(self.labels)})")
+    if folds < 2:
+      raise ValueError("Cross validation needs at least 2 folds")
+    self.models = models
+    self.cluster_counts = cluster_counts
+    self.covariance_types = covariance_types
+    self.folds = folds
+    self.max_workers = max_workers
+
+  @classmethod
+  def from_csv(cls, path: str, column: str, label_column: str, chunksize: int = SELECTION_CHUNKSIZE, **kwargs) -> "ModelSelection":
+    '''
+    Function to set up the selection from a labelled CSV, read chunksize rows at a time. Only the power (float64) and
+    the parsed ground truth (bool) of every row are kept, not the data frame with its text labels. Every
+    fold is trained on the others, so those two columns are kept whole.
+    kwargs - see the constructor.
+    '''
+    values, labels = [], []
+    for chunk in pd.read_csv(path, usecols=[column, label_column], chunksize=chunksize):
+      values.append(chunk[column].fillna(0).to_numpy(dtype=float))
+      labels.append(Evaluation.parse_ground_truth(chunk[label_column].to_numpy()))
+    return cls(values = np.concatenate(values) if values else np.empty(0), labels = np.concatenate(labels) if labels else np.empty(0, dtype=bool), **kwargs)
+
+  def candidates(self) -> list:
+    '''
+    The combinations to evaluate. The covariance type only applies to "gmm", and "threshold" only has 2 clusters.
+    '''
+    candidates = []
+    for model in self.models:
+      for n_clusters in self.cluster_counts:
+        if model == "threshold" and n_clusters != 2:
+          continue
+        for covariance_type in (self.covariance_types if model == "gmm" else (None,)):
+          candidates.append({"model": model, "n_clusters": n_clusters, "covariance_type": covariance_type})
+    return candidates
+
+  def run(self) -> pd.DataFrame:
+    '''
+    Returns the results table, one row per combination with its metrics over every fold, the spread of its f1 score
+    across the folds and its total training time, best f1 first.
+    '''
+    candidates = self.candidates()
+    print(f"Evaluating {len(candidates)} models x {self.folds} folds on {len(self.values)} datapoints")
+    start = time()
+    with ProcessPoolExecutor(max_workers=self.max_workers, initializer=share, initargs=(self.values, self.labels)) as executor:
+      futures = [executor.submit(evaluate_candidate, candidate, fold, self.folds) for candidate in candidates for fold in range(self.folds)]
+      results = [future.result() for future in futures]
+
+    rows = []
+    for candidate in candidates:
+      folds = [result for result in results if all(result[key] == value for key, value in candidate.items())]
+      evaluation = Evaluation.Evaluation()
+      for result in folds:
+        evaluation.confusion += result["confusion"]
+      rows.append({**candidate, **evaluation.scores(), "f1_std": float(np.std([Evaluation.scores(result["confusion"])["f1"] for result in folds])), "fit_seconds": round(sum(result["fit_seconds"] for result in folds), 3)})
+    print(f"Time taken: {time() - start}")
+    return pd.DataFrame(rows).sort_values("f1", ascending=False, kind="stable").reset_index(drop=True)
@@ -0,0 +1,150 @@
+import os
+import asyncio
+import numpy as np
+import pandas as pd
+from time import time, process_time
+from concurrent.futures import ProcessPoolExecutor
+from components import CycleDetection, ModelStore
+from data import Orchestrator
+from api import AWSInterface, AnomalyDispatcher, Sources, StartupProfile
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# General constants.
+AWS_S3_BUCKET_TRAINING = os.getenv("AWS_S3_BUCKET_TRAINING")
+STREAM_DEVICE_FIELD = "deviceName" # Field of a stream record holding the device (renamed column) it belongs to
+REPORT_EVERY = 60 # Polls between two accounting reports
+
+def train_detector(device: str, values: np.ndarray) -> tuple:
+  '''
+  Worker process entry point: train the cycle detector of one device.
+  Only the trained state (centroids, ON cluster) is sent back to the parent process.
+  Returns the trained state and the CPU time spent training.
+  '''
+  start = process_time()
+  detector = CycleDetection.CycleDetection(df = pd.DataFrame({device: values}), device = device, model = Orchestrator.CYCLE_DETECTION_MODEL, mode = "train", aws_api = None)
+  detector.fit(values)
+  return detector.trained_state(), process_time() - start
+
+class MultiOrchestrator:
+  '''
+    Function to orchestrate the monitoring of several appliances in one process.
+
+    The training set is loaded once and shared by every device, the cycle detectors are trained in parallel on a
+    process pool and a single stream poller feeds every device. Each received record is routed by its
+    STREAM_DEVICE_FIELD to the Orchestrator (state machine and Gaussian) of that device.
+  '''
+
+  def __init__(self, device_mapping: dict, devices: list = None, device_labels: dict = None, max_workers: int = None, source: Sources.Source = None) -> None:
+    '''
+    device_mapping - the column renaming of the training set, e.g. DEVICE_MAPPING.
+    devices - the devices to monitor. Defaults to every device in device_mapping.
+    device_labels - optional device label sent with the anomalies of each device. Defaults to the device name.
+    max_workers - size of the training process pool. Defaults to the number of CPUs.
+    source - where stream datapoints are received from, with their STREAM_DEVICE_FIELD. Defaults to adaptive polling
+      of the S3 stream bucket.
+    '''
+    print("Initializing MultiOrchestrator...")
+    start = time()
+    self.device_mapping = device_mapping
+    self.devices = devices if devices is not None else list(device_mapping.values())
+    self.device_labels = device_labels if device_labels is not None else {}
+    self.max_workers = max_workers
+    self.aws_api = AWSInterface.AWSInterface()
+    self.dispatcher = AnomalyDispatcher.AnomalyDispatcher(url=Orchestrator.API_URL)
+    self.model_store = ModelStore.ModelStore()
+    self.source = source if source is not None else Sources.S3PollingSource(aws_api=self.aws_api, bucket_path=Orchestrator.STREAM_FILE_PATH, device_field=STREAM_DEVICE_FIELD)
+    self.df = self.aws_api.get_training_frame(bucket_path=AWS_S3_BUCKET_TRAINING, file_name = Orchestrator.TARGET_TRAINING_SET, device_mapping=device_mapping, columns=self.devices)
+    print(f"Time taken: {time() - start}")
+    StartupProfile.startup.mark("shared training set")
+
+    self.orchestrators = {}
+    self.accounting = {device: {"train_cpu_seconds": 0.0, "cpu_seconds": 0.0, "samples": 0, "anomalies": 0} for device in self.devices}
+    self.unrouted = 0
+    self.polls = 0
+
+  def train(self) -> None:
+    '''
+    Function to build every device's Orchestrator on the shared frame, then train the cycle detectors that could
+    not be loaded from the model store in parallel.
+    '''
+    for device in self.devices:
+      self.orchestrators[device] = Orchestrator.Orchestrator(device = device, device_mapping = self.device_mapping, aws_api = self.aws_api, df = self.df, device_label = self.device_labels.get(device, device), dispatcher = self.dispatcher, model_store = self.model_store, source = self.source)
+    untrained = [device for device in self.devices if self.orchestrators[device].cycle_detector.centroids is None]
+
+    print(f"Training {len(untrained)} cycle detectors")
+    start = time()
+    if untrained:
+      with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+        futures = {device: executor.submit(train_detector, device, self.df[device].to_numpy()) for device in untrained}
+        for device, future in futures.items():
+          trained_state, cpu_seconds = future.result()
+          self.orchestrators[device].cycle_detector.load_trained(**trained_state)
+          self.accounting[device]["train_cpu_seconds"] = cpu_seconds
+    StartupProfile.startup.mark(f"{len(untrained)} cycle detectors trained in parallel")
+    for orchestrator in self.orchestrators.values():
+      orchestrator.train() # Stores the models trained above, and releases the training set
+    self.df = None
+    print(f"Time taken: {time() - start}")
+
+  def run(self) -> None:
+    self.train()
+    asyncio.run(self.consume())
+
+  async def consume(self) -> None:
+    async for (timestamps, values, devices), arrived in self.source.batches():
+      self.polls += 1
+      self.route(timestamps = timestamps, values = values, devices = devices)
+      if self.polls % REPORT_EVERY == 0:
+        print(self.report().to_string())
+
+  def receive(self) -> tuple:
+    '''
+    Function to read every new datapoint of every device with one poller.
+    '''
+    return self.source.receive()
+
+  def route(self, timestamps, values, devices) -> list:
+    '''
+    Function to split a received batch by device, preserving the order within each device, and score every
+    part on its device's Orchestrator. Returns the anomalies raised.
+    '''
+    names, inverse = np.unique(np.asarray(devices).astype(str), return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(names) + 1))
+
+    anomalies = []
+    for i, name in enumerate(names):
+      orchestrator = self.orchestrators.get(name)
+      if orchestrator is None:
+        self.unrouted += int(bounds[i + 1] - bounds[i])
+        continue
+      selected = order[bounds[i]:bounds[i + 1]]
+      start = process_time()
+      device_anomalies = orchestrator.process_batch(timestamps = timestamps[selected], values = values[selected])
+      accounting = self.accounting[name]
+      accounting["cpu_seconds"] += process_time() - start
+      accounting["samples"] += len(selected)
+      accounting["anomalies"] += len(device_anomalies)
+      anomalies += device_anomalies
+    return anomalies
+
+  def report(self) -> pd.DataFrame:
+    '''
+    Per device accounting: training and scoring CPU time, samples, anomalies, and memory in bytes.
+    memory_bytes counts the device's own state: its normal operation history and its pending cycle buffer (and its
+    share of the training frame until it is released after training).
+    '''
+    rows = {}
+    for device in self.devices:
+      row = dict(self.accounting[device])
+      memory = self.df[device].memory_usage(index=False, deep=True) if self.df is not None else 0
+      orchestrator = self.orchestrators.get(device)
+      if orchestrator is not None:
+        memory += orchestrator.segmenter.buffer.nbytes + (orchestrator.history.nbytes if orchestrator.history is not None else 0)
+      row["memory_bytes"] = int(memory)
+      rows[device] = row
+    report = pd.DataFrame.from_dict(rows, orient="index")
+    print(f"Unrouted datapoints: {self.unrouted}")
+    return report
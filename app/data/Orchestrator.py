@@ -1,23 +1,50 @@
 import os
-import requests
 import json
-from time import sleep, time
-from components import CycleDetection, GaussianCalculator
-from data import Anomaly
-from api import AWSInterface
-from datetime import datetime
+import asyncio
+import logging
+import numpy as np
+from time import perf_counter, time
+from components import CycleDetection, CycleFeatures, CycleSegmenter, GaussianCalculator, HistoryStore, KDECalculator, ModelStore, MultivariateGaussianCalculator, RunningMoments
+from data import Anomaly, ModelRefresh
+from api import AWSInterface, AnomalyDispatcher, Metrics, Sources, StartupProfile
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 # General constants.
 AWS_S3_BUCKET_TRAINING = os.getenv("AWS_S3_BUCKET_TRAINING")
-TRAINING_FILE_NAME = "House_1_pruned_350k.csv"
-TARGET_TRAINING_SET = f"training/refrigerator/{TRAINING_FILE_NAME}"
+HOUSE = os.getenv("HOUSE", "House_1") # The house monitored by default. Every house has its own training set.
+TRAINING_SET_TEMPLATE = "training/refrigerator/{house}_pruned_350k.csv"
+TARGET_TRAINING_SET = TRAINING_SET_TEMPLATE.format(house=HOUSE)
 STREAM_FILE_PATH = "ingestdata-sample-stream" # Sample directory - ingestdata-sample-stream
 API_URL = "https://elgo-backend.vercel.app/anomalies/createAnomaly"
 # API_URL = "http://localhost:3000/anomalies/createAnomaly"
 DEVICE_LABEL = "device12345"
+CYCLE_DETECTION_MODEL = os.getenv("CYCLE_DETECTION_MODEL", "knn") # "knn", "minibatch", "threshold" or "gmm", see CycleDetection
+# "sigma" (3 sigma rule of a Gaussian), "kde" (kernel density of normal cycle powers) or "mahalanobis" (multivariate
+# Gaussian of the cycle features, per ON/OFF cycle)
+CYCLE_SCORER = os.getenv("CYCLE_SCORER", "sigma")
+TRAINING_SAMPLE_PERIOD = 8 # Seconds between two datapoints of the training set, which has no timestamps
+# Retention of the normal operation history the Gaussian is computed from: the newest NORMAL_HISTORY_SIZE datapoints,
+# and optionally only the ones learned in the last NORMAL_HISTORY_MAX_AGE seconds. With NORMAL_HISTORY_DIR, the
+# history is memory-mapped from that directory and kept across restarts.
+NORMAL_HISTORY_SIZE = int(os.getenv("NORMAL_HISTORY_SIZE", "1000000"))
+NORMAL_HISTORY_MAX_AGE = float(os.getenv("NORMAL_HISTORY_MAX_AGE")) if os.getenv("NORMAL_HISTORY_MAX_AGE") else None
+NORMAL_HISTORY_DIR = os.getenv("NORMAL_HISTORY_DIR")
+# float64 keeps the Gaussian of the history numerically the same as the one of its datapoints. float32 halves the memory
+# of the history, at about 1e-8 relative error in the Gaussian.
+NORMAL_HISTORY_DTYPE = os.getenv("NORMAL_HISTORY_DTYPE", "float64")
+UPLOAD_LABELLED_TRAINING = os.getenv("UPLOAD_LABELLED_TRAINING", "false").lower() == "true" # Dump the labelled training set to S3 after training
+
+def to_datetime(timestamp) -> datetime:
+  '''
+  Convert a stream timestamp (datetime64 in UTC, or datetime) into a timezone aware datetime.
+  '''
+  if isinstance(timestamp, np.datetime64):
+    return timestamp.astype("datetime64[us]").astype(datetime).replace(tzinfo=timezone.utc)
+  return timestamp
 
 class Orchestrator:
   '''
@@ -25,125 +52,343 @@ class Orchestrator:
 
     This relies on the following environment variables:
     1. TARGET_TRAINING_SET - this is a file path along for a csv file. ENSURE THAT TARGET_TRAINING_SET only has normal operation only.
+       Other houses than HOUSE train on TRAINING_SET_TEMPLATE for that house.
     2. DEVICE - specific device for which we are carrying out the training.
   '''
 
-  def __init__(self, device: str, device_mapping: dict) -> None:
+  def __init__(self, device: str, device_mapping: dict, aws_api: AWSInterface.AWSInterface = None, df = None, cycle_detector: CycleDetection.CycleDetection = None, device_label: str = DEVICE_LABEL, dispatcher: AnomalyDispatcher.AnomalyDispatcher = None, model_store: ModelStore.ModelStore = None, source: Sources.Source = None, history: HistoryStore.HistoryStore = None, house: str = HOUSE, keep_history: bool = True, model_refresh: str = ModelRefresh.MODEL_REFRESH, checkpoint: dict = None) -> None:
+    '''
+    device - the appliance (renamed column) to monitor.
+    aws_api, df, cycle_detector - optional pieces shared with other Orchestrators (see MultiOrchestrator).
+      When not provided, the Orchestrator connects to AWS, loads the training set and creates its own detector.
+      It only connects to AWS when it needs to: to load the training set, poll the default source or upload the
+      labelled training set.
+    device_label - the device label sent with anomalies.
+    dispatcher - optional anomaly delivery queue shared with other Orchestrators.
+    model_store - where trained models are stored and loaded from. Defaults to the local MODEL_STORE_DIR.
+    source - where stream datapoints are received from. Defaults to adaptive polling of the S3 stream bucket.
+    history - store of the normal operation history. Defaults to one with the NORMAL_HISTORY_* retention.
+    house - the house the device is in, which selects its training set.
+    keep_history - if False, the Gaussian only keeps the running moments of the normal operation instead of a history
+      store. This is all a checkpoint holds (see checkpoint and restore), e.g. for the streams of ShardedRunner.
+    model_refresh - "off", "thread" or "process": retrain the cycle detector in the background when it drifts, see
+      ModelRefresh.
+    checkpoint - continue a stream from its checkpoint (see checkpoint and restore) instead of training: the training
+      set is never loaded, fingerprinted or summarised. Implies keep_history=False.
+    '''
     print("Initializeing Orchestrator...")
     start = time()
-    self.aws_api = AWSInterface.AWSInterface();
-    self.df = self.aws_api.get_csv_file(bucket_path=AWS_S3_BUCKET_TRAINING, file_name = TARGET_TRAINING_SET)
-    print("Renaming...")
-    self.df = self.df.rename(index=str, columns=device_mapping).fillna(0)
-    print(f"Time taken: {time() - start}")
+    if aws_api is None and ((df is None and checkpoint is None) or source is None or UPLOAD_LABELLED_TRAINING):
+      aws_api = AWSInterface.AWSInterface()
+    self.aws_api = aws_api
     self.device = device
+    self.house = house
+    self.device_label = device_label
+    # Anomalies are delivered on a background thread, so a slow backend never stalls detection.
+    self.dispatcher = dispatcher if dispatcher is not None else AnomalyDispatcher.AnomalyDispatcher(url=API_URL)
+    StartupProfile.startup.mark(f"{self.device}: AWS interface and dispatcher")
+    if df is None and checkpoint is None:
+      # Only the selected device's column is loaded, from the local cache when the training set has not changed.
+      df = self.aws_api.get_training_frame(bucket_path=AWS_S3_BUCKET_TRAINING, file_name = TRAINING_SET_TEMPLATE.format(house=self.house), device_mapping=device_mapping, columns=[self.device])
+    self.df = df
+    self.source = source if source is not None else Sources.S3PollingSource(aws_api=self.aws_api, bucket_path=STREAM_FILE_PATH)
+    print(f"Time taken: {time() - start}")
+    StartupProfile.startup.mark(f"{self.device}: training set")
 
     # Cycle detection and count helpers
     print("Initializing Cycle Detector")
     start = time()
-    self.cycle_detector = CycleDetection.CycleDetection(df = self.df, device = self.device, model = "knn", mode = "train", aws_api=self.aws_api)
+    if cycle_detector is None:
+      cycle_detector = CycleDetection.CycleDetection(df = self.df, device = self.device, model = CYCLE_DETECTION_MODEL, mode = "train", aws_api=self.aws_api, house=self.house)
+    self.cycle_detector = cycle_detector
     print(f"Time taken: {time() - start}")
+    StartupProfile.startup.mark(f"{self.device}: cycle detector")
+
+    # Carries the current cycle, its datapoints and start timestamp across received batches
+    self.segmenter = CycleSegmenter.CycleSegmenter()
+    self.cycles_scored = 0
+    self.labels = None # Cluster label of every datapoint of the last batch scored by process_batch
 
-    self.current_cycle = -1
-    self.previous_cycle = -1
-    self.start_timestamp = datetime.fromisoformat('2000-01-01 00:00:01')
-    self.current_power_list = []
+    # Instrumentation. These are no-ops unless Metrics.registry is enabled before the Orchestrator is created.
+    self.metrics = Metrics.registry
+    self.samples_classified = self.metrics.counter("samples_classified_total", "Datapoints classified as ON or OFF", device=self.device)
+    self.cycles_total = self.metrics.counter("cycles_total", "Cycles scored", device=self.device)
+    self.anomalies_total = self.metrics.counter("anomalies_total", "Anomalous cycles", device=self.device)
+    self.cycle_lengths = self.metrics.histogram("cycle_length_samples", "Datapoints per scored cycle", buckets=Metrics.COUNT_BUCKETS, device=self.device)
+    self.arrival_to_score = self.metrics.histogram("arrival_to_score_seconds", "Time from a batch arriving from the source to it being scored", source=self.source.name)
+    self.event_to_score = self.metrics.histogram("event_to_score_seconds", "Time from the newest datapoint's timestamp to its batch being scored", source=self.source.name)
 
-    # Gaussian Detection
-    self.normal_operation = self.df[self.device].tolist()
+    self.model_store = model_store if model_store is not None else ModelStore.ModelStore()
+    if checkpoint is None:
+      artifact = self.load_normal_operation(keep_history = keep_history, history = history)
+    else:
+      # The checkpoint holds the trained model, the Gaussian moments and the scorer, see restore.
+      artifact = None
+      self.normal_operation = None
+      self.fingerprint = None
+      self.model_stored = True
+      self.training_moments = None
+      self.history = None
+    StartupProfile.startup.mark(f"{self.device}: model store and normal operation history")
+
+    # With the "kde" scorer, cycles are scored against the density of the normal cycle powers instead, and with
+    # the "mahalanobis" scorer against the distribution of the cycle features of normal ON (and OFF) cycles.
+    # They are seeded with the cycles of the training set once the cycle detector is trained (see train).
+    self.kde = None
+    self.multivariate = None
+    self.features = CycleFeatures.CycleFeatures()
+    self.load_scorer(artifact.get("scorer") if artifact is not None else None)
+
+    # Started once the cycle detector is trained (see start_refresh)
+    self.model_refresh = model_refresh
+    self.refresh = None
+    StartupProfile.startup.mark(f"{self.device}: scorers")
+    if checkpoint is not None:
+      self.restore(checkpoint)
+
+  def load_normal_operation(self, keep_history: bool, history: HistoryStore.HistoryStore | None) -> dict | None:
+    '''
+    Function to set up the Gaussian from the training set, and load the stored model trained on it if there is one.
+    Returns the stored artifact, or None.
+    '''
+    # A model trained on exactly this data with the same parameters is loaded instead of retrained, together with
+    # the Gaussian moments of the training set.
+    self.normal_operation = self.df[self.device].to_numpy()
     print(f"Normal operation loaded with size: {len(self.normal_operation)}")
-    self.gauss = GaussianCalculator.GaussianCalculator(data = self.normal_operation)
+    self.fingerprint = ModelStore.ModelStore.fingerprint(self.normal_operation, self.cycle_detector.parameters())
+    artifact = self.model_store.load(self.device, self.fingerprint)
+    self.model_stored = artifact is not None
+    stored_moments = None
+    if artifact is not None:
+      print(f"Loaded stored model {self.fingerprint[:12]} for {self.device}")
+      if self.cycle_detector.centroids is None:
+        self.cycle_detector.load_trained(**artifact["model"])
+      stored_moments = RunningMoments.RunningMoments.from_state(artifact["gaussian"])
+
+    # Gaussian Detection. The training column is only kept until the models are fitted (see release_training),
+    # the Gaussian follows the bounded normal operation history.
+    if not keep_history:
+      history = None
+      moments = stored_moments if stored_moments is not None else RunningMoments.RunningMoments.from_values(self.normal_operation)
+      self.training_moments = moments.state()
+      self.gauss = GaussianCalculator.GaussianCalculator(moments = moments)
+    elif history is None:
+      history_path = os.path.join(NORMAL_HISTORY_DIR, "".join(character if character.isalnum() else "_" for character in self.device)) if NORMAL_HISTORY_DIR else None
+      history = HistoryStore.HistoryStore(capacity = NORMAL_HISTORY_SIZE, max_age = NORMAL_HISTORY_MAX_AGE, dtype = NORMAL_HISTORY_DTYPE, path = history_path)
+    self.history = history
+    if history is not None:
+      if len(self.history) == 0:
+        self.history.append(self.normal_operation, moments = stored_moments)
+        self.training_moments = self.history.moments.state()
+      else:
+        print(f"Normal operation history reopened with size: {len(self.history)}")
+        self.training_moments = artifact["gaussian"] if artifact is not None else None # Summarised when the model is stored (see train)
+      self.gauss = GaussianCalculator.GaussianCalculator(history = self.history)
+    return artifact
 
   def run(self):
     # First train on the data made available for training.
-    print(f"Training cycle detector")
-    start = time()
-    print(f"Training start: {start}")
-    self.cycle_detector.KMeansTraining()
-    print(f"Time taken: {time() - start}")
+    self.train()
+
+    # Continuously consume datapoints from the source as they arrive and check to see if they are anomalous or not
+    asyncio.run(self.consume())
+
+  async def consume(self) -> None:
+    '''
+    Function to score every batch as soon as the source delivers it, and measure the end-to-end latency.
+    '''
+    async for (timestamps, values), arrived in self.source.batches():
+      self.process_batch(timestamps=timestamps, values=values)
+      self.record_latency(timestamps=timestamps, arrived=arrived)
+
+  def record_latency(self, timestamps, arrived: float) -> None:
+    '''
+    Function to record how long a scored batch took from arriving (perf_counter time) and from its newest datapoint.
+    '''
+    self.arrival_to_score.observe(perf_counter() - arrived)
+    newest = to_datetime(np.max(timestamps))
+    self.event_to_score.observe((datetime.now(timezone.utc) - newest).total_seconds())
 
-    # Continuously request for datapoint from an endpoint and check to see if it is anomalous or not
-    while(True):
-      sleep(10)
-      power_data = self.receive()
-      if len(power_data) == 0:
-        continue
-      for timestamp, datapoint in power_data.items():
-        print(f"\n\nReceived Datapoints {datapoint}")
-        self.current_cycle = self.cycle_detector.detect_on_off([[datapoint]]) # Outputs 0 or 1 for OFF or ON respectively
-        print(f"Datapoint at t = {timestamp} classified as {'ON' if self.current_cycle else 'OFF'}")
-
-        if self.previous_cycle == -1:
-          # If the previous cycle is uninitialized
-          print("Unintialized cycle, initializing now...")
-          self.previous_cycle = self.current_cycle
-          self.current_power_list.append(datapoint)
-          self.start_timestamp = timestamp
-          continue
-
-        if self.previous_cycle == self.current_cycle:
-          # If the current and previous datapoints belong to the same cycle
-          print("Same as previous cycle")
-          self.previous_cycle = self.current_cycle
-          self.current_power_list.append(datapoint)
-          continue
-
-        if self.current_cycle != self.previous_cycle:
-          if len(self.current_power_list) < 2:
-            # The minimum number of datapoints to qualify as a cycle is 2. However, in the rare scenario that the power cycle keeps oscillating
-            # between ON and OFF before accumulating atleast 2 datapoints in each cycle, we can continue the loop and set the current cycle to the
-            # same as the previous cycle. This effectively accumulates atleast two datapoints in current power list, even if the power cycle is erratic
-            # and jumps around.
-            self.current_power_list.append(datapoint)
-            self.previous_cycle = self.current_cycle
-            continue
-
-          print("Different from previous cycle")
-          # The cycle has changed, and it's time to check if the cycle is anomalous or not.
-          # Step 1: Calculate the average power in the current cycle (Done by the Gauss class, internally)
-          # Step 2: Plug this into gaussian pdf formula (Need to trigger pdf function of Gauss)
-          # Step 3: Evaluate to see if you need to raise alarm (Need to carry out check in this function)
-
-          average_power = self.gauss.mean(self.current_power_list)
+  def train(self) -> None:
+    '''
+    Function to train the cycle detector, unless it was already trained (loaded from the model store, or trained
+    on a worker process), and store the trained model.
+    '''
+    if self.cycle_detector.centroids is None:
+      print(f"Training cycle detector")
+      start = time()
+      print(f"Training start: {start}")
+      self.cycle_detector.KMeansTraining(upload = UPLOAD_LABELLED_TRAINING)
+      print(f"Time taken: {time() - start}")
+    if CYCLE_SCORER == "kde" and self.kde is None:
+      self.kde = KDECalculator.KDECalculator(data = self.training_cycles().means)
+      self.model_stored = False
+    elif CYCLE_SCORER == "mahalanobis" and self.multivariate is None:
+      cycles = self.training_cycles()
+      features = CycleFeatures.CycleFeatures().extract(cycles)
+      self.multivariate = {int(label): MultivariateGaussianCalculator.MultivariateGaussianCalculator(data = features[cycles.labels == label]) for label in np.unique(cycles.labels)}
+      self.model_stored = False
+    if not self.model_stored:
+      if self.training_moments is None:
+        self.training_moments = HistoryStore.summarise(self.normal_operation).state()
+      self.model_store.save(device = self.device, fingerprint = self.fingerprint, parameters = self.cycle_detector.parameters(), model_state = self.cycle_detector.trained_state(), gaussian_state = self.training_moments, scorer_state = self.scorer_state())
+      self.model_stored = True
+    self.release_training()
+    self.start_refresh()
+    StartupProfile.startup.mark(f"{self.device}: training")
+
+  def release_training(self) -> None:
+    '''
+    Function to drop the training set (and the labelled copy of the detector) once every model is fitted.
+    From then on the normal operation only lives in the history store.
+    '''
+    self.df = None
+    self.cycle_detector.release_training_data()
+    self.normal_operation = None
+
+  def training_cycles(self) -> CycleSegmenter.SegmentedCycles:
+    '''
+    Function to cut the training set into cycles with the trained detector.
+    '''
+    labels = self.cycle_detector.classify(self.normal_operation)
+    timestamps = (np.arange(len(self.normal_operation)) * TRAINING_SAMPLE_PERIOD).astype("datetime64[s]")
+    return CycleSegmenter.CycleSegmenter().segment(timestamps=timestamps, values=self.normal_operation, labels=labels)
+
+  def load_scorer(self, scorer: dict | None) -> None:
+    '''
+    Function to restore the "kde" or "mahalanobis" scorer from its stored state, if it is the configured CYCLE_SCORER.
+    '''
+    if scorer is not None and scorer["kind"] == CYCLE_SCORER == "kde":
+      self.kde = KDECalculator.KDECalculator.from_state(scorer["state"])
+    elif scorer is not None and scorer["kind"] == CYCLE_SCORER == "mahalanobis":
+      self.multivariate = {int(label): MultivariateGaussianCalculator.MultivariateGaussianCalculator.from_state(state) for label, state in scorer["state"].items()}
+
+  def checkpoint(self) -> dict:
+    '''
+    Function to capture the detection state of the stream: the trained cycle detector, the cycle in progress (its
+    label, start timestamp and datapoints, see CycleSegmenter.state), the Gaussian moments and the cycle scorer.
+    Restoring it (see restore) continues the stream exactly where it was, without retraining.
+    '''
+    return {
+      "model" : self.cycle_detector.trained_state(),
+      "segmenter" : self.segmenter.state(),
+      "gaussian" : self.gauss.state(),
+      "scorer" : self.scorer_state(),
+      "previous_duration" : None if np.isnan(self.features.previous_duration) else float(self.features.previous_duration),
+      "cycles_scored" : self.cycles_scored
+    }
+
+  def restore(self, checkpoint: dict) -> None:
+    '''
+    Function to continue the stream from a checkpoint (see checkpoint). Replaces training: the training set is
+    released afterwards. Requires keep_history=False, as a checkpoint holds the Gaussian moments, not the history.
+    '''
+    if self.history is not None:
+      raise ValueError("A checkpoint only holds the Gaussian moments, restore requires keep_history=False")
+    self.cycle_detector.load_trained(**checkpoint["model"])
+    self.segmenter = CycleSegmenter.CycleSegmenter.from_state(checkpoint["segmenter"])
+    self.gauss = GaussianCalculator.GaussianCalculator(moments = RunningMoments.RunningMoments.from_state(checkpoint["gaussian"]))
+    self.kde = None
+    self.multivariate = None
+    self.load_scorer(checkpoint["scorer"])
+    self.features.previous_duration = np.nan if checkpoint["previous_duration"] is None else checkpoint["previous_duration"]
+    self.cycles_scored = checkpoint["cycles_scored"]
+    self.release_training()
+    self.start_refresh()
+
+  def start_refresh(self) -> None:
+    '''
+    Function to start tracking the drift of the trained cycle detector, if model_refresh is enabled.
+    '''
+    if self.model_refresh != "off":
+      self.refresh = ModelRefresh.ModelRefresh(detector = self.cycle_detector, executor = ModelRefresh.shared_executor(self.model_refresh), device = self.device)
+
+  def scorer_state(self) -> dict | None:
+    '''
+    The state of the "kde" or "mahalanobis" scorer, for the model store.
+    '''
+    if self.kde is not None:
+      return {"kind": "kde", "state": self.kde.state()}
+    if self.multivariate is not None:
+      return {"kind": "mahalanobis", "state": {str(label): calculator.state() for label, calculator in self.multivariate.items()}}
+    return None
+
+  def process_batch(self, timestamps, values) -> list:
+    '''
+    Function to score a whole received batch at once and return the anomalies raised:
+      1. Classify every datapoint as ON or OFF in a single NumPy call
+      2. Cut the batch into cycles, carrying the unfinished cycle over from the previous batch
+      3. Check each closed cycle's average power against the Gaussian (or the kernel density, or its features
+         against the multivariate Gaussian), and either raise an anomaly or update the normal operation with it
+      4. With model_refresh, track the drift of the cycle detector, and swap in the refreshed one once it is retrained
+    '''
+    with self.metrics.span("classify", device=self.device):
+      labels = self.cycle_detector.classify(values) # Outputs the cluster label of every datapoint
+    self.labels = labels
+    with self.metrics.span("segment", device=self.device):
+      cycles = self.segmenter.segment(timestamps=timestamps, values=values, labels=labels)
+    self.samples_classified.inc(len(values))
+    self.cycles_scored += len(cycles)
+    self.cycles_total.inc(len(cycles))
+    anomalies = []
+
+    # The Gaussian is updated after every normal cycle, so the verdicts are taken in order.
+    with self.metrics.span("score", device=self.device):
+      if self.multivariate is not None:
+        features = self.features.extract(cycles)
+      for k in range(len(cycles)):
+        self.cycle_lengths.observe(cycles.lengths[k])
+        average_power = cycles.means[k]
+        if self.multivariate is not None:
+          calculator = self.multivariate.get(int(cycles.labels[k]))
+          alarm = calculator is not None and calculator.is_anomalous(features[k])
+        elif self.kde is not None:
+          alarm = self.kde.is_anomalous(datapoint=average_power)
+        else:
           self.gauss.calculate_pdf(datapoint=average_power)
           alarm = self.gauss.sigma_rule(datapoint=average_power)
-          if alarm:
-            print(f"ANOMALOUS CYCLE | Average power: {average_power}")
-            data = Anomaly.Anomaly(device_label=DEVICE_LABEL, timestamp_start=self.start_timestamp, timestamp_end=timestamp, valid_anomaly=True, action_taken=False)
-            self.send(data.dict())
-          else:
-            print(f"NORMAL CYCLE | Average power: {average_power}")
-            # Call update here using self.normal_operation
-            self.update_normal_operation(self.current_power_list)
-
-          self.current_power_list = []
-          self.current_power_list.append(datapoint)
-          self.start_timestamp = timestamp
-          self.previous_cycle = self.current_cycle
-  
+        if alarm:
+          logger.debug("Anomalous cycle of %s, average power %s", self.device_label, average_power)
+          data = Anomaly.Anomaly(device_label=self.device_label, timestamp_start=to_datetime(cycles.start_timestamps[k]), timestamp_end=to_datetime(cycles.end_timestamps[k]), valid_anomaly=True, action_taken=False)
+          self.send(data.dict())
+          self.anomalies_total.inc()
+          anomalies.append(data)
+        elif self.multivariate is not None:
+          if calculator is not None:
+            calculator.push(data = features[k])
+        elif self.kde is not None:
+          self.kde.push(data = [average_power])
+        else:
+          self.update_normal_operation(cycles.cycle(k))
+    if len(cycles) and self.history is not None:
+      self.history.flush() # Only writes to disk for a memory-mapped history
+    if self.refresh is not None:
+      refreshed = self.refresh.observe(timestamps = timestamps, values = values, labels = labels, cycles = len(cycles), alarms = len(anomalies))
+      if refreshed is not None:
+        self.cycle_detector = refreshed # Between two batches: the next batch is classified by the refreshed model
+    return anomalies
+
   def receive(self):
     '''
       Function to ping endpoint and see if there is any datapoint available.
-      Endpoint to ping is in AWS S3, and it contains buffered data. 
+      Endpoint to ping is the source (by default the S3 stream bucket, which contains buffered data).
+      Returns the timestamps and power of every datapoint received since the last call, as NumPy columns.
     '''
-    return self.aws_api.get_latest_in_bucket(bucket_path=STREAM_FILE_PATH)
+    return self.source.receive()
   
   def send(self, data: dict) -> None:
-    res = requests.post(API_URL, json=data, headers={"Content-Type": "application/json", "Accept": "*/*"})
-    if res.status_code == 200:
-      print("Successfully sent anomaly notification to user backend")
-    else:
-      print(f"Failed to post request to backend user server. Status: {res.status_code}.\n{res.text}")
+    '''
+    Function to queue an anomaly notification for the user backend. Returns immediately, delivery (with retries)
+    happens on the dispatcher's thread.
+    '''
+    self.dispatcher.send(data)
   
   def update_normal_operation(self, new_data: list) -> None:
     '''
     Function to:
-      1. update self.normal_operation
-      2. update mean and stdev by calling GaussianCalculator.update
-      3. Periodically dump everything into csv file in S3 bucket
-    In order to update the normal_operation, we have to dump everything from the previous cycle into
-    the normal operation array.
-    '''
-    self.normal_operation += new_data
-    self.gauss.update(data = self.normal_operation)
-    # You have the option to prune or dump data here.
+      1. add the datapoints of the last normal cycle to the normal operation history
+      2. update mean and stdev from the moments the history keeps
+    The history is bounded (see HistoryStore): the oldest datapoints are dropped, and removed from the
+    moments, as new ones arrive, so the update is constant time and memory does not grow.
+    '''
+    self.gauss.push(data = new_data)
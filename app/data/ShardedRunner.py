@@ -0,0 +1,332 @@
+import os
+import asyncio
+import multiprocessing
+import queue
+import numpy as np
+import pandas as pd
+from collections import deque
+from time import time
+from components import CheckpointStore, HashRing, ModelStore
+from data import Orchestrator, MultiOrchestrator
+from api import AWSInterface, AnomalyDispatcher, Sources
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# General constants.
+STREAM_HOUSE_FIELD = "houseId" # Field of a stream record holding the house it comes from
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "4"))
+CHECKPOINT_EVERY = int(os.getenv("CHECKPOINT_EVERY", "50")) # Batches received between two checkpoints of every stream
+RELEASE_TIMEOUT = 60.0 # Seconds to wait for a worker to hand over a stream when rebalancing
+SPOOL_SUFFIX = ".spool.jsonl"
+RUNNER_SPOOL = "runner" # Spool of the runner, holding the undelivered anomalies of the workers that were removed
+
+def stream_key(house: str, device: str) -> str:
+  return f"{house}/{device}"
+
+def spool_path(checkpoint_dir: str, name: str) -> str:
+  return os.path.join(checkpoint_dir, f"{name}{SPOOL_SUFFIX}")
+
+def shard_worker(worker: str, inbox, outbox, device_mapping: dict, aws_factory, api_url: str, checkpoint_dir: str, store_dir: str) -> None:
+  '''
+  Worker process entry point: run the Orchestrators of the streams the runner assigns to this worker.
+
+  Messages from the runner, in order:
+    ("assign", key) - start a stream: restored from its checkpoint if there is one, trained (or loaded from the model
+                      store) otherwise.
+    ("batch", key, sequence, timestamps, values) - score the next batch of a stream. Batches already included in the
+                      checkpoint the stream was restored from are skipped, so replaying them is harmless.
+    ("release", key) - checkpoint a stream and stop running it. Answered with ("released", worker, key, sequence).
+    ("checkpoint",) - checkpoint every stream. Answered with ("checkpointed", worker, {key: sequence}).
+    ("stop",) - checkpoint every stream and exit. Answered with ("stopped", worker, {key: sequence}).
+  '''
+  aws_api = aws_factory()
+  # Every worker spools its own undelivered anomalies, delivered again if it is restarted.
+  dispatcher = AnomalyDispatcher.AnomalyDispatcher(url=api_url, spool_path=spool_path(checkpoint_dir, worker))
+  checkpoints = CheckpointStore.CheckpointStore(checkpoint_dir)
+  model_store = ModelStore.ModelStore(store_dir)
+  source = Sources.Source() # Workers never poll, the runner receives the stream for them
+  orchestrators = {}
+  sequences = {}
+
+  while True:
+    message = inbox.get()
+    kind = message[0]
+    if kind == "batch":
+      _, key, sequence, timestamps, values = message
+      if sequence <= sequences[key]:
+        continue
+      orchestrators[key].process_batch(timestamps=timestamps, values=values)
+      sequences[key] = sequence
+    elif kind == "assign":
+      key = message[1]
+      house, device = key.split("/", 1)
+      checkpoint = checkpoints.load(key)
+      if checkpoint is not None:
+        # Restored without loading the training set of the stream
+        orchestrator = Orchestrator.Orchestrator(device = device, device_mapping = device_mapping, aws_api = aws_api, device_label = key, dispatcher = dispatcher, model_store = model_store, source = source, house = house, keep_history = False, checkpoint = checkpoint["state"])
+        sequences[key] = checkpoint["sequence"]
+      else:
+        orchestrator = Orchestrator.Orchestrator(device = device, device_mapping = device_mapping, aws_api = aws_api, device_label = key, dispatcher = dispatcher, model_store = model_store, source = source, house = house, keep_history = False)
+        orchestrator.train()
+        sequences[key] = 0
+      orchestrators[key] = orchestrator
+    elif kind == "release":
+      key = message[1]
+      checkpoints.save(key, sequences[key], orchestrators.pop(key).checkpoint())
+      outbox.put(("released", worker, key, sequences.pop(key)))
+    else:
+      for key, orchestrator in orchestrators.items():
+        checkpoints.save(key, sequences[key], orchestrator.checkpoint())
+      if kind == "stop":
+        dispatcher.close()
+        outbox.put(("stopped", worker, dict(sequences)))
+        return
+      outbox.put(("checkpointed", worker, dict(sequences)))
+
+class ShardedRunner:
+  '''
+    Function to monitor the appliances of many houses, sharded over worker processes.
+
+    Every (house, device) stream is assigned to a worker with consistent hashing (see HashRing), so adding or
+    removing a worker only moves about 1 / workers of the streams. The runner receives the stream, with the house and
+    device of every record, and routes the datapoints of each stream in order, as numbered batches, to its worker.
+
+    Workers checkpoint their streams every CHECKPOINT_EVERY received batches (the cycle in progress and the Gaussian
+    moments, see Orchestrator.checkpoint). The runner keeps every batch until a checkpoint includes it, so:
+    - a worker that dies is restarted, restores its streams from their checkpoints and gets the batches since
+      replayed. Nothing is retrained and no cycle is lost, but anomalies of the replayed batches may be sent again.
+    - when the number of workers changes, a moved stream is checkpointed by its old worker and restored by its new one.
+    Every worker spools its undelivered anomalies (see AnomalyDispatcher), a restarted worker delivers them again. The
+    spool of a removed worker, or of a worker left over from a run with more workers, is taken over by the runner.
+    The runner itself only resumes from the last checkpoints: the batches it received after them are not kept on disk.
+  '''
+
+  def __init__(self, houses: list, devices: list, device_mapping: dict, workers: int = SHARD_WORKERS, source: Sources.Source = None, aws_factory = AWSInterface.AWSInterface, api_url: str = Orchestrator.API_URL, checkpoint_dir: str = CheckpointStore.CHECKPOINT_DIR, store_dir: str = ModelStore.MODEL_STORE_DIR, checkpoint_every: int = CHECKPOINT_EVERY) -> None:
+    '''
+    houses, devices - every device (renamed column) is monitored in every house.
+    source - where stream datapoints are received from, keyed by "<house>/<device>". Defaults to adaptive polling of
+      the S3 stream bucket, with the STREAM_HOUSE_FIELD and STREAM_DEVICE_FIELD of every record.
+    aws_factory - creates the AWS interface of every worker process (the training sets of its houses are loaded with it).
+    checkpoint_dir - where the stream checkpoints (and the anomaly spools of the workers) are kept.
+    '''
+    print("Initializing ShardedRunner...")
+    self.streams = [stream_key(house, device) for house in houses for device in devices]
+    self.device_mapping = device_mapping
+    self.aws_factory = aws_factory
+    self.api_url = api_url
+    self.checkpoint_dir = checkpoint_dir
+    self.store_dir = store_dir
+    self.checkpoint_every = checkpoint_every
+    self.source = source if source is not None else Sources.S3PollingSource(aws_api=aws_factory(), bucket_path=Orchestrator.STREAM_FILE_PATH, device_field=(STREAM_HOUSE_FIELD, MultiOrchestrator.STREAM_DEVICE_FIELD))
+    self.ring = HashRing.HashRing([f"worker-{index}" for index in range(workers)])
+    self.context = multiprocessing.get_context()
+    self.dispatcher = None # Delivers the anomalies spooled by removed workers, see adopt_spool
+
+    self.processes = {}
+    self.inboxes = {}
+    self.outboxes = {}
+    self.assignment = {} # Stream key to the worker running it
+    # Batches are numbered per stream, continuing from the last checkpoint so a restarted runner resumes it.
+    checkpoints = CheckpointStore.CheckpointStore(checkpoint_dir)
+    self.sequences = {}
+    for key in self.streams:
+      checkpoint = checkpoints.load(key)
+      self.sequences[key] = checkpoint["sequence"] if checkpoint is not None else 0
+    self.pending = {key: deque() for key in self.streams} # (sequence, timestamps, values) not checkpointed yet
+    self.received = 0
+    self.restarts = 0
+    self.unrouted = 0
+
+  def spawn(self, worker: str) -> None:
+    '''
+    Function to start (or restart) a worker process, with fresh queues.
+    '''
+    if worker in self.inboxes:
+      # Nobody reads the inbox of a dead worker any more: its batches are replayed from pending, so the ones still
+      # buffered must not keep the runner from exiting.
+      self.inboxes[worker].cancel_join_thread()
+    self.inboxes[worker] = self.context.Queue()
+    self.outboxes[worker] = self.context.Queue()
+    process = self.context.Process(target=shard_worker, name=worker, daemon=True, args=(worker, self.inboxes[worker], self.outboxes[worker], self.device_mapping, self.aws_factory, self.api_url, self.checkpoint_dir, self.store_dir))
+    process.start()
+    self.processes[worker] = process
+
+  def assign(self, key: str, worker: str) -> None:
+    '''
+    Function to start a stream on a worker, replaying the batches its checkpoint does not include.
+    '''
+    self.assignment[key] = worker
+    self.inboxes[worker].put(("assign", key))
+    for sequence, timestamps, values in self.pending[key]:
+      self.inboxes[worker].put(("batch", key, sequence, timestamps, values))
+
+  def adopt_spool(self, worker: str) -> None:
+    '''
+    Function to take over the undelivered anomalies of a worker that is gone for good. They are synced to the spool of
+    the runner before the spool of the worker is deleted, and delivered by the runner.
+    '''
+    adopted = self.dispatcher.adopt(spool_path(self.checkpoint_dir, worker))
+    if adopted:
+      print(f"Took over {adopted} undelivered anomalies of {worker}")
+
+  def start(self) -> None:
+    os.makedirs(self.checkpoint_dir, exist_ok=True)
+    start = time()
+    self.dispatcher = AnomalyDispatcher.AnomalyDispatcher(url=self.api_url, spool_path=spool_path(self.checkpoint_dir, RUNNER_SPOOL))
+    for name in os.listdir(self.checkpoint_dir):
+      worker = name[:-len(SPOOL_SUFFIX)]
+      if name.endswith(SPOOL_SUFFIX) and worker != RUNNER_SPOOL and worker not in self.ring.nodes:
+        self.adopt_spool(worker)
+    for worker in self.ring.nodes:
+      self.spawn(worker)
+    for key, worker in self.ring.assignment(self.streams).items():
+      self.assign(key, worker)
+    print(f"Started {len(self.processes)} workers for {len(self.streams)} streams. Time taken: {time() - start}")
+
+  def run(self) -> None:
+    self.start()
+    try:
+      asyncio.run(self.consume())
+    finally:
+      self.stop()
+
+  async def consume(self) -> None:
+    async for (timestamps, values, keys), arrived in self.source.batches():
+      self.route(timestamps = timestamps, values = values, keys = keys)
+
+  def route(self, timestamps, values, keys) -> None:
+    '''
+    Function to split a received batch by stream, preserving the order within each stream, and send every part to
+    the worker running that stream. Every checkpoint_every batches the workers are asked to checkpoint.
+    '''
+    names, inverse = np.unique(np.asarray(keys).astype(str), return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(names) + 1))
+
+    self.supervise()
+    for i, key in enumerate(names):
+      worker = self.assignment.get(key)
+      if worker is None:
+        self.unrouted += int(bounds[i + 1] - bounds[i])
+        continue
+      selected = order[bounds[i]:bounds[i + 1]]
+      self.sequences[key] += 1
+      batch = (self.sequences[key], timestamps[selected], values[selected])
+      self.pending[key].append(batch)
+      self.inboxes[worker].put(("batch", key) + batch)
+    self.received += 1
+    if self.received % self.checkpoint_every == 0:
+      for worker in self.processes:
+        self.inboxes[worker].put(("checkpoint",))
+    self.collect()
+
+  def acknowledge(self, key: str, sequence: int) -> None:
+    '''
+    Function to drop the batches of a stream included in its checkpoint.
+    '''
+    pending = self.pending[key]
+    while pending and pending[0][0] <= sequence:
+      pending.popleft()
+
+  def collect(self, worker: str = None, timeout: float = 0.0) -> list:
+    '''
+    Function to process the answers of the workers (or of one worker, waiting up to timeout for one).
+    Returns the answers.
+    '''
+    answers = []
+    for name in [worker] if worker is not None else list(self.outboxes):
+      while True:
+        try:
+          answer = self.outboxes[name].get(timeout=timeout) if timeout else self.outboxes[name].get_nowait()
+        except queue.Empty:
+          break
+        answers.append(answer)
+        if answer[0] == "released":
+          self.acknowledge(answer[2], answer[3])
+        else:
+          for key, sequence in answer[2].items():
+            self.acknowledge(key, sequence)
+        timeout = 0.0
+    return answers
+
+  def supervise(self) -> None:
+    '''
+    Function to restart the workers that died. Their streams are restored from the last checkpoints and the batches
+    received since are replayed.
+    '''
+    for worker, process in list(self.processes.items()):
+      if process.is_alive():
+        continue
+      print(f"Worker {worker} exited with code {process.exitcode}, restarting it")
+      self.restarts += 1
+      self.spawn(worker)
+      for key in [key for key, owner in self.assignment.items() if owner == worker]:
+        self.assign(key, worker)
+
+  def resize(self, workers: int) -> dict:
+    '''
+    Function to change the number of workers. Only the streams whose worker changes on the hash ring move: each is
+    checkpointed and released by its old worker, then restored on its new worker.
+    Returns the moved streams and their new workers.
+    '''
+    names = [f"worker-{index}" for index in range(workers)]
+    removed = [worker for worker in self.processes if worker not in names]
+    for worker in names:
+      if worker not in self.processes:
+        self.ring.add(worker)
+        self.spawn(worker)
+    for worker in removed:
+      self.ring.remove(worker)
+
+    moves = {key: worker for key, worker in self.ring.assignment(self.streams).items() if self.assignment[key] != worker}
+    releasing = {}
+    for key in moves:
+      releasing.setdefault(self.assignment[key], set()).add(key)
+      self.inboxes[self.assignment[key]].put(("release", key))
+    for worker, keys in releasing.items():
+      deadline = time() + RELEASE_TIMEOUT
+      # A worker that dies before answering is not waited for: its streams resume from their last checkpoints.
+      while keys and time() < deadline and self.processes[worker].is_alive():
+        keys -= {answer[2] for answer in self.collect(worker, timeout=0.1) if answer[0] == "released"}
+    for key, worker in moves.items():
+      self.assign(key, worker)
+
+    for worker in removed:
+      self.inboxes[worker].put(("stop",))
+      self.processes[worker].join(timeout=RELEASE_TIMEOUT)
+      if self.processes[worker].is_alive():
+        # Its spool is taken over below, it must not be written any more
+        self.processes[worker].terminate()
+        self.processes[worker].join()
+      self.collect(worker)
+      self.adopt_spool(worker)
+      for mapping in (self.processes, self.inboxes, self.outboxes):
+        del mapping[worker]
+    print(f"Resized to {workers} workers, {len(moves)} of {len(self.streams)} streams moved")
+    return moves
+
+  def stop(self) -> None:
+    '''
+    Function to checkpoint every stream and stop the workers.
+    '''
+    for worker in self.processes:
+      self.inboxes[worker].put(("stop",))
+    for worker, process in self.processes.items():
+      process.join(timeout=RELEASE_TIMEOUT)
+      self.collect(worker)
+    self.processes.clear()
+    if self.dispatcher is not None:
+      self.dispatcher.close()
+
+  def report(self) -> pd.DataFrame:
+    '''
+    Per worker: the streams it runs and the batches routed to them that are not checkpointed yet.
+    '''
+    rows = {worker: {"alive": process.is_alive(), "streams": 0, "pending_batches": 0} for worker, process in self.processes.items()}
+    for key, worker in self.assignment.items():
+      if worker in rows:
+        rows[worker]["streams"] += 1
+        rows[worker]["pending_batches"] += len(self.pending[key])
+    print(f"Restarts: {self.restarts}. Unrouted datapoints: {self.unrouted}")
+    return pd.DataFrame.from_dict(rows, orient="index")
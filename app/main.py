@@ -1,4 +1,6 @@
-from data import Orchestrator
+from api import StartupProfile
+import argparse
+import logging
 import warnings
 
 DEVICE_MAPPING = {
@@ -15,8 +17,76 @@ DEVICE_MAPPING = {
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Detect anomalous power cycles of appliances.')
+    parser.add_argument('--all-devices', action='store_true',
+                        help='Monitor every appliance in DEVICE_MAPPING from one process')
+    parser.add_argument('--houses', nargs='+',
+                        help='Monitor every appliance of these houses, sharded over worker processes')
+    parser.add_argument('--workers', type=int,
+                        help='Worker processes with --houses (default: SHARD_WORKERS)')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Expose Prometheus metrics on this port')
+    parser.add_argument('--metrics-file', type=str,
+                        help='Periodically write Prometheus metrics to this file')
+    parser.add_argument('--trace-spans', action='store_true',
+                        help='Also record the time spent in each pipeline stage')
+    parser.add_argument('--source', choices=['s3', 'directory', 'socket'], default='s3',
+                        help='Where stream datapoints are received from (default: adaptive polling of the S3 stream bucket)')
+    parser.add_argument('--watch-dir', type=str,
+                        help='Directory of JSON lines files to tail with --source directory')
+    parser.add_argument('--socket-port', type=int, default=8765,
+                        help='Local port producers push JSON lines to with --source socket')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Start up and train, report the time and heavy imports of every startup stage, and exit')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='WARNING',
+                        help='Level of the log messages, DEBUG logs every anomalous cycle and every failed delivery attempt')
+    args = parser.parse_args()
+    if args.profile_startup and args.houses:
+        parser.error('--profile-startup profiles a single process, it cannot be used with --houses')
+
     print("Starting...")
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     warnings.filterwarnings(action='ignore')
+    StartupProfile.startup.mark("interpreter and arguments")
+
+    # Only the modules of the selected mode are imported. Heavier dependencies (boto3, pandas, sklearn) are imported
+    # by the stages that need them, see --profile-startup.
+    from api import Metrics, Sources
+    from data import Orchestrator
+    if args.houses:
+        from data import MultiOrchestrator, ShardedRunner
+    elif args.all_devices:
+        from data import MultiOrchestrator
+    StartupProfile.startup.mark("imports")
+
+    if args.metrics_port is not None or args.metrics_file is not None or args.trace_spans:
+        Metrics.registry.enable(tracing=args.trace_spans)
+    if args.metrics_port is not None:
+        Metrics.registry.serve(args.metrics_port)
+    if args.metrics_file is not None:
+        Metrics.registry.export_to_file(args.metrics_file)
     
-    orchestrator = Orchestrator.Orchestrator(device = "Fridge", device_mapping=DEVICE_MAPPING)
-    orchestrator.run()
+    device_field = MultiOrchestrator.STREAM_DEVICE_FIELD if args.all_devices else None
+    if args.houses:
+        device_field = (ShardedRunner.STREAM_HOUSE_FIELD, MultiOrchestrator.STREAM_DEVICE_FIELD)
+    source = None # The orchestrators poll the S3 stream bucket by default
+    if args.source == 'directory':
+        if args.watch_dir is None:
+            parser.error('--source directory requires --watch-dir')
+        source = Sources.DirectorySource(path=args.watch_dir, device_field=device_field)
+    elif args.source == 'socket':
+        source = Sources.SocketSource(port=args.socket_port, device_field=device_field)
+
+    if args.houses:
+        orchestrator = ShardedRunner.ShardedRunner(houses=args.houses, devices=list(DEVICE_MAPPING.values()), device_mapping=DEVICE_MAPPING, workers=args.workers if args.workers is not None else ShardedRunner.SHARD_WORKERS, source=source)
+    elif args.all_devices:
+        orchestrator = MultiOrchestrator.MultiOrchestrator(device_mapping=DEVICE_MAPPING, source=source)
+    else:
+        orchestrator = Orchestrator.Orchestrator(device = "Fridge", device_mapping=DEVICE_MAPPING, source=source)
+
+    if args.profile_startup:
+        orchestrator.train()
+        print(StartupProfile.startup.report())
+        orchestrator.dispatcher.close(timeout=1.0)
+    else:
+        orchestrator.run()
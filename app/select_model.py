@@ -0,0 +1,38 @@
+from data import ModelSelection
+from components import CycleDetection
+import argparse
+import warnings
+
+'''
+Cross validated selection of the cycle detection model on a labelled CSV.
+
+Example, from the app directory:
+    python select_model.py House_1_labelled.csv --column Fridge --labels "Power Cycle" --models knn gmm --clusters 2 3
+'''
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Select the cycle detection model with cross validation.')
+    parser.add_argument('file', type=str,
+                        help='CSV with a power column and its ON/OFF ground truth')
+    parser.add_argument('--column', type=str, required=True,
+                        help='Power column')
+    parser.add_argument('--labels', type=str, default='Power Cycle',
+                        help='Ground truth column, 1/0 or ON/OFF')
+    parser.add_argument('--models', type=str, nargs='+', default=list(CycleDetection.MODELS),
+                        help='Models to evaluate')
+    parser.add_argument('--clusters', type=int, nargs='+', default=list(ModelSelection.CLUSTER_COUNTS),
+                        help='Numbers of clusters to evaluate')
+    parser.add_argument('--covariance-types', type=str, nargs='+', default=list(ModelSelection.COVARIANCE_TYPES),
+                        help='Covariance types to evaluate with the gmm model')
+    parser.add_argument('--folds', type=int, default=ModelSelection.SELECTION_FOLDS,
+                        help='Cross validation folds')
+    parser.add_argument('--chunksize', type=int, default=ModelSelection.SELECTION_CHUNKSIZE,
+                        help='CSV rows read at a time')
+    parser.add_argument('--workers', type=int,
+                        help='Size of the process pool (default: the number of CPUs)')
+    args = parser.parse_args()
+
+    warnings.filterwarnings(action='ignore')
+
+    selection = ModelSelection.ModelSelection.from_csv(args.file, column=args.column, label_column=args.labels, chunksize=args.chunksize, models=args.models, cluster_counts=args.clusters, covariance_types=args.covariance_types, folds=args.folds, max_workers=args.workers)
+    print(selection.run().to_string(index=False))
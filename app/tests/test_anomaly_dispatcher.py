@@ -0,0 +1,71 @@
+'''
+Delivery of the AnomalyDispatcher against the local stand-in backend: retries, requeue after an outage and replay of
+the spool after a restart. Every anomaly must be delivered exactly once.
+
+Run from the app directory:
+    python -m pytest tests
+'''
+import os
+import tempfile
+import unittest
+from collections import Counter
+from time import sleep, time
+from api.AnomalyDispatcher import AnomalyDispatcher
+from benchmarks.stand_ins import StandInBackend
+
+def wait_for(condition, timeout: float = 10.0) -> bool:
+    deadline = time() + timeout
+    while not condition() and time() < deadline:
+        sleep(0.01)
+    return condition()
+
+class AnomalyDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spool_path = os.path.join(self.directory.name, "spool.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertDeliveredOnce(self, backend: StandInBackend, n: int) -> None:
+        received = Counter(payload["n"] for payload in backend.received)
+        self.assertEqual(received, Counter(range(n)))
+
+    def outage(self, batch: bool) -> None:
+        with StandInBackend(failure_rate=1.0) as backend:
+            dispatcher = AnomalyDispatcher(url=backend.url, batch_url=backend.batch_url if batch else None, max_retries=1, backoff=0.01, requeue_delay=0.05, max_requeue_delay=0.1, spool_path=self.spool_path)
+            for n in range(20):
+                dispatcher.send({"n": n})
+            self.assertTrue(wait_for(lambda: dispatcher.requeued >= 20))
+            self.assertEqual(len(backend.received), 0)
+            backend.failure_rate = 0.0
+            self.assertTrue(wait_for(lambda: dispatcher.delivered == 20))
+            dispatcher.close()
+            self.assertDeliveredOnce(backend, 20)
+        # Every payload was acknowledged, so nothing is delivered again after a restart.
+        restarted = AnomalyDispatcher(url=backend.url, spool_path=self.spool_path)
+        self.assertEqual(restarted.queue.qsize(), 0)
+        restarted.close()
+
+    def test_outage_then_recovery(self):
+        self.outage(batch=False)
+
+    def test_outage_then_recovery_batch_endpoint(self):
+        self.outage(batch=True)
+
+    def test_spool_replayed_after_restart(self):
+        with StandInBackend(failure_rate=1.0) as backend:
+            dispatcher = AnomalyDispatcher(url=backend.url, max_retries=0, backoff=0.01, requeue_delay=60.0, spool_path=self.spool_path)
+            for n in range(10):
+                dispatcher.send({"n": n})
+            self.assertTrue(wait_for(lambda: dispatcher.requeued >= 10))
+            dispatcher.close(timeout=0.1)
+        with StandInBackend() as backend:
+            dispatcher = AnomalyDispatcher(url=backend.url, spool_path=self.spool_path)
+            self.assertTrue(wait_for(lambda: dispatcher.delivered == 10))
+            dispatcher.close()
+            self.assertDeliveredOnce(backend, 10)
+
+if __name__ == "__main__":
+    unittest.main()